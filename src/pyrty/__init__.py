@@ -12,8 +12,19 @@ finally:
 # _logger = logging.getLogger(__name__)
 
 from pyrty.pyr_env import PyREnv
+from pyrty.fusion import fuse
+from pyrty.pipeline import Pipeline
+from pyrty.pool import WorkerPool
 from pyrty.pyr_func import PyRFunc
 from pyrty.pyr_script import PyRScript
+from pyrty.refs import DatasetRef, FileRef
 from pyrty.registry import DBManager, RegistryManager, unregister_pyrty_func
+from pyrty.results import LazyResult, SinkResult
+from pyrty.server import DaemonClient, PyRDaemon
+from pyrty.store import ObjectRef, ObjectStore, put
+from pyrty.workers import Session
 
-__all__ = ['PyREnv', 'PyRScript', 'PyRFunc', 'DBManager', 'RegistryManager', 'unregister_pyrty_func']
\ No newline at end of file
+__all__ = ['PyREnv', 'PyRScript', 'PyRFunc', 'Pipeline', 'fuse', 'FileRef',
+           'DatasetRef', 'LazyResult', 'SinkResult', 'ObjectRef', 'ObjectStore', 'put',
+           'Session', 'WorkerPool', 'PyRDaemon', 'DaemonClient', 'DBManager',
+           'RegistryManager', 'unregister_pyrty_func']
\ No newline at end of file
@@ -0,0 +1,114 @@
+import os
+import sys
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional
+
+import pandas as pd
+
+_BLOCK_SIZE = 512  # Unit of `ru_inblock` and `ru_oublock`
+# `ru_maxrss` is in bytes on macOS, KiB elsewhere
+_MAXRSS_UNIT = 1 if sys.platform == 'darwin' else 1024
+
+
+@dataclass
+class CallMetadata:
+    """Resources used by one call of a function.
+
+    CPU times, peak RSS and block I/O are those of the call's process and of the
+    processes it waited for, from `wait4`. They stay `None` when the call had no
+    local child process to account for (batch jobs, in-process backends, daemon
+    calls). `bytes_in` and `bytes_out` count the data pyrty serialized for the
+    script and read back from it. `phases` splits `duration` into the time spent
+    preparing inputs, executing the script and post-processing its result.
+    `memory` is the result's `pyrty.results.MemoryReport` when it was materialized.
+    """
+
+    alias: str = ''
+    duration: float = 0.0  # Wall-clock seconds
+    user_time: Optional[float] = None  # CPU seconds
+    sys_time: Optional[float] = None
+    max_rss: Optional[int] = None  # Bytes
+    read_bytes: Optional[int] = None  # From the block device, not the page cache
+    write_bytes: Optional[int] = None
+    bytes_in: int = 0
+    bytes_out: int = 0
+    returncode: Optional[int] = None
+    phases: Dict[str, float] = field(default_factory=dict)
+    memory: Any = None
+
+    @property
+    def cpu_time(self) -> Optional[float]:
+        if self.user_time is None:
+            return None
+        return self.user_time + self.sys_time
+
+    def add_rusage(self, rusage, returncode: Optional[int] = None) -> None:
+        """Adds the usage of a child process, as returned by `wait_with_rusage`."""
+        if rusage is not None:
+            self.user_time = (self.user_time or 0.0) + rusage.ru_utime
+            self.sys_time = (self.sys_time or 0.0) + rusage.ru_stime
+            self.max_rss = max(self.max_rss or 0, rusage.ru_maxrss * _MAXRSS_UNIT)
+            self.read_bytes = (self.read_bytes or 0) + rusage.ru_inblock * _BLOCK_SIZE
+            self.write_bytes = (self.write_bytes or 0) + rusage.ru_oublock * _BLOCK_SIZE
+        if returncode is not None:
+            self.returncode = returncode
+
+
+def wait_with_rusage(proc):
+    """Waits for `proc` (a `Popen`) and returns its resource usage, if available."""
+    if not hasattr(os, 'wait4'):
+        proc.wait()
+        return None
+    try:
+        __, status, rusage = os.wait4(proc.pid, 0)
+    except ChildProcessError:  # Already reaped
+        proc.wait()
+        return None
+    if os.WIFEXITED(status):
+        proc.returncode = os.WEXITSTATUS(status)
+    else:
+        proc.returncode = -os.WTERMSIG(status)
+    return rusage
+
+
+class UsageLog:
+    """Totals of `CallMetadata` per alias, over the calls made in this process."""
+
+    _summed = ('duration', 'user_time', 'sys_time', 'read_bytes', 'write_bytes',
+               'bytes_in', 'bytes_out')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._totals: Dict[str, Dict[str, Any]] = {}
+
+    def record(self, metadata: CallMetadata, failed: bool = False) -> None:
+        with self._lock:
+            totals = self._totals.setdefault(metadata.alias, dict(
+                calls=0, failures=0, max_rss=0, **dict.fromkeys(self._summed, 0)))
+            totals['calls'] += 1
+            totals['failures'] += failed
+            totals['max_rss'] = max(totals['max_rss'], metadata.max_rss or 0)
+            for name in self._summed:
+                totals[name] += getattr(metadata, name) or 0
+
+    def totals(self, alias: str) -> Dict[str, Any]:
+        """Totals for `alias`, with `max_rss` the largest peak of any call."""
+        with self._lock:
+            return dict(self._totals.get(alias, {}))
+
+    def summary(self) -> pd.DataFrame:
+        """Totals per alias, with the mean duration and CPU time of a call."""
+        with self._lock:
+            df = pd.DataFrame.from_dict(self._totals, orient='index')
+        if not df.empty:
+            df['mean_duration'] = df.duration / df.calls
+            df['mean_cpu_time'] = (df.user_time + df.sys_time) / df.calls
+        return df
+
+    def reset(self) -> None:
+        with self._lock:
+            self._totals.clear()
+
+
+usage_log = UsageLog()
@@ -0,0 +1,201 @@
+"""Benchmarks comparing ways of running the same `PyRFunc`.
+
+Example:
+    python -m pyrty.bench my_func --n 50 --executors local embedded
+    python -m pyrty.bench my_r_func --n 20 --blas openblas mkl
+    python -m pyrty.bench my_r_func --n 20 --csv-engines readr data.table
+"""
+import argparse
+import copy
+import logging
+import time
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+from pyrty.run_manager import fetch_executor
+from pyrty.script_writers.rscript import CSV_ENGINES
+
+_logger = logging.getLogger(__name__)
+
+
+def time_calls(fn: Callable[[], object], n: int = 10, warmup: int = 1) -> List[float]:
+    """Wall-clock seconds of `n` calls to `fn`, after `warmup` untimed calls."""
+    for __ in range(warmup):
+        fn()
+    timings = []
+    for __ in range(n):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def summarize(timings: Dict[str, Sequence[float]]) -> pd.DataFrame:
+    """One row of latency statistics (in seconds) per label."""
+    rows = {}
+    for label, values in timings.items():
+        values = np.asarray(values)
+        rows[label] = dict(n=len(values), min=values.min(), median=np.median(values),
+                           mean=values.mean(), p95=np.percentile(values, 95))
+    return pd.DataFrame.from_dict(rows, orient='index')
+
+
+def compare_executors(
+    func,
+    input: Optional[Dict] = None,
+    executors: Sequence[str] = ('local', 'embedded'),
+    n: int = 10,
+    warmup: int = 1,
+) -> pd.DataFrame:
+    """Times `func(input)` on each executor (see `pyrty.executors._executors`).
+
+    Executors that cannot run `func` themselves and fall back to another one are
+    labelled `'<name> (fallback)'`.
+    """
+    original = func.run_manager.executor
+    timings = {}
+    try:
+        for name in executors:
+            executor = fetch_executor(name)()
+            label = name
+            if (hasattr(executor, 'fallback')
+                    and not executor.supports(func.run_manager)):
+                label = f'{name} (fallback)'
+            func.run_manager.executor = executor
+            _logger.info(f'Timing {func.alias} on {label}.')
+            timings[label] = time_calls(lambda: func(input), n=n, warmup=warmup)
+            executor.shutdown()
+    finally:
+        func.run_manager.executor = original
+    return summarize(timings)
+
+
+def _run_manager_for(func, script, env=None):
+    """Run manager for a copy of `func`'s script, resolving its interpreter in `env`."""
+    from pyrty.run_manager import RunManager
+
+    script.script_writer._exe = type(script.script_writer)._exe
+    return RunManager(env or func.env, script, func.run_manager.skip_lines_output,
+                      func.run_manager.resources)
+
+
+def blas_env(func, variant: str, create: bool = True):
+    """Copy of `func`'s (conda or mamba) environment pinning BLAS variant `variant`.
+
+    The copy is created next to the original, at `<prefix>-<variant>`, unless it
+    exists already. Only the packages explicitly installed in the original are
+    carried over, unpinned as they were asked for, so the solver is free to pick
+    builds that link against the variant.
+    """
+    from pyrty.env_managers.conda import CondaEnv
+    from pyrty.pyr_env import PyREnv
+
+    prefix = Path(func.env.prefix)
+    spec = CondaEnv.from_prefix(prefix, from_history=True).with_blas(variant)
+    envfile = prefix.parent / f'{prefix.name}-{variant}.yaml'
+    spec.write(envfile)
+    name = f'{prefix.name}-{variant}'
+    env = PyREnv(func.env.manager, dict(prefix=prefix.parent / name, envfile=envfile,
+                                        name=name))
+    if create and not env.env_exists:
+        _logger.info(f'Creating {env.prefix} with BLAS {variant}.')
+        env.create_env()
+    return env
+
+
+def compare_blas(
+    func,
+    variants: Sequence[str] = ('openblas', 'mkl'),
+    input: Optional[Dict] = None,
+    n: int = 10,
+    warmup: int = 1,
+) -> pd.DataFrame:
+    """Times `func(input)` with each BLAS implementation (see `blas_env`).
+
+    The function's script runs unchanged in a copy of its environment per variant,
+    so only the linear algebra backend differs. Mostly of interest for R functions
+    doing matrix work, where the reference BLAS can be orders of magnitude slower.
+    """
+    timings = {}
+    for variant in variants:
+        env = blas_env(func, variant)
+        run_manager = _run_manager_for(func, copy.deepcopy(func.script), env)
+        _logger.info(f'Timing {func.alias} with BLAS {variant}.')
+        timings[variant] = time_calls(lambda: run_manager.run(input or {}), n=n,
+                                      warmup=warmup)
+    return summarize(timings)
+
+
+def compare_csv_engines(
+    func,
+    input: Optional[Dict] = None,
+    engines: Sequence[str] = ('readr', 'data.table'),
+    n: int = 10,
+    warmup: int = 1,
+) -> pd.DataFrame:
+    """Times the R function `func(input)` reading and writing CSV with each engine.
+
+    A copy of the script is written per engine (see `RScriptWriter.csv_engine`); the
+    env must have the engines' packages installed. Results go through stdout, as
+    they do by default. `readr` is not loaded for the other engines, so their timings
+    don't include its startup.
+    """
+    if func.script.lang != 'R':
+        raise ValueError(f'{func.alias} is not an R function.')
+    unknown = set(engines) - set(CSV_ENGINES)
+    if unknown:
+        raise ValueError(f'CSV engines {sorted(unknown)} are not supported; '
+                         f'use some of {", ".join(CSV_ENGINES)}.')
+    timings = {}
+    with TemporaryDirectory(prefix='pyrty-bench-') as tmpdirname:
+        for engine in engines:
+            script = copy.deepcopy(func.script)
+            writer = script.script_writer
+            writer.csv_engine = engine
+            if engine != 'readr':
+                writer.libs = [lib for lib in writer.libs if lib != 'readr']
+            writer.path = Path(tmpdirname) / f'{func.alias}-{engine}.R'
+            writer.versioned = False
+            script.create_script()
+            run_manager = _run_manager_for(func, script)
+            _logger.info(f'Timing {func.alias} with CSV engine {engine}.')
+            timings[engine] = time_calls(lambda: run_manager.run(input or {}), n=n,
+                                         warmup=warmup)
+    return summarize(timings)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    from pyrty.pyr_func import PyRFunc
+
+    parser = argparse.ArgumentParser(
+        description='Compare executors on a registered function.')
+    parser.add_argument('alias', help='Registered function, called without arguments.')
+    parser.add_argument('--n', type=int, default=10, help='Timed calls per executor.')
+    parser.add_argument('--warmup', type=int, default=1,
+                        help='Untimed calls per executor.')
+    parser.add_argument('--executors', nargs='+', default=['local', 'embedded'])
+    parser.add_argument('--blas', nargs='+', metavar='VARIANT',
+                        help='Compare these BLAS implementations instead of executors.')
+    parser.add_argument('--csv-engines', nargs='+', metavar='ENGINE',
+                        help='Compare these CSV engines of an R function instead of '
+                             'executors.')
+    args = parser.parse_args(argv)
+
+    func = PyRFunc.from_registry(args.alias)
+    if args.blas:
+        df = compare_blas(func, args.blas, n=args.n, warmup=args.warmup)
+    elif args.csv_engines:
+        df = compare_csv_engines(func, engines=args.csv_engines, n=args.n,
+                                 warmup=args.warmup)
+    else:
+        df = compare_executors(func, executors=args.executors, n=args.n,
+                               warmup=args.warmup)
+    print(df.to_string())
+
+
+if __name__ == '__main__':
+    main()
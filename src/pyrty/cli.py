@@ -0,0 +1,96 @@
+"""Command-line interface, installed as `pyrty`.
+
+Example:
+    pyrty serve --alias my_func other_func
+    pyrty stats my_func --window 1h --since 7d
+    pyrty loadtest --local shell --concurrency 1 4 --duration 10
+"""
+import argparse
+import logging
+from typing import List, Optional
+
+
+def serve(args: argparse.Namespace) -> None:
+    from pyrty.server import PyRDaemon
+
+    pool = None
+    if args.max_workers is not None:
+        pool = dict(min_workers=args.min_workers, max_workers=args.max_workers,
+                    max_calls=args.max_calls, max_rss=args.max_rss,
+                    memory_budget=args.memory_budget)
+    daemon = PyRDaemon(args.socket, aliases=args.alias, fork=not args.no_fork,
+                       pool=pool)
+    daemon.serve_forever()
+
+
+def stats(args: argparse.Namespace) -> None:
+    from pyrty.registry import DBManager, RegistryManager
+
+    db_manager = DBManager(db_dir=RegistryManager().pyrty_dir)
+    df = db_manager.stats(args.alias, window=args.window, since=args.since,
+                          by_version=args.by_version)
+    print(df.to_string() if not df.empty else f'No calls to {args.alias} are recorded.')
+
+
+def loadtest(args: argparse.Namespace) -> None:
+    from pyrty.loadtest import main as loadtest_main
+
+    loadtest_main(args.args)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(prog='pyrty')
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help='Log at INFO level.')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    serve_parser = commands.add_parser(
+        'serve', help='Serve registered functions on a Unix socket.')
+    serve_parser.add_argument('--socket', help='Socket path (default: $PYRTY_SOCKET or '
+                                               'pyrty.sock in the pyrty directory).')
+    serve_parser.add_argument('--alias', nargs='*', default=[],
+                              help='Functions to warm up at start-up.')
+    serve_parser.add_argument('--no-fork', action='store_true',
+                              help='Call functions in the daemon instead of from '
+                                   'fork-servers.')
+    pool_args = serve_parser.add_argument_group(
+        'worker pools',
+        'Serve functions from autoscaling worker pools (enabled by --max-workers).')
+    pool_args.add_argument('--max-workers', type=int,
+                           help='Upper bound on workers per function.')
+    pool_args.add_argument('--min-workers', type=int, default=1,
+                           help='Workers kept per function.')
+    pool_args.add_argument('--max-calls', type=int,
+                           help='Calls after which a worker is recycled.')
+    pool_args.add_argument('--max-rss',
+                           help='RSS after which a worker is recycled, e.g. 2G.')
+    pool_args.add_argument('--memory-budget',
+                           help='Bound on the total RSS of a function\'s workers.')
+    serve_parser.set_defaults(handler=serve)
+
+    stats_parser = commands.add_parser(
+        'stats', help='Latency percentiles and throughput of a function.')
+    stats_parser.add_argument('alias')
+    stats_parser.add_argument('--window',
+                              help='Summarize time windows of this length, e.g. 1h.')
+    stats_parser.add_argument('--since',
+                              help='Only calls from the last period, e.g. 7d.')
+    stats_parser.add_argument('--by-version', action='store_true',
+                              help='Summarize each script version.')
+    stats_parser.set_defaults(handler=stats)
+
+    loadtest_parser = commands.add_parser(
+        'loadtest', add_help=False,
+        help='Load-test a function; see `pyrty loadtest --help`.')
+    loadtest_parser.set_defaults(handler=loadtest)
+
+    # The arguments of `loadtest` are parsed by `pyrty.loadtest.main`
+    args, args.args = parser.parse_known_args(argv)
+    if args.args and args.command != 'loadtest':
+        parser.error(f'unrecognized arguments: {" ".join(args.args)}')
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+    args.handler(args)
+
+
+if __name__ == '__main__':
+    main()
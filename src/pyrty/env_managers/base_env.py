@@ -13,6 +13,12 @@ class BaseEnvManager(ABC):
     def get_run_cmd(self, cmd: str) -> str:
         return self.run_cmd_template.format(cmd=cmd)
 
+    def find_exe(self, name: str) -> str:
+        """Path of executable `name` inside the environment."""
+        ret = subprocess.run(self.get_run_cmd(f'which {name}').split(' '),
+                             capture_output=True)
+        return ret.stdout.decode('utf-8').replace('\n', '')
+
     def create(self) -> None:
         subprocess.run([SHELL_EXE, str(self.deploy_script_path)], check=True)
         if self.postdeploy_script_path.exists():
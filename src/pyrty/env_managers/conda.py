@@ -1,14 +1,21 @@
+import ast
+import json
 import logging
+import re
 import shutil
 import subprocess
 from dataclasses import dataclass, field
 from pathlib import Path
+from typing import Optional
 
 import yaml
 
 from pyrty.env_managers.base_env import BaseEnvManager
 from pyrty.env_managers.utils import (
+    BLAS_PACKAGES,
+    BLAS_VARIANTS,
     DEFAULT_CHANNELS,
+    blas_dependency,
     default_env_name,
     default_env_prefix,
     write_conda_deploy_script,
@@ -16,6 +23,10 @@ from pyrty.env_managers.utils import (
 
 _logger = logging.getLogger(__name__)
 
+# Parsed `conda-meta` records per prefix, keyed by the directory's mtime
+_conda_meta_cache = {}
+_subdir_os = ('linux', 'osx', 'win')
+
 
 @dataclass
 class CondaEnv:
@@ -76,6 +87,96 @@ class CondaEnv:
         subprocess.run(f'{str(exe)} run -p {str(prefix)} {str(exe)} env export > {str(path)}', shell=True, check=True)
         return cls.from_yaml(path)
 
+    @classmethod
+    def from_prefix(cls, prefix: Path, from_history: bool = False):
+        """Create a CondaEnv instance from the package records of an existing Conda env.
+
+        Reads `<prefix>/conda-meta/*.json` directly instead of shelling out to
+        `conda env export`. Results are cached until the directory's mtime changes,
+        which happens whenever packages are installed or removed.
+
+        Args:
+            prefix (str): The path of the Conda env.
+            from_history (bool): Only list the specs that were explicitly asked for,
+                as recorded in `conda-meta/history`, instead of every installed
+                package pinned to its build (like `conda env export --from-history`).
+
+        Returns:
+            CondaEnv: The created CondaEnv instance.
+        """
+        meta_dir = Path(prefix) / 'conda-meta'
+        mtime = meta_dir.stat().st_mtime_ns
+        cached = _conda_meta_cache.get((str(prefix), from_history))
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+
+        dependencies, channels = [], []
+        for record_path in sorted(meta_dir.glob('*.json')):
+            record = json.loads(record_path.read_text())
+            spec = f"{record['name']}={record['version']}={record['build']}"
+            dependencies.append(spec)
+            channel = _channel_name(record.get('channel', ''))
+            if channel and channel not in channels:
+                channels.append(channel)
+
+        if from_history:
+            dependencies = _requested_specs(meta_dir / 'history')
+        env = cls(Path(prefix).name, dependencies, channels)
+        _conda_meta_cache[(str(prefix), from_history)] = (mtime, env)
+        return env
+
+    @property
+    def packages(self) -> dict:
+        """Mapping of package names to versions (`None` when unpinned).
+
+        Returns:
+            dict: Package versions by name.
+        """
+        packages = {}
+        for dep in self.dependencies:
+            if isinstance(dep, str):
+                name, __, version = dep.partition('=')
+                packages[name] = version.split('=')[0] or None
+        return packages
+
+    @property
+    def blas(self) -> Optional[str]:
+        """BLAS implementation pinned (or installed) in the environment, if any.
+
+        Returns:
+            str: One of `BLAS_VARIANTS`, read from the build string of `libblas`.
+        """
+        for dep in self.dependencies:
+            if (isinstance(dep, str) and _package_name(dep) == 'libblas'
+                    and dep.count('=') >= 2):
+                build = dep.rsplit('=', 1)[1]
+                for variant in BLAS_VARIANTS:
+                    if build.endswith(variant):
+                        return variant
+        return None
+
+    def with_blas(self, variant: str) -> 'CondaEnv':
+        """Copy of the environment pinning BLAS implementation `variant`.
+
+        Any BLAS and LAPACK packages in the dependencies are dropped, so the solver
+        picks those matching the variant. The variants are conda-forge builds, so
+        `conda-forge` is added to the channels if needed.
+
+        Args:
+            variant (str): One of `BLAS_VARIANTS`, e.g. `'openblas'` or `'mkl'`.
+
+        Returns:
+            CondaEnv: The pinned copy.
+        """
+        dependencies = [
+            dep for dep in self.dependencies
+            if not (isinstance(dep, str) and _package_name(dep) in BLAS_PACKAGES)]
+        dependencies.append(blas_dependency(variant))
+        channels = list(self.channels)
+        if 'conda-forge' not in channels:
+            channels.append('conda-forge')
+        return CondaEnv(self.name, dependencies, channels)
+
     @property
     def r_packages(self) -> list:
         """List of R packages (including CRAN and Bioconductor) in the environment.
@@ -104,6 +205,37 @@ class CondaEnv:
         return [dep for dep in self.dependencies if dep.startswith('bioconductor-')]
 
 
+def _package_name(dep: str) -> str:
+    """Package name of a dependency spec such as `libblas=*=*mkl` or `r-base >=4.2`."""
+    return re.split(r'[\s=<>!~]', dep.strip(), maxsplit=1)[0]
+
+
+def _requested_specs(history: Path) -> list:
+    """Specs explicitly installed and not removed since, from a `conda-meta/history`."""
+    specs = {}
+    for line in history.read_text().splitlines():
+        match = re.match(r'#\s*(update|remove) specs:\s*(\[.*\])\s*$', line)
+        if not match:
+            continue
+        for spec in ast.literal_eval(match.group(2)):
+            if match.group(1) == 'update':
+                specs[_package_name(spec)] = spec
+            else:
+                specs.pop(_package_name(spec), None)
+    return list(specs.values())
+
+
+def _channel_name(url: str) -> str:
+    """Channel name from a `conda-meta` channel URL, as `conda env export` shows it."""
+    parts = [part for part in url.split('/') if part]
+    if parts and (parts[-1] == 'noarch'
+                  or '-' in parts[-1] and parts[-1].split('-')[0] in _subdir_os):
+        parts = parts[:-1]
+    if 'repo.anaconda.com' in url:
+        return 'defaults'
+    return parts[-1] if parts else ''
+
+
 class CondaEnvManager(BaseEnvManager):
     def __init__(
         self,
@@ -114,7 +246,10 @@ class CondaEnvManager(BaseEnvManager):
         dependencies: list = None,
         channels: list = None,
         postdeploy_cmds: list[str] = None,
+        blas: str = None,
     ):
+        if blas is not None:
+            blas_dependency(blas)  # Validates the variant
         self._exe = exe if exe else shutil.which("conda")
         self._prefix = prefix
         self.envfile = envfile
@@ -122,6 +257,7 @@ class CondaEnvManager(BaseEnvManager):
         self._dependencies = dependencies
         self.channels = channels or DEFAULT_CHANNELS
         self.postdeploy_cmds = postdeploy_cmds
+        self.blas = blas
 
     def create(self):
         # Overwrite
@@ -142,7 +278,12 @@ class CondaEnvManager(BaseEnvManager):
         self._prefix = prefix # May be None
         if self.exists:
             _logger.info(f"Environment exists at {self.prefix}.")
-            self._env = CondaEnv.from_existing(self.exe, self.prefix, self.envfile)
+            self._env = CondaEnv.from_prefix(self.prefix)
+            self._env.write(self.envfile)
+            if self.blas and self._env.blas != self.blas:
+                _logger.warning(f"Environment {self.prefix} uses BLAS "
+                                f"{self._env.blas}, not {self.blas}; remove it to "
+                                f"recreate it with {self.blas}.")
 
         else:
             if not self.prefix: # Now must be provided or generated
@@ -161,12 +302,20 @@ class CondaEnvManager(BaseEnvManager):
             if self.envfile.exists():
                 _logger.info(f"Environment file {self.envfile} exists.")
                 self._env = CondaEnv.from_yaml(self.envfile)
+                if self.blas:
+                    # Pinned in a copy, leaving the given file as it is
+                    self._env = self._env.with_blas(self.blas)
+                    self.envfile = self.envfile.with_name(
+                        f"{self.envfile.stem}.{self.blas}{self.envfile.suffix}")
+                    self._env.write(self.envfile)
 
             # -- When environment dependencies are provided ...
             elif name and dependencies:
                 name_ = default_env_name(name)
                 _logger.info(f"Creating environment {name_} with dependencies {dependencies}.")
                 self._env = CondaEnv(name_, dependencies, channels)
+                if self.blas:
+                    self._env = self._env.with_blas(self.blas)
                 self._env.write(self.envfile)
             
             # -- Else ...
@@ -183,6 +332,12 @@ class CondaEnvManager(BaseEnvManager):
     #     if dependency not in self.dependencies:
     #         self.dependencies.append(dependency)
 
+    def find_exe(self, name: str) -> str:
+        exe = Path(self.prefix) / 'bin' / name
+        if exe.is_file():
+            return str(exe)
+        return super().find_exe(name)
+
     @property
     def deploy_script_path(self) -> Path:
         return Path(self.prefix).parent / f"{self.name}.deploy.sh"
@@ -200,6 +355,19 @@ class CondaEnvManager(BaseEnvManager):
     def env(self):
         return self._env
 
+    @property
+    def exists(self) -> bool:
+        """Whether the prefix holds a valid Conda env (not just a directory)."""
+        history = Path(self.prefix) / 'conda-meta' / 'history' if self.prefix else None
+        return history is not None and history.is_file()
+
+    @property
+    def installed_packages(self) -> dict:
+        """Versions of the packages installed in the env, read from `conda-meta`."""
+        if not self.exists:
+            raise FileNotFoundError(f'Environment {self.prefix} does not exist.')
+        return CondaEnv.from_prefix(self.prefix).packages
+
     @property
     def name(self):
         return self._name
@@ -241,7 +409,8 @@ class MambaEnvManager(CondaEnvManager):
         dependencies: list = None,
         channels: list = None,
         postdeploy_cmds: list[str] = None,
+        blas: str = None,
     ):
         super().__init__(exe=exe or shutil.which("mamba"), prefix=prefix,
                          envfile=envfile, name=name, dependencies=dependencies,
-                         channels=channels, postdeploy_cmds=postdeploy_cmds)
\ No newline at end of file
+                         channels=channels, postdeploy_cmds=postdeploy_cmds, blas=blas)
\ No newline at end of file
@@ -7,6 +7,12 @@ _reg_manager = RegistryManager()
 
 DEFAULT_CHANNELS = ['defaults', 'conda-forge']
 
+# Implementations conda-forge's `libblas` can be switched to, by build string
+BLAS_VARIANTS = ('openblas', 'mkl', 'blis', 'netlib', 'accelerate')
+# Packages providing or selecting BLAS/LAPACK, dropped from a spec pinning a variant
+BLAS_PACKAGES = ('libblas', 'libcblas', 'liblapack', 'liblapacke', 'blas', 'blas-devel',
+                 'libopenblas', 'openblas', 'mkl', 'mkl-devel', 'mkl-service', 'blis')
+
 SHELL_EXE = 'bash'
 
 def default_env_name(s) -> str:
@@ -15,6 +21,13 @@ def default_env_name(s) -> str:
 def default_env_prefix(s) -> Path:
     return _reg_manager.envs / default_env_name(s)
 
+def blas_dependency(variant: str) -> str:
+    """Conda spec selecting BLAS implementation `variant`, e.g. `libblas=*=*mkl`."""
+    if variant not in BLAS_VARIANTS:
+        raise ValueError(f'BLAS variant {variant} is not supported; '
+                         f'use one of {", ".join(BLAS_VARIANTS)}.')
+    return f'libblas=*=*{variant}'
+
 def write_conda_deploy_script(script_path, conda_exe, prefix, envfile) -> None:
     if not isinstance(script_path, Path):
         script_path = Path(script_path)
@@ -0,0 +1,23 @@
+from pyrty.executors.base_executor import BaseExecutor
+from pyrty.executors.batch import BatchExecutor
+from pyrty.executors.embedded import EmbeddedRExecutor
+from pyrty.executors.inprocess import InProcessExecutor
+from pyrty.executors.local import LocalExecutor, PoolExecutor
+
+_executors = {
+    'local': LocalExecutor,
+    'pool': PoolExecutor,
+    'batch': BatchExecutor,
+    'embedded': EmbeddedRExecutor,
+    'inprocess': InProcessExecutor,
+}
+
+__all__ = [
+    '_executors',
+    'BaseExecutor',
+    'BatchExecutor',
+    'EmbeddedRExecutor',
+    'InProcessExecutor',
+    'LocalExecutor',
+    'PoolExecutor',
+]
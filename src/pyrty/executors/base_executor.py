@@ -0,0 +1,78 @@
+import os
+from abc import ABC, abstractmethod
+from concurrent.futures import Future
+from contextlib import contextmanager
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import Any, Dict, Iterator, Optional, Union
+
+from pyrty.accounting import CallMetadata
+from pyrty.resources import ResourceSpec
+from pyrty.script_writers.base_script import OUTPUT_ENV_VAR
+
+
+@contextmanager
+def temporary_run_dir(dir: Union[str, Path, None] = None) -> Iterator[Path]:
+    """A call's own directory for its intermediates, removed once the call is done."""
+    with TemporaryDirectory(dir=dir, prefix='pyrty-run-') as tmpdirname:
+        yield Path(tmpdirname)
+
+
+class BaseExecutor(ABC):
+    """Runs the commands built by a `RunManager`.
+
+    A command's result is its stdout parsed into a DataFrame (`capture=True`), the
+    path its script wrote to (`output_path`), or `None`. `env_vars` are set in the
+    command's environment on top of the inherited one. Executors running the command
+    as a local child process add its resource usage to `metadata`, if given.
+    """
+
+    @abstractmethod
+    def submit(
+        self,
+        cmd: str,
+        capture: bool = False,
+        output_path: Union[str, Path, None] = None,
+        resources: Optional[ResourceSpec] = None,
+        skip: int = 0,
+        env_vars: Optional[Dict[str, str]] = None,
+        metadata: Optional[CallMetadata] = None,
+    ) -> Future:
+        pass
+
+    def run_dir(self):
+        """Context manager giving a call the directory its inputs are written to.
+
+        It must be visible wherever the executor runs commands; by default it is a
+        local temporary directory.
+        """
+        return temporary_run_dir()
+
+    def supports(self, run_manager) -> bool:
+        """Whether `call` can run `run_manager`'s script directly, not as a command."""
+        return False
+
+    def call(self, run_manager, input: Dict[str, Any], run_dir: Path, output_path=None,
+             env_vars: Optional[Dict[str, str]] = None):
+        """Runs `run_manager`'s script on `input` directly, when `supports` allows."""
+        raise NotImplementedError
+
+    def execute(self, cmd: str, **kwargs):
+        """Runs `cmd` and waits for its result."""
+        return self.submit(cmd, **kwargs).result()
+
+    def shutdown(self) -> None:
+        pass
+
+    @staticmethod
+    def make_env(output_path: Union[str, Path, None] = None,
+                 resources: Optional[ResourceSpec] = None,
+                 env_vars: Optional[Dict[str, str]] = None) -> Dict[str, str]:
+        env = resources.env() if resources is not None else dict(os.environ)
+        if output_path is not None:
+            env[OUTPUT_ENV_VAR] = str(output_path)
+        env.update(env_vars or {})
+        return env
+
+    def __str__(self) -> str:
+        return type(self).__name__
@@ -0,0 +1,201 @@
+import logging
+import os
+import re
+import shlex
+import subprocess
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+
+from pyrty.accounting import CallMetadata
+from pyrty.executors.base_executor import BaseExecutor, temporary_run_dir
+from pyrty.registry import RegistryManager
+from pyrty.resources import ResourceSpec
+from pyrty.utils import read_capture
+
+_logger = logging.getLogger(__name__)
+_reg_manager = RegistryManager()
+
+
+class BatchExecutor(BaseExecutor):
+    """Runs commands as jobs on a batch scheduler (Slurm by default).
+
+    Each command is wrapped in a job script that redirects its stdout to a file and
+    records its exit status. The job is submitted with `submit_cmd`, and the result
+    is collected once the status file appears. Calls write their inputs under
+    `job_dir/runs`, so that jobs find them on the compute nodes. `poll_cmd`, if
+    given, should print nothing once the scheduler no longer knows the job, which
+    lets jobs that die without writing a status (e.g. killed for exceeding limits)
+    fail fast.
+
+    Args:
+        submit_cmd: Command submitting a job script, which is appended as last
+            argument.
+        poll_cmd: Command checking on a job; `{job_id}` is replaced by the job id.
+        job_id_pattern: Regex whose first group extracts the job id from
+            `submit_cmd`'s output.
+        directives: Extra header lines for the job script (e.g.
+            `#SBATCH --partition=normal`).
+        resource_directives: Header lines requesting a `ResourceSpec`'s threads and
+            memory; `{threads}` and `{memory_mb}` are filled in. Set to `()` to
+            disable.
+        job_dir: Directory for job scripts and outputs; must be visible from compute
+            nodes.
+        poll_interval: Seconds between checks on a job.
+        max_workers: Maximum number of jobs in flight.
+    """
+
+    def __init__(
+        self,
+        submit_cmd: str = 'sbatch',
+        poll_cmd: Optional[str] = 'squeue -h -j {job_id}',
+        job_id_pattern: str = r'(\d+)',
+        directives: Optional[List[str]] = None,
+        resource_directives: Optional[List[str]] = None,
+        job_dir: Union[str, Path, None] = None,
+        poll_interval: float = 5.0,
+        max_workers: int = 256,
+    ):
+        self.submit_cmd = submit_cmd
+        self.poll_cmd = poll_cmd
+        self.job_id_pattern = job_id_pattern
+        self.directives = directives or []
+        if resource_directives is None:
+            resource_directives = ['#SBATCH --cpus-per-task={threads}',
+                                   '#SBATCH --mem={memory_mb}M']
+        self.resource_directives = resource_directives
+        if job_dir is None:
+            job_dir = _reg_manager.pyrty_dir / 'jobs'
+        self.job_dir = Path(job_dir)
+        self.poll_interval = poll_interval
+        self.max_workers = max_workers
+        self._pool = ThreadPoolExecutor(max_workers)
+
+    def submit(
+        self,
+        cmd: str,
+        capture: bool = False,
+        output_path: Union[str, Path, None] = None,
+        resources: Optional[ResourceSpec] = None,
+        skip: int = 0,
+        env_vars: Optional[Dict[str, str]] = None,
+        metadata: Optional[CallMetadata] = None,
+    ) -> Future:
+        return self._pool.submit(self._run, cmd, capture, output_path, resources, skip,
+                                 env_vars, metadata)
+
+    def shutdown(self) -> None:
+        self._pool.shutdown()
+
+    def run_dir(self):
+        """A call's directory under `job_dir`, kept until the call's jobs are done."""
+        runs_dir = self.job_dir / 'runs'
+        runs_dir.mkdir(parents=True, exist_ok=True)
+        return temporary_run_dir(runs_dir)
+
+    def write_job_script(self, cmd: str, job_name: str, output_path=None,
+                         resources: Optional[ResourceSpec] = None,
+                         env_vars: Optional[Dict[str, str]] = None) -> Path:
+        """Writes the job script running `cmd`, and returns its path."""
+        self.job_dir.mkdir(parents=True, exist_ok=True)
+        job_script = self.job_dir / f'{job_name}.sh'
+        stdout_path = self._stdout_path(job_name)
+        status_path = self._status_path(job_name)
+
+        # Only forward variables pyrty sets; the job inherits the node's environment
+        env = self.make_env(output_path, resources, env_vars)
+        exports = [f'export {k}={shlex.quote(v)}' for k, v in sorted(env.items())
+                   if os.environ.get(k) != v]
+
+        lines = ['#!/usr/bin/env bash', f'#SBATCH --job-name={job_name}']
+        lines.extend(self.directives)
+        if resources is not None:
+            lines.extend(self._format_resource_directives(resources))
+        lines.extend(exports)
+        lines.extend([
+            f'cd {shlex.quote(os.getcwd())}',
+            f'{cmd} > {shlex.quote(str(stdout_path))}',
+            f'echo $? > {shlex.quote(str(status_path))}.tmp',
+            f'mv {shlex.quote(str(status_path))}.tmp {shlex.quote(str(status_path))}',
+        ])
+        job_script.write_text('\n'.join(lines) + '\n')
+        return job_script
+
+    def _run(self, cmd, capture, output_path, resources, skip, env_vars=None,
+             metadata=None):
+        job_name = f'pyrty-{uuid.uuid4().hex[:12]}'
+        job_script = self.write_job_script(cmd, job_name, output_path, resources,
+                                           env_vars)
+        job_id = self._submit_job(job_script)
+        _logger.info(f'Submitted job {job_id} ({job_script}).')
+
+        try:
+            returncode = self._wait(job_id, job_name)
+            if metadata is not None:  # Usage stays with the scheduler (e.g. `sacct`)
+                metadata.returncode = returncode
+            if returncode != 0:
+                raise subprocess.CalledProcessError(returncode, cmd)
+            if capture:
+                return read_capture(self._stdout_path(job_name), skip=skip)
+            if output_path is not None:
+                return Path(output_path)
+        finally:
+            for path in (job_script, self._stdout_path(job_name),
+                         self._status_path(job_name)):
+                if path.exists():
+                    path.unlink()
+
+    def _submit_job(self, job_script: Path) -> str:
+        ret = subprocess.run(self.submit_cmd.split(' ') + [str(job_script)],
+                             capture_output=True, check=True, text=True)
+        match = re.search(self.job_id_pattern, ret.stdout)
+        if match is None:
+            raise RuntimeError(f'Could not parse a job id from {ret.stdout!r}.')
+        return match.group(1)
+
+    def _wait(self, job_id: str, job_name: str) -> int:
+        status_path = self._status_path(job_name)
+        gone_once = False
+        while not status_path.exists():
+            time.sleep(self.poll_interval)
+            if (self.poll_cmd and not status_path.exists()
+                    and not self._job_known(job_id)):
+                # Give shared filesystems one more interval to show the status file
+                if gone_once:
+                    raise RuntimeError(f'Job {job_id} ended without reporting '
+                                       f'an exit status.')
+                gone_once = True
+        return int(status_path.read_text().strip())
+
+    def _job_known(self, job_id: str) -> bool:
+        ret = subprocess.run(self.poll_cmd.format(job_id=job_id).split(' '),
+                             capture_output=True, text=True)
+        return bool(ret.stdout.strip())
+
+    def _format_resource_directives(self, resources: ResourceSpec) -> List[str]:
+        lines = []
+        for directive in self.resource_directives:
+            if '{threads}' in directive and resources.n_threads is None:
+                continue
+            if '{memory_mb}' in directive and resources.memory_bytes is None:
+                continue
+            lines.append(directive.format(
+                threads=resources.n_threads,
+                memory_mb=(resources.memory_bytes or 0) >> 20,
+            ))
+        return lines
+
+    def _stdout_path(self, job_name: str) -> Path:
+        return self.job_dir / f'{job_name}.out'
+
+    def _status_path(self, job_name: str) -> Path:
+        return self.job_dir / f'{job_name}.status'
+
+    def __getstate__(self):
+        return {k: v for k, v in self.__dict__.items() if k != '_pool'}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._pool = ThreadPoolExecutor(self.max_workers)
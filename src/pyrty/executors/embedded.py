@@ -0,0 +1,203 @@
+import hashlib
+import logging
+import numbers
+import os
+import sys
+import threading
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Any, Dict, Optional, Union
+
+import pandas as pd
+
+from pyrty.accounting import CallMetadata
+from pyrty.executors.base_executor import BaseExecutor
+from pyrty.executors.local import LocalExecutor
+from pyrty.refs import FileRef
+from pyrty.resources import ResourceSpec
+from pyrty.utils import as_captured, read_frame, write_frame
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+_logger = logging.getLogger(__name__)
+
+# R can be started only once per process; calls into it must not overlap
+_r_lock = threading.RLock()
+_r_home: Optional[Path] = None
+
+
+def _as_logical(value) -> bool:
+    if isinstance(value, bool):
+        return value
+    return str(value).upper() in ('TRUE', 'T', '1')
+
+
+# `rpy2` vectors and Python conversions for optparse's types
+_r_types = {
+    'logical': ('BoolVector', _as_logical),
+    'integer': ('IntVector', int),
+    'double': ('FloatVector', float),
+    'numeric': ('FloatVector', float),
+    'character': ('StrVector', str),
+}
+
+
+def find_r_home(prefix: Union[str, Path]) -> Optional[Path]:
+    """`R_HOME` of the R in the env at `prefix`, if its shared library exists."""
+    r_home = Path(prefix) / 'lib' / 'R'
+    libr = r_home / 'lib' / ('libR.dylib' if sys.platform == 'darwin' else 'libR.so')
+    return r_home if libr.exists() else None
+
+
+def start_r(r_home: Union[str, Path]) -> bool:
+    """Starts the embedded R from `r_home`, and returns whether it runs from there.
+
+    Only one R can be embedded per process: once started, calls for other R homes
+    return `False`.
+    """
+    global _r_home
+    with _r_lock:
+        if _r_home is None:
+            os.environ['R_HOME'] = str(r_home)
+            import rpy2.robjects  # noqa: F401  (initializes R)
+            _r_home = Path(r_home)
+            _logger.info(f'Embedded R from {r_home}.')
+        return _r_home == Path(r_home)
+
+
+class EmbeddedRExecutor(BaseExecutor):
+    """Runs R functions inside this process through `rpy2`, without a subprocess.
+
+    The script's body is defined once as an R function in the embedded interpreter
+    and called with the inputs converted in memory: DataFrames cross over as Arrow
+    tables through the C data interface when `rpy2-arrow` is installed, and as
+    Feather files otherwise. Scalars become R vectors of their arg's declared
+    optparse `type` (e.g. `"'integer'"`), or else of their Python type, so the body
+    sees the same values as when `optparse` parses them from the command line.
+    Results come back as from a subprocess run, every value a string (see
+    `pyrty.utils.as_captured`), so a function's result types do not depend on
+    the backend.
+
+    Scripts the embedded R cannot run (other languages, envs without a shared
+    `libR`, or a different env than the one R was embedded from) run as commands
+    on `fallback`, by default a `LocalExecutor`. Resource limits only apply there,
+    as the embedded R shares this process.
+    """
+
+    def __init__(self, fallback: Optional[BaseExecutor] = None):
+        self.fallback = fallback or LocalExecutor()
+        self._defined = set()
+
+    def supports(self, run_manager) -> bool:
+        if run_manager.script.lang != 'R':
+            return False
+        r_home = find_r_home(run_manager.env.prefix)
+        if r_home is None:
+            return False
+        try:
+            return start_r(r_home)
+        except ImportError:
+            return False
+        except Exception as e:
+            _logger.warning(f'Could not embed R from {r_home}, '
+                            f'running as subprocess: {e}')
+            return False
+
+    def call(self, run_manager, input: Dict[str, Any], run_dir: Path, output_path=None,
+             env_vars: Optional[Dict[str, str]] = None):
+        from rpy2 import robjects as ro
+
+        writer = run_manager.script.script_writer
+        name = self._define(ro, writer)
+        with _r_lock:
+            if env_vars:
+                ro.r['Sys.setenv'](**env_vars)
+            try:
+                opt = ro.vectors.ListVector({
+                    arg: self._to_r(ro, value, run_dir, arg,
+                                    writer.args.get(arg, {}).get('type'))
+                    for arg, value in (input or {}).items()})
+                res = ro.globalenv[name](opt)
+                if output_path is not None:
+                    ro.r['pyrty_write'](res, str(output_path))
+                    return Path(output_path)
+                if writer.ret:
+                    return self._to_pandas(ro, res, run_dir)
+            finally:
+                if env_vars:
+                    ro.r['Sys.unsetenv'](ro.vectors.StrVector(list(env_vars)))
+
+    def submit(
+        self,
+        cmd: str,
+        capture: bool = False,
+        output_path: Union[str, Path, None] = None,
+        resources: Optional[ResourceSpec] = None,
+        skip: int = 0,
+        env_vars: Optional[Dict[str, str]] = None,
+        metadata: Optional[CallMetadata] = None,
+    ) -> Future:
+        return self.fallback.submit(cmd, capture=capture, output_path=output_path,
+                                    resources=resources, skip=skip, env_vars=env_vars,
+                                    metadata=metadata)
+
+    def shutdown(self) -> None:
+        self.fallback.shutdown()
+
+    def _define(self, ro, writer) -> str:
+        # Keyed by script version, so edited scripts are defined anew
+        key = hashlib.sha256(str(writer.versioned_path).encode()).hexdigest()[:12]
+        name = f'.pyrty_embedded_{key}'
+        with _r_lock:
+            if name not in self._defined:
+                ro.r(writer.make_prologue())
+                if writer.libs:
+                    ro.r(writer.make_imports())
+                ro.r(writer.make_function_def(name))
+                self._defined.add(name)
+        return name
+
+    @staticmethod
+    def _to_r(ro, value, run_dir: Path, name: str, r_type: Optional[str] = None):
+        if isinstance(value, pd.DataFrame):
+            try:
+                import rpy2_arrow.pyarrow_rarrow as pyra
+                table = pa.Table.from_pandas(value, preserve_index=False)
+                return ro.r['as.data.frame'](pyra.pyarrow_table_to_r_table(table))
+            except ImportError:
+                value = write_frame(value, run_dir / f'{name}.feather')
+        elif isinstance(value, FileRef):
+            value = value.resolve(run_dir, name)
+        r_type = (r_type or '').strip('\'"')
+        if r_type in _r_types:
+            vector, convert = _r_types[r_type]
+        elif isinstance(value, bool):
+            vector, convert = _r_types['logical']
+        elif isinstance(value, numbers.Integral):
+            vector, convert = _r_types['integer']
+        elif isinstance(value, numbers.Real):
+            vector, convert = _r_types['double']
+        else:
+            vector, convert = _r_types['character']
+        return getattr(ro.vectors, vector)([convert(value)])
+
+    @staticmethod
+    def _to_pandas(ro, res, run_dir: Path) -> pd.DataFrame:
+        try:
+            import rpy2_arrow.pyarrow_rarrow as pyra
+            table = pyra.rarrow_to_py_table(ro.r('arrow::as_arrow_table')(res))
+            df = table.to_pandas()
+        except ImportError:
+            path = run_dir / 'result.feather'
+            ro.r['pyrty_write'](res, str(path))
+            df = read_frame(path)
+        return as_captured(df)
+
+    def __getstate__(self):
+        return {'fallback': self.fallback}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
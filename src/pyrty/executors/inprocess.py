@@ -0,0 +1,231 @@
+import hashlib
+import importlib.util
+import json
+import logging
+import multiprocessing
+import os
+import subprocess
+import sys
+import sysconfig
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional, Union
+
+import pandas as pd
+
+from pyrty.accounting import CallMetadata
+from pyrty.executors.base_executor import BaseExecutor
+from pyrty.executors.local import LocalExecutor
+from pyrty.refs import FileRef
+from pyrty.resources import ResourceSpec
+from pyrty.script_writers.base_script import COMPRESSION_ENV_VAR
+from pyrty.utils import as_captured
+
+_logger = logging.getLogger(__name__)
+
+_INFO_SCRIPT = ('import json, sys, sysconfig; '
+                'paths = sysconfig.get_paths(); '
+                'print(json.dumps([sys.implementation.cache_tag, '
+                'sysconfig.get_config_var("SOABI"), '
+                'sorted({paths["purelib"], paths["platlib"]})]))')
+
+_env_info: Dict[str, tuple] = {}
+# Namespaces of defined scripts, by source hash
+_compiled: Dict[str, Dict[str, Any]] = {}
+_spawn_lock = threading.Lock()  # `set_executable` is global to the spawn start method
+_environ_lock = threading.Lock()  # Serializes calls that set variables in `os.environ`
+
+
+def python_info(python: Union[str, Path]) -> tuple:
+    """`(cache_tag, SOABI, site_dirs)` of the interpreter at `python`."""
+    python = str(python)
+    if python not in _env_info:
+        ret = subprocess.run([python, '-c', _INFO_SCRIPT], capture_output=True,
+                             text=True, check=True)
+        cache_tag, soabi, site_dirs = json.loads(ret.stdout)
+        _env_info[python] = (cache_tag, soabi, site_dirs)
+    return _env_info[python]
+
+
+def own_python_info() -> tuple:
+    paths = sysconfig.get_paths()
+    return (sys.implementation.cache_tag, sysconfig.get_config_var('SOABI'),
+            sorted({paths['purelib'], paths['platlib']}))
+
+
+class InProcessExecutor(BaseExecutor):
+    """Runs Python functions without `conda run`, if the env's Python is compatible.
+
+    An env is compatible when its Python has the same ABI as this interpreter and
+    the script's libraries are importable here. With `mode='thread'`, the script's
+    body runs in this process on the calling thread; with `mode='process'`, it runs
+    in a pool of `multiprocessing` workers started with the env's interpreter
+    (`set_executable`). The workers inherit this process's `sys.path`, with the
+    env's site-packages put first; modules pyrty itself imports, such as pandas,
+    are still loaded from this interpreter's paths before that.
+
+    Inputs are passed as objects rather than files: DataFrames reach the body as
+    in-memory copies (the prologue's `pyrty_read` returns non-paths unchanged).
+    Results come back as from a subprocess run, every value a string (see
+    `pyrty.utils.as_captured`), unless `typed=True`, which returns the body's
+    DataFrame as is, with its dtypes. The output path and compression
+    are passed to the body's `pyrty_write` directly; calls with other `env_vars`
+    set them in `os.environ`, one call at a time. Scripts of incompatible envs run
+    as commands on `fallback`, by default a `LocalExecutor`.
+    """
+
+    def __init__(self, mode: str = 'thread', max_workers: Optional[int] = None,
+                 fallback: Optional[BaseExecutor] = None, typed: bool = False):
+        if mode not in ('thread', 'process'):
+            raise ValueError(f'Mode {mode} is not supported; '
+                             f'use "thread" or "process".')
+        self.mode = mode
+        self.typed = typed
+        self.max_workers = max_workers
+        self.fallback = fallback or LocalExecutor()
+        self._pools: Dict[str, ProcessPoolExecutor] = {}
+        self._supported: Dict[str, bool] = {}
+
+    def supports(self, run_manager) -> bool:
+        if run_manager.script.lang != 'python':
+            return False
+        key = f'{run_manager.env.prefix}:{run_manager.script.script_path}'
+        if key not in self._supported:
+            self._supported[key] = self._compatible(run_manager)
+        return self._supported[key]
+
+    def call(self, run_manager, input: Dict[str, Any], run_dir: Path, output_path=None,
+             env_vars: Optional[Dict[str, str]] = None):
+        writer = run_manager.script.script_writer
+        source = '\n'.join(filter(None, [writer.make_prologue(), writer.make_imports(),
+                                         writer.make_function_def('_pyrty_fn')]))
+        args = {arg: value.resolve(run_dir, arg) if isinstance(value, FileRef)
+                else value
+                for arg, value in (input or {}).items()}
+        output_path = str(output_path) if output_path is not None else None
+
+        if self.mode == 'thread':
+            # Copies, so that bodies modifying their inputs leave the caller's intact
+            args = {arg: value.copy() if isinstance(value, pd.DataFrame) else value
+                    for arg, value in args.items()}
+            res = _call(source, args, output_path, env_vars, ret=writer.ret)
+        else:
+            python = run_manager.env.find_exe('python')
+            future = self._submit(python, source, args, output_path, env_vars,
+                                  writer.ret)
+            res = future.result()
+        if isinstance(res, pd.DataFrame) and not self.typed:
+            return as_captured(res)
+        return res
+
+    def submit(
+        self,
+        cmd: str,
+        capture: bool = False,
+        output_path: Union[str, Path, None] = None,
+        resources: Optional[ResourceSpec] = None,
+        skip: int = 0,
+        env_vars: Optional[Dict[str, str]] = None,
+        metadata: Optional[CallMetadata] = None,
+    ) -> Future:
+        return self.fallback.submit(cmd, capture=capture, output_path=output_path,
+                                    resources=resources, skip=skip, env_vars=env_vars,
+                                    metadata=metadata)
+
+    def shutdown(self) -> None:
+        for pool in self._pools.values():
+            pool.shutdown()
+        self._pools.clear()
+        self.fallback.shutdown()
+
+    def _compatible(self, run_manager) -> bool:
+        python = run_manager.env.find_exe('python')
+        try:
+            cache_tag, soabi, __ = python_info(python)
+        except (OSError, subprocess.CalledProcessError, ValueError) as e:
+            _logger.info(f'Could not inspect {python}: {e}')
+            return False
+        own_tag, own_soabi, __ = own_python_info()
+        if (cache_tag, soabi) != (own_tag, own_soabi):
+            _logger.info(f'{python} ({soabi}) is not ABI-compatible with this '
+                         f'interpreter ({own_soabi}).')
+            return False
+        missing = [lib for lib in run_manager.script.script_writer.libs
+                   if importlib.util.find_spec(lib.split('.')[0]) is None]
+        if missing and self.mode == 'thread':
+            _logger.info(f'Not running {run_manager.script.script_path} in-process; '
+                         f'missing {missing}.')
+            return False
+        return True
+
+    def _submit(self, python: str, *args) -> Future:
+        with _spawn_lock:
+            context = multiprocessing.get_context('spawn')
+            # Global to the spawn method; workers start on demand, during `submit`
+            context.set_executable(python)
+            try:
+                if python not in self._pools:
+                    site_dirs = python_info(python)[2]
+                    self._pools[python] = ProcessPoolExecutor(
+                        self.max_workers, mp_context=context,
+                        initializer=_prefer_site_dirs, initargs=(site_dirs,))
+                return self._pools[python].submit(_call, *args)
+            finally:
+                context.set_executable(sys.executable)
+
+    def __getstate__(self):
+        return {'mode': self.mode, 'max_workers': self.max_workers,
+                'fallback': self.fallback, 'typed': self.typed}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+
+def _prefer_site_dirs(site_dirs: List[str]) -> None:
+    """Puts the env's `site_dirs` ahead of the `sys.path` inherited from the parent."""
+    for site_dir in reversed(site_dirs):
+        if site_dir in sys.path:
+            sys.path.remove(site_dir)
+        sys.path.insert(0, site_dir)
+
+
+def _call(source: str, args: Dict[str, Any], output_path: Optional[str],
+          env_vars: Optional[Dict[str, str]], ret: bool):
+    """Defines the script's function (once per source) and calls it on `args`."""
+    key = hashlib.sha256(source.encode()).hexdigest()
+    if key not in _compiled:
+        namespace = {'__name__': '__pyrty__'}
+        exec(compile(source, f'<pyrty {key[:12]}>', 'exec'), namespace)
+        _compiled[key] = namespace
+    namespace = _compiled[key]
+
+    env_vars = dict(env_vars or {})
+    compression = env_vars.pop(COMPRESSION_ENV_VAR, None)
+    with _environ(env_vars):
+        res = namespace['_pyrty_fn'](SimpleNamespace(**args))
+        if output_path is not None:
+            namespace['pyrty_write'](res, output_path, compression)
+            return Path(output_path)
+        return res if ret else None
+
+
+@contextmanager
+def _environ(env_vars: Dict[str, str]):
+    """Sets `env_vars` in `os.environ` for the duration, holding `_environ_lock`."""
+    if not env_vars:
+        yield
+        return
+    with _environ_lock:
+        previous = {name: os.environ.get(name) for name in env_vars}
+        os.environ.update(env_vars)
+        try:
+            yield
+        finally:
+            for name, value in previous.items():
+                if value is None:
+                    os.environ.pop(name, None)
+                else:
+                    os.environ[name] = value
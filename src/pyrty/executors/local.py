@@ -0,0 +1,83 @@
+import subprocess
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from subprocess import Popen
+from typing import Dict, Optional, Union
+
+from pyrty.accounting import CallMetadata, wait_with_rusage
+from pyrty.executors.base_executor import BaseExecutor
+from pyrty.resources import ResourceSpec
+from pyrty.utils import run_capture
+
+
+class LocalExecutor(BaseExecutor):
+    """Runs each command in a local subprocess, blocking the caller."""
+
+    def submit(
+        self,
+        cmd: str,
+        capture: bool = False,
+        output_path: Union[str, Path, None] = None,
+        resources: Optional[ResourceSpec] = None,
+        skip: int = 0,
+        env_vars: Optional[Dict[str, str]] = None,
+        metadata: Optional[CallMetadata] = None,
+    ) -> Future:
+        future = Future()
+        try:
+            future.set_result(self._run(cmd, capture, output_path, resources, skip,
+                                        env_vars, metadata))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def _run(self, cmd, capture, output_path, resources, skip, env_vars=None,
+             metadata=None):
+        env = self.make_env(output_path, resources, env_vars)
+        if capture:
+            return run_capture(cmd, skip=skip, metadata=metadata, resources=resources,
+                               env=env)
+        args = cmd.split(' ')
+        if resources is not None:
+            args = resources.command(args)
+        with Popen(args, env=env) as p:
+            rusage = wait_with_rusage(p)
+        if metadata is not None:
+            metadata.add_rusage(rusage, p.returncode)
+        if output_path is not None:
+            if p.returncode != 0:
+                raise subprocess.CalledProcessError(p.returncode, cmd)
+            return Path(output_path)
+
+
+class PoolExecutor(LocalExecutor):
+    """Runs commands in local subprocesses, at most `max_workers` at a time.
+
+    `submit` returns immediately, so many calls can be in flight from one thread.
+    """
+
+    def __init__(self, max_workers: Optional[int] = None):
+        self.max_workers = max_workers
+        self._pool = ThreadPoolExecutor(max_workers)
+
+    def submit(
+        self,
+        cmd: str,
+        capture: bool = False,
+        output_path: Union[str, Path, None] = None,
+        resources: Optional[ResourceSpec] = None,
+        skip: int = 0,
+        env_vars: Optional[Dict[str, str]] = None,
+        metadata: Optional[CallMetadata] = None,
+    ) -> Future:
+        return self._pool.submit(self._run, cmd, capture, output_path, resources, skip,
+                                 env_vars, metadata)
+
+    def shutdown(self) -> None:
+        self._pool.shutdown()
+
+    def __getstate__(self):
+        return {'max_workers': self.max_workers}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
@@ -0,0 +1,145 @@
+import copy
+import logging
+import re
+from typing import List, Optional
+
+from pyrty.pyr_func import PyRFunc
+from pyrty.registry import RegistryManager
+
+_logger = logging.getLogger(__name__)
+_reg_manager = RegistryManager()
+
+_fusable_langs = ('R', 'python')
+
+
+def fuse(
+    funcs: List[PyRFunc],
+    links: Optional[List[str]] = None,
+    alias: Optional[str] = None,
+    register: bool = False,
+) -> PyRFunc:
+    """Fuses a chain of functions sharing an env and language into one script.
+
+    Each function's body is wrapped in its own function (so local variables do not
+    clash) and the result of step `i` is passed in memory to step `i + 1`, so the
+    chain pays for interpreter startup and library loading once. Each step after
+    the first must therefore read its linked argument with `pyrty_read`, which
+    returns in-memory values unchanged, rather than as a path.
+
+    Args:
+        funcs: Functions to chain, in order.
+        links: For each function after the first, the argument receiving the
+            previous step's result. Defaults to each function's first argument.
+        alias: Alias of the fused function. Defaults to the aliases joined by `__`.
+        register: Whether to register the fused function.
+
+    Returns:
+        PyRFunc: The fused function. Arguments not fed by a link keep their names,
+        prefixed with their function's alias when two steps share an argument name.
+    """
+    if len(funcs) < 2:
+        raise ValueError('Need at least two functions to fuse.')
+    lang = funcs[0].script.lang
+    prefix = funcs[0].env.prefix
+    for func in funcs:
+        if func.script.lang != lang or func.env.prefix != prefix:
+            raise ValueError(f'{func.alias} does not share the env and language '
+                             f'of {funcs[0].alias}.')
+    if lang not in _fusable_langs:
+        raise NotImplementedError(f'Fusing {lang} functions is not supported.')
+    for func in funcs[:-1]:
+        if not func.script.script_ret:
+            raise ValueError(f'{func.alias} does not return a value to pass on.')
+
+    if links is None:
+        links = [list(func.script.script_writer.args)[0] for func in funcs[1:]]
+    elif len(links) != len(funcs) - 1:
+        raise ValueError('Need one link per function after the first.')
+
+    for func, link in zip(funcs[1:], links):
+        if not _reads_input(lang, func.script.script_writer.code_body, link):
+            raise ValueError(f'{func.alias} must read {link} with pyrty_read to take '
+                             f'the result of the previous step.')
+
+    alias = alias or '__'.join(func.alias for func in funcs)
+    writers = [func.script.script_writer for func in funcs]
+
+    # Arguments not fed by the previous step become arguments of the fused script
+    free_args = [(i, arg) for i, w in enumerate(writers) for arg in w.args
+                 if not (i > 0 and arg == links[i - 1])]
+    counts = {}
+    for __, arg in free_args:
+        counts[arg] = counts.get(arg, 0) + 1
+    arg_names = {(i, arg): arg if counts[arg] == 1
+                 else f'{_safe_name(funcs[i].alias)}_{arg}'
+                 for i, arg in free_args}
+
+    args, libs = {}, []
+    for (i, arg), name in arg_names.items():
+        args[name] = {**copy.deepcopy(writers[i].args[arg]), 'name': name}
+    for w in writers:
+        libs.extend(lib for lib in w.libs if lib not in libs)
+
+    last = writers[-1]
+    script_kwargs = dict(
+        args=args,
+        code_body=_fused_body(lang, writers, links, arg_names),
+        description=f'Fused from {", ".join(func.alias for func in funcs)}',
+        libs=libs,
+        output_type=last.output_type.value if last.output_type else None,
+        path=_reg_manager.scripts / f'{alias}.{lang.lower()}',
+        ret=last.ret,
+        ret_name=_result_name(lang, len(writers) - 1) if last.ret else None,
+    )
+
+    fused = PyRFunc(alias, env=funcs[0].env, keep=register)
+    fused.add_script(lang, script_kwargs)
+    if register:
+        fused.register()
+    else:
+        fused._create_func()
+    _logger.info(f'Fused {[func.alias for func in funcs]} into {alias}.')
+    return fused
+
+
+def _fused_body(lang, writers, links, arg_names) -> str:
+    lines = [] if lang == 'R' else ['from types import SimpleNamespace']
+    lines.extend(w.make_function_def(_step_name(lang, i))
+                 for i, w in enumerate(writers))
+    for i, w in enumerate(writers):
+        step_args = {}
+        for arg in w.args:
+            if i > 0 and arg == links[i - 1]:
+                step_args[arg] = _result_name(lang, i - 1)
+            else:
+                step_args[arg] = (f'opt${arg_names[(i, arg)]}' if lang == 'R'
+                                  else f'args.{arg_names[(i, arg)]}')
+        result, step = _result_name(lang, i), _step_name(lang, i)
+        if lang == 'R':
+            call_args = ', '.join(f'`{k}` = {v}' for k, v in step_args.items())
+            lines.append(f'{result} <- {step}(list({call_args}))')
+        else:
+            call_args = ', '.join(f'{k}={v}' for k, v in step_args.items())
+            lines.append(f'{result} = {step}(SimpleNamespace({call_args}))')
+    return '\n'.join(lines)
+
+
+def _reads_input(lang: str, code: str, arg: str) -> bool:
+    arg = re.escape(arg)
+    if lang == 'R':
+        accessor = rf'opt(\${arg}\b|\[\[[\'"]{arg}[\'"]\]\])'
+    else:
+        accessor = rf'args\.{arg}\b'
+    return re.search(rf'pyrty_read\(\s*{accessor}', code) is not None
+
+
+def _step_name(lang: str, i: int) -> str:
+    return f'.pyrty_step_{i}' if lang == 'R' else f'_pyrty_step_{i}'
+
+
+def _result_name(lang: str, i: int) -> str:
+    return f'.pyrty_result_{i}' if lang == 'R' else f'_pyrty_result_{i}'
+
+
+def _safe_name(s: str) -> str:
+    return re.sub(r'\W', '_', s)
@@ -0,0 +1,367 @@
+"""Load tests driving a function at a given concurrency or request rate.
+
+Records the latency of every request, errors, and the memory of this process and
+its children over time. `local_function` builds a trivial function running on the
+host's interpreters, so a load test needs neither a registry entry nor network.
+Load-test calls are not recorded in the call history (see `PyRFunc.history`).
+
+Example:
+    python -m pyrty.loadtest --local shell --concurrency 1 2 4 8 --duration 30 \
+        --out report/
+"""
+import argparse
+import itertools
+import json
+import logging
+import os
+import shutil
+import sys
+import threading
+import time
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from tempfile import mkdtemp
+from typing import Any, Callable, Dict, List, Optional, Sequence, Union
+
+import numpy as np
+import pandas as pd
+
+from pyrty.pool import process_rss
+
+_logger = logging.getLogger(__name__)
+
+_LOCAL_BODIES = {
+    'python': 'res = pyrty_read(args.x)',
+    'R': 'res <- pyrty_read(opt$x)',
+    'shell': 'echo "v,w"\necho "1,2"',
+}
+_EXTENSIONS = {'python': 'py', 'R': 'R', 'shell': 'sh'}
+
+
+class HostEnv:
+    """Stands in for a `PyREnv`, running commands with the host's executables."""
+
+    manager = 'host'
+    env_name = 'host'
+    env_exists = True
+
+    @property
+    def prefix(self) -> Path:
+        return Path(sys.prefix)
+
+    def get_run_in_env_cmd(self, cmd: str) -> str:
+        return cmd
+
+    def find_exe(self, name: str) -> str:
+        return shutil.which(name) or name
+
+
+def host_function(alias: str, code: str, lang: str = 'python', args: Dict = None,
+                  libs: List[str] = None, script_dir: Union[str, Path, None] = None):
+    """A `PyRFunc` running `code` in a `HostEnv`, returning table `res`.
+
+    Without `script_dir`, the script is written to a temporary directory that is
+    removed with the function, or at exit.
+    """
+    from pyrty.pyr_func import PyRFunc
+    from pyrty.pyr_script import PyRScript
+    from pyrty.run_manager import RunManager
+
+    temporary = script_dir is None
+    script_dir = Path(mkdtemp(prefix='pyrty-host-') if temporary else script_dir)
+    script_kwargs = dict(path=script_dir / f'{alias}.{_EXTENSIONS[lang]}',
+                         code_body=code, ret=True, ret_name='res', output_type='df')
+    if lang != 'shell':
+        script_kwargs['args'] = args or {}
+    if libs:
+        script_kwargs['libs'] = libs
+    func = PyRFunc(alias, PyRScript(lang, script_kwargs), HostEnv())
+    func.script.create_script()
+    func.run_manager = RunManager(func.env, func.script)
+    if temporary:
+        weakref.finalize(func, shutil.rmtree, script_dir, ignore_errors=True)
+    return func
+
+
+def local_function(lang: str = 'shell', script_dir: Union[str, Path, None] = None):
+    """A trivial host `PyRFunc`: Python and R echo table `x`, shell prints one."""
+    if lang not in _LOCAL_BODIES:
+        raise ValueError(f'No local function for {lang}; '
+                         f'use one of {sorted(_LOCAL_BODIES)}.')
+    return host_function(f'loadtest-{lang}', _LOCAL_BODIES[lang], lang=lang,
+                         args={'x': {}}, script_dir=script_dir,
+                         libs=['optparse', 'readr'] if lang == 'R' else None)
+
+
+def local_input(lang: str = 'shell') -> Optional[Dict[str, Any]]:
+    """Input for `local_function(lang)`."""
+    return None if lang == 'shell' else {'x': pd.DataFrame({'v': range(10), 'w': 0.5})}
+
+
+@contextmanager
+def _without_history(func):
+    """Stops `func` recording calls in its call history meanwhile."""
+    if getattr(func, 'history', None) is None:
+        yield
+        return
+    own = vars(func).get('history')
+    func.history = None
+    try:
+        yield
+    finally:
+        if own is None:
+            del func.history  # Back to the class's history
+        else:
+            func.history = own
+
+
+def children_rss(pid: int) -> tuple:
+    """`(count, total RSS in bytes)` of the descendants of process `pid`."""
+    parents = {}
+    for stat in Path('/proc').glob('[0-9]*/stat'):
+        try:
+            # The command name may contain spaces; fields resume after its closing paren
+            fields = stat.read_text().rsplit(')', 1)[1].split()
+            parents[int(stat.parent.name)] = int(fields[1])
+        except (OSError, ValueError, IndexError):
+            continue
+    descendants, frontier = [], [pid]
+    while frontier:
+        children = [child for child, parent in parents.items() if parent in frontier]
+        descendants.extend(children)
+        frontier = children
+    return len(descendants), sum(process_rss(child) or 0 for child in descendants)
+
+
+@dataclass
+class LoadReport:
+    """Requests and memory samples of a load test.
+
+    `calls` has one row per request: when it was due (seconds from the start), its
+    latency from then (including time queued behind earlier requests when driven at
+    a rate), its service time, and its error type if it failed. `memory` has one row
+    per sample of this process's RSS and of its children's.
+    """
+
+    settings: Dict[str, Any]
+    calls: pd.DataFrame
+    memory: pd.DataFrame
+    elapsed: float
+
+    def summary(self) -> Dict[str, Any]:
+        latency = self.calls.latency.to_numpy(dtype=float)
+        errors = int((~self.calls.ok).sum())
+        p50, p95, p99 = (np.percentile(latency, [50, 95, 99]) if len(latency)
+                         else [np.nan] * 3)
+        memory = self.memory
+        growth = (memory.parent_rss.iloc[-1] - memory.parent_rss.iloc[0]
+                  if len(memory) else np.nan)
+        return dict(
+            self.settings,
+            requests=len(self.calls),
+            errors=errors,
+            error_rate=errors / len(self.calls) if len(self.calls) else np.nan,
+            throughput=len(self.calls) / self.elapsed if self.elapsed else np.nan,
+            p50=p50, p95=p95, p99=p99,
+            max=latency.max() if len(latency) else np.nan,
+            mean_service_time=self.calls.service_time.mean(),
+            parent_rss_growth=growth,
+            children_rss_peak=memory.children_rss.max() if len(memory) else np.nan,
+        )
+
+    def histogram(self, bins: int = 20) -> pd.DataFrame:
+        """Counts of latencies in `bins` logarithmically spaced buckets."""
+        latency = self.calls.latency.to_numpy(dtype=float)
+        if not len(latency):
+            return pd.DataFrame(columns=['lower', 'upper', 'count'])
+        low, high = max(latency.min(), 1e-6), max(latency.max(), 1e-6)
+        if high > low:
+            edges = np.geomspace(low, high * (1 + 1e-9), bins + 1)
+        else:
+            edges = np.array([low, high + 1e-6])
+        counts, edges = np.histogram(latency, bins=edges)
+        return pd.DataFrame({'lower': edges[:-1], 'upper': edges[1:], 'count': counts})
+
+    def errors(self) -> pd.Series:
+        """Number of failed requests by error type."""
+        return self.calls.loc[~self.calls.ok, 'error'].value_counts()
+
+    def write(self, directory: Union[str, Path]) -> Path:
+        """Writes `summary.json`, `report.txt` and calls, memory and histogram CSVs."""
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        summary = {k: (v.item() if isinstance(v, np.generic) else v)
+                   for k, v in self.summary().items()}
+        summary_json = json.dumps(summary, indent=2, default=str)
+        (directory / 'summary.json').write_text(summary_json)
+        self.calls.to_csv(directory / 'calls.csv', index=False)
+        self.memory.to_csv(directory / 'memory.csv', index=False)
+        self.histogram().to_csv(directory / 'histogram.csv', index=False)
+        (directory / 'report.txt').write_text(str(self) + '\n')
+        return directory
+
+    def __str__(self) -> str:
+        s = self.summary()
+        rate = f", rate {s['rate']}/s" if s.get('rate') else ''
+        lines = [
+            f"{s['requests']} requests in {self.elapsed:.1f}s "
+            f"({s['throughput']:.2f}/s) at concurrency {s['concurrency']}{rate}",
+            f"errors: {s['errors']} ({s['error_rate']:.1%})",
+            f"latency (s): p50 {s['p50']:.3f}  p95 {s['p95']:.3f}  "
+            f"p99 {s['p99']:.3f}  max {s['max']:.3f}",
+            f"memory: parent RSS grew {s['parent_rss_growth'] / (1 << 20):+.1f} MiB, "
+            f"children peaked at {s['children_rss_peak'] / (1 << 20):.1f} MiB",
+        ]
+        if s['errors']:
+            lines.extend(f'  {error}: {count}'
+                         for error, count in self.errors().items())
+        return '\n'.join(lines)
+
+
+def run_load(
+    func: Callable,
+    input: Optional[Dict[str, Any]] = None,
+    concurrency: int = 4,
+    rate: Optional[float] = None,
+    duration: Optional[float] = 10.0,
+    requests: Optional[int] = None,
+    warmup: int = 0,
+    sample_interval: float = 0.5,
+) -> LoadReport:
+    """Calls `func(input)` under load until `duration` seconds or `requests` requests.
+
+    Without `rate`, `concurrency` threads call `func` back to back (a closed loop).
+    With `rate`, requests are due at that many per second whether or not earlier ones
+    have finished, and run on `concurrency` threads (an open loop); latencies are
+    measured from when each request was due, so they include queueing. The calls
+    are not recorded in `func`'s call history.
+    """
+    if duration is None and requests is None:
+        raise ValueError('Set `duration`, `requests` or both.')
+    with _without_history(func):
+        for __ in range(warmup):
+            func(input)
+
+        records, memory = [], []
+        stop = threading.Event()
+        start = time.perf_counter()
+        deadline = start + duration if duration is not None else float('inf')
+
+        def sample():
+            count, rss = children_rss(os.getpid())
+            elapsed = time.perf_counter() - start
+            memory.append((elapsed, process_rss(os.getpid()), count, rss))
+
+        def sampler():
+            sample()
+            while not stop.wait(sample_interval):
+                sample()
+
+        def request(due: float):
+            begin = time.perf_counter()
+            try:
+                func(input)
+                ok, error = True, ''
+            except Exception as e:
+                ok, error = False, type(e).__name__
+            end = time.perf_counter()
+            records.append((due - start, end - due, end - begin, ok, error))
+
+        sampler_thread = threading.Thread(target=sampler, daemon=True)
+        sampler_thread.start()
+        if rate is None:
+            issued = itertools.count()
+
+            def loop():
+                while time.perf_counter() < deadline:
+                    if requests is not None and next(issued) >= requests:
+                        break
+                    request(time.perf_counter())
+            threads = [threading.Thread(target=loop) for __ in range(concurrency)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        else:
+            with ThreadPoolExecutor(concurrency) as pool:
+                for i in itertools.count():
+                    due = start + i / rate
+                    if due >= deadline or (requests is not None and i >= requests):
+                        break
+                    time.sleep(max(0.0, due - time.perf_counter()))
+                    pool.submit(request, due)
+        elapsed = time.perf_counter() - start
+        stop.set()
+        sampler_thread.join()
+        sample()
+
+    calls = pd.DataFrame(records,
+                         columns=['due', 'latency', 'service_time', 'ok', 'error'])
+    calls = calls.sort_values('due', ignore_index=True)
+    memory = pd.DataFrame(memory,
+                          columns=['time', 'parent_rss', 'children', 'children_rss'])
+    name = (getattr(func, 'alias', None)
+            or getattr(func, '__name__', type(func).__name__))
+    settings = dict(func=name, concurrency=concurrency, rate=rate, duration=duration,
+                    requests_limit=requests)
+    report = LoadReport(settings, calls, memory, elapsed)
+    _logger.info(f'Load test of {settings["func"]}:\n{report}')
+    return report
+
+
+def sweep(
+    func: Callable,
+    input: Optional[Dict[str, Any]] = None,
+    concurrencies: Sequence[int] = (1, 2, 4, 8),
+    out: Union[str, Path, None] = None,
+    **kwargs,
+) -> pd.DataFrame:
+    """Runs `run_load` at each concurrency; one summary row per concurrency.
+
+    With `out`, each report is written to `out/concurrency-<n>` and the table to
+    `out/sweep.csv`.
+    """
+    rows = []
+    for concurrency in concurrencies:
+        report = run_load(func, input, concurrency=concurrency, **kwargs)
+        rows.append(report.summary())
+        if out is not None:
+            report.write(Path(out) / f'concurrency-{concurrency}')
+    df = pd.DataFrame(rows).set_index('concurrency')
+    if out is not None:
+        df.to_csv(Path(out) / 'sweep.csv')
+    return df
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        description='Load-test a function at increasing concurrency.')
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument('alias', nargs='?',
+                        help='Registered function, called without arguments.')
+    target.add_argument('--local', choices=sorted(_LOCAL_BODIES),
+                        help='Use a trivial local function.')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--rate', type=float,
+                        help='Requests per second (default: back to back).')
+    parser.add_argument('--duration', type=float, default=10.0,
+                        help='Seconds per concurrency level.')
+    parser.add_argument('--requests', type=int, help='Requests per concurrency level.')
+    parser.add_argument('--out', help='Directory to write the reports to.')
+    args = parser.parse_args(argv)
+
+    if args.local:
+        func, input = local_function(args.local), local_input(args.local)
+    else:
+        from pyrty.pyr_func import PyRFunc
+        func, input = PyRFunc.from_registry(args.alias), None
+    df = sweep(func, input, concurrencies=args.concurrency, out=args.out,
+               rate=args.rate, duration=args.duration, requests=args.requests)
+    print(df.to_string())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,210 @@
+import hashlib
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, List, Optional, Union
+
+import numpy as np
+import pandas as pd
+
+from pyrty.refs import FileRef
+from pyrty.registry import RegistryManager
+from pyrty.resources import ResourcePool, ResourceSpec
+from pyrty.script_writers.base_script import OutputFormat
+from pyrty.utils import hash_file, hash_frame, read_frame, write_frame
+
+_logger = logging.getLogger(__name__)
+_reg_manager = RegistryManager()
+
+
+def split_frame(
+    df: pd.DataFrame,
+    npartitions: Optional[int] = None,
+    by: Union[str, List[str], None] = None,
+) -> List[pd.DataFrame]:
+    """Splits `df` into row chunks or, when `by` is given, whole groups.
+
+    With `by` and `npartitions`, groups are packed into `npartitions` partitions of
+    roughly equal size; with `by` alone there is one partition per group.
+    """
+    if by is None:
+        npartitions = max(1, min(npartitions or 1, len(df)))
+        return [df.iloc[ix] for ix in np.array_split(np.arange(len(df)), npartitions)]
+
+    groups = [group for __, group in df.groupby(by, sort=False)]
+    if not npartitions or npartitions >= len(groups):
+        return groups
+
+    # Greedy bin packing: largest groups first, each into the smallest partition
+    bins = [[] for __ in range(npartitions)]
+    sizes = [0] * npartitions
+    for group in sorted(groups, key=len, reverse=True):
+        i = sizes.index(min(sizes))
+        bins[i].append(group)
+        sizes[i] += len(group)
+    return [pd.concat(b) for b in bins if b]
+
+
+def map_partitions(
+    func,
+    df: pd.DataFrame,
+    arg: str,
+    npartitions: Optional[int] = None,
+    by: Union[str, List[str], None] = None,
+    max_workers: Optional[int] = None,
+    format: str = 'csv',
+    resources: Optional[ResourceSpec] = None,
+    **kwargs,
+) -> pd.DataFrame:
+    """Calls `func` on partitions of `df` in parallel and concatenates the outputs.
+
+    Args:
+        func (PyRFunc): The function to call.
+        df: The input to split.
+        arg: The argument of `func` receiving each partition.
+        npartitions: Number of partitions. Defaults to `max_workers` without `by`.
+        by: Column(s) whose groups are kept whole within a partition.
+        max_workers: Number of concurrent calls. Defaults to the number of CPUs.
+        format: File format partitions are passed in (`csv`, `feather` or `parquet`).
+        resources: Resources whose CPUs are divided among the concurrent calls; each
+            call keeps the memory limit. Defaults to the function's run manager
+            resources, or all available CPUs.
+        **kwargs: Other arguments of `func`, shared by all partitions.
+    """
+    max_workers = max_workers or os.cpu_count()
+    if by is None and npartitions is None:
+        npartitions = max_workers
+    parts = split_frame(df, npartitions=npartitions, by=by)
+    suffix = OutputFormat(format).suffix
+    _logger.info(f'Mapping {func} over {len(parts)} partitions '
+                 f'with {max_workers} workers.')
+    resources = resources or func.run_manager.resources or ResourceSpec.available()
+    slots = ResourcePool(resources, min(max_workers, len(parts)))
+
+    def run_partition(path):
+        with slots.acquire() as spec:
+            return func.run_manager.run({**shared, arg: path}, resources=spec)
+
+    def write_partition(ix):
+        return write_frame(parts[ix], tmpdir / f'{arg}-{ix}{suffix}')
+
+    with func.run_manager.run_dir() as tmpdir, ThreadPoolExecutor(max_workers) as pool:
+        shared = {}
+        for name, value in kwargs.items():
+            if isinstance(value, pd.DataFrame):
+                value = write_frame(value, tmpdir / f'{name}{suffix}')
+            shared[name] = value
+
+        paths = list(pool.map(write_partition, range(len(parts))))
+        outputs = list(pool.map(run_partition, paths))
+
+    outputs = [output for output in outputs if output is not None]
+    if not outputs:
+        return None
+    return pd.concat(outputs, ignore_index=True)
+
+
+def map_incremental(
+    func,
+    df: pd.DataFrame,
+    arg: str,
+    by: Union[str, List[str]],
+    combine: Optional[Callable[[List[pd.DataFrame]], pd.DataFrame]] = None,
+    cache_dir: Union[str, Path, None] = None,
+    max_workers: Optional[int] = None,
+    format: str = 'parquet',
+    resources: Optional[ResourceSpec] = None,
+    prune: bool = False,
+    **kwargs,
+) -> pd.DataFrame:
+    """Calls `func` on each group of `df`, reusing cached outputs of unchanged groups.
+
+    Each group of `by` is hashed together with the script, the env and the other
+    arguments, and its output is cached under that hash, prefixed by the
+    fingerprint of the other arguments. Only groups that are new or whose rows
+    changed are run, so rerunning over an append-only table costs as much as the
+    appended groups.
+
+    Args:
+        func (PyRFunc): The function to call.
+        df: The input to split.
+        arg: The argument of `func` receiving each group.
+        by: Column(s) defining the groups, e.g. a date.
+        combine: Combines the per-group outputs, in group order. Defaults to
+            concatenating them.
+        cache_dir: Where outputs are cached. Defaults to `cache/<alias>` in the pyrty
+            directory.
+        max_workers: Number of concurrent calls. Defaults to the number of CPUs.
+        format: File format of cached outputs and inputs (`csv`, `feather` or
+            `parquet`).
+        resources: Resources whose CPUs are divided among the concurrent calls.
+        prune: Whether to delete cached outputs of groups no longer in `df`. Only
+            outputs cached with the same other arguments are deleted.
+        **kwargs: Other arguments of `func`, shared by all groups.
+    """
+    if cache_dir is None:
+        cache_dir = _reg_manager.pyrty_dir / 'cache' / func.alias
+    cache_dir = Path(cache_dir)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    suffix = OutputFormat(format).suffix
+    groups = split_frame(df, by=by)
+    if not groups:
+        return None
+
+    shared_digest = hashlib.sha256()
+    for name, value in sorted(kwargs.items()):
+        shared_digest.update(f'{name}={_digest(value)};'.encode())
+    scope = shared_digest.hexdigest()[:16]
+    base = hashlib.sha256()
+    base.update(hash_file(func.script_path).encode())
+    base.update(str(func.env.prefix).encode())
+    base.update(scope.encode())
+    paths = []
+    for group in groups:
+        digest = base.copy()
+        digest.update(hash_frame(group.reset_index(drop=True)).encode())
+        paths.append(cache_dir / f'{scope}-{digest.hexdigest()[:32]}{suffix}')
+
+    todo = [ix for ix, path in enumerate(paths) if not path.exists()]
+    _logger.info(f'Running {func} on {len(todo)} of {len(groups)} groups; '
+                 f'the rest are cached.')
+    if todo:
+        max_workers = max_workers or os.cpu_count()
+        resources = resources or func.run_manager.resources or ResourceSpec.available()
+        slots = ResourcePool(resources, min(max_workers, len(todo)))
+
+        def run_group(ix):
+            input_path = write_frame(groups[ix], tmpdir / f'{arg}-{ix}{suffix}')
+            partial = paths[ix].with_name(f'.{paths[ix].stem}.partial{suffix}')
+            with slots.acquire() as spec:
+                func.run_manager.run({**shared, arg: input_path}, output_path=partial,
+                                     resources=spec)
+            os.replace(partial, paths[ix])
+
+        run_dir = func.run_manager.run_dir()
+        with run_dir as tmpdir, ThreadPoolExecutor(max_workers) as pool:
+            shared = {}
+            for name, value in kwargs.items():
+                if isinstance(value, pd.DataFrame):
+                    value = write_frame(value, tmpdir / f'{name}{suffix}')
+                shared[name] = value
+            list(pool.map(run_group, todo))
+
+    if prune:  # Outputs cached with other arguments are not stale
+        for stale in set(cache_dir.glob(f'{scope}-*{suffix}')) - set(paths):
+            stale.unlink()
+    outputs = [read_frame(path) for path in paths]
+    if combine is not None:
+        return combine(outputs)
+    return pd.concat(outputs, ignore_index=True)
+
+
+def _digest(value) -> str:
+    if isinstance(value, pd.DataFrame):
+        return hash_frame(value)
+    if isinstance(value, FileRef):
+        return value.fingerprint()
+    if isinstance(value, Path):
+        return hash_file(value)
+    return repr(value)
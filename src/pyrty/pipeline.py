@@ -0,0 +1,213 @@
+import hashlib
+import logging
+import os
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+import pandas as pd
+
+from pyrty.refs import FileRef
+from pyrty.registry import RegistryManager
+from pyrty.resources import ResourcePool, ResourceSpec
+from pyrty.script_writers.base_script import OutputFormat
+from pyrty.utils import hash_file, hash_frame, read_frame, write_frame
+
+_logger = logging.getLogger(__name__)
+_reg_manager = RegistryManager()
+
+
+@dataclass(frozen=True)
+class StepRef:
+    """Reference to the output of a pipeline step, used as input to another step."""
+
+    name: str
+
+
+@dataclass
+class Step:
+    name: str
+    func: Any  # PyRFunc
+    inputs: Dict[str, Any]
+
+    @property
+    def upstream(self) -> List[str]:
+        return [v.name for v in self.inputs.values() if isinstance(v, StepRef)]
+
+
+class Pipeline:
+    """Chains `PyRFunc`s, passing intermediates between subprocesses as files.
+
+    Intermediates are written by each script's footer into `run_dir` and handed
+    to downstream scripts as paths, so they are never loaded into this process.
+    Steps whose upstream steps have finished run in parallel, with `resources`
+    (default: all available CPUs) divided among concurrent steps, and each output is
+    cached under a key built from the step's script and its inputs' content hashes.
+
+    Example:
+        pipe = Pipeline()
+        norm = pipe.add('norm', normalize, x=df)
+        feats = pipe.add('feats', featurize, x=norm)
+        pipe.add('model', fit_model, x=norm, features=feats)
+        pipe.run()
+        res = pipe.collect('model')
+    """
+
+    def __init__(
+        self,
+        run_dir: Union[str, Path, None] = None,
+        format: str = 'parquet',
+        max_workers: Optional[int] = None,
+        cache: bool = True,
+        resources: Optional[ResourceSpec] = None,
+    ):
+        if run_dir is None:
+            run_dir = _reg_manager.pyrty_dir / 'runs'
+        self.run_dir = Path(run_dir)
+        self.format = OutputFormat(format)
+        self.max_workers = max_workers
+        self.cache = cache
+        self.resources = resources
+        self.steps: Dict[str, Step] = {}
+        self.outputs: Dict[str, Path] = {}
+
+    def add(self, name: str, func, **inputs) -> StepRef:
+        """Adds a step calling `func` with `inputs`.
+
+        Inputs may be literal values, DataFrames, paths, or `StepRef`s returned by
+        earlier calls to `add` (or `pipeline[name]`).
+        """
+        if name in self.steps:
+            raise ValueError(f'Step {name} already exists.')
+        for value in inputs.values():
+            if isinstance(value, StepRef) and value.name not in self.steps:
+                raise ValueError(f'Unknown upstream step {value.name}.')
+        self.steps[name] = Step(name, func, inputs)
+        return StepRef(name)
+
+    def run(self, targets: Optional[List[str]] = None) -> Dict[str, Path]:
+        """Runs the steps needed for `targets` (default: all).
+
+        Returns the output paths of the steps run.
+        """
+        steps = self._select(targets)
+        self.run_dir.mkdir(parents=True, exist_ok=True)
+
+        n_workers = max(1, min(self.max_workers or len(steps), _max_width(steps)))
+        slots = ResourcePool(self.resources or ResourceSpec.available(), n_workers)
+
+        done: Dict[str, Tuple[Path, str]] = {}
+        pending = dict(steps)
+        running = {}
+        with ThreadPoolExecutor(n_workers) as pool:
+            while pending or running:
+                for name, step in list(pending.items()):
+                    if all(up in done for up in step.upstream):
+                        running[pool.submit(self._run_step, step, done, slots)] = name
+                        del pending[name]
+                finished, __ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    done[running.pop(future)] = future.result()
+
+        self.outputs.update({name: path for name, (path, __) in done.items()})
+        return {name: self.outputs[name] for name in steps}
+
+    def collect(self, name: str) -> pd.DataFrame:
+        """Loads the output of step `name` from the last run."""
+        try:
+            return read_frame(self.outputs[name])
+        except KeyError:
+            raise ValueError(f'Step {name} has not been run.')
+
+    def __getitem__(self, name: str) -> StepRef:
+        if name not in self.steps:
+            raise KeyError(name)
+        return StepRef(name)
+
+    def __repr__(self) -> str:
+        links = [f'{up} -> {step.name}'
+                 for step in self.steps.values() for up in step.upstream]
+        return f'Pipeline({", ".join(links or self.steps)})'
+
+    def _select(self, targets: Optional[List[str]]) -> Dict[str, Step]:
+        if targets is None:
+            return dict(self.steps)
+        selected, stack = set(), list(targets)
+        while stack:
+            name = stack.pop()
+            if name not in self.steps:
+                raise ValueError(f'Unknown step {name}.')
+            if name not in selected:
+                selected.add(name)
+                stack.extend(self.steps[name].upstream)
+        # Preserve insertion order, which is a valid topological order
+        return {name: step for name, step in self.steps.items() if name in selected}
+
+    def _run_step(self, step: Step, done: Dict[str, Tuple[Path, str]],
+                  slots: ResourcePool) -> Tuple[Path, str]:
+        key = self._step_key(step, done)
+        output_path = self.run_dir / f'{step.name}-{key[:16]}{self.format.suffix}'
+        if self.cache and output_path.exists():
+            _logger.info(f'Using cached output for step {step.name}: {output_path}')
+        else:
+            _logger.info(f'Running step {step.name} -> {output_path}')
+            partial_path = output_path.with_name(
+                f'{output_path.stem}.partial{self.format.suffix}')
+            with slots.acquire() as spec:
+                step.func.run_manager.run(self._resolve_inputs(step, done),
+                                          output_path=partial_path, resources=spec)
+            os.replace(partial_path, output_path)
+            _content_hash(output_path, refresh=True)
+        return output_path, _content_hash(output_path)
+
+    def _step_key(self, step: Step, done: Dict[str, Tuple[Path, str]]) -> str:
+        digest = hashlib.sha256()
+        digest.update(hash_file(step.func.script_path).encode())
+        digest.update(str(step.func.env.prefix).encode())
+        for arg, value in sorted(step.inputs.items()):
+            if isinstance(value, StepRef):
+                value = done[value.name][1]
+            elif isinstance(value, pd.DataFrame):
+                value = hash_frame(value)
+            elif isinstance(value, FileRef):
+                value = value.fingerprint()
+            elif isinstance(value, Path):
+                value = hash_file(value)
+            digest.update(f'{arg}={value};'.encode())
+        return digest.hexdigest()
+
+    def _resolve_inputs(self, step: Step,
+                        done: Dict[str, Tuple[Path, str]]) -> Dict[str, Any]:
+        resolved = {}
+        for arg, value in step.inputs.items():
+            if isinstance(value, StepRef):
+                value = done[value.name][0]
+            elif isinstance(value, pd.DataFrame):
+                name = f'input-{hash_frame(value)[:16]}{self.format.suffix}'
+                input_path = self.run_dir / name
+                if not input_path.exists():
+                    write_frame(value, input_path)
+                value = input_path
+            resolved[arg] = value
+        return resolved
+
+
+def _max_width(steps: Dict[str, Step]) -> int:
+    """Largest number of steps at the same depth, i.e. that may run concurrently."""
+    depths = {}
+    for name, step in steps.items():
+        depths[name] = 1 + max((depths[up] for up in step.upstream if up in depths),
+                               default=0)
+    counts = {}
+    for depth in depths.values():
+        counts[depth] = counts.get(depth, 0) + 1
+    return max(counts.values(), default=1)
+
+
+def _content_hash(path: Path, refresh: bool = False) -> str:
+    """Content hash of an intermediate, memoized in a sidecar file next to it."""
+    sidecar = path.with_name(f'{path.name}.sha256')
+    if refresh or not sidecar.exists():
+        sidecar.write_text(hash_file(path))
+    return sidecar.read_text()
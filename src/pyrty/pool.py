@@ -0,0 +1,247 @@
+import itertools
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Union
+
+from pyrty.resources import ResourceSpec, parse_memory
+from pyrty.workers import Worker
+
+_logger = logging.getLogger(__name__)
+
+
+def process_rss(pid: int) -> Optional[int]:
+    """Resident set size of process `pid` in bytes, from `/proc` (`None` without it)."""
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) << 10
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+@dataclass(frozen=True)
+class PoolDecision:
+    """A scaling or recycling decision, as recorded in `WorkerPool.decisions`."""
+
+    time: float
+    action: str  # 'scale_up', 'scale_down', 'recycle' or 'hold'
+    reason: str
+    workers: int
+
+
+class WorkerPool:
+    """Workers for one function, scaled between bounds on queue depth and memory.
+
+    Each worker is a serial `Worker` running one call at a time. A worker is added
+    when calls are queued and no worker is idle, unless `max_workers` are running or
+    the pool's estimated memory (the observed RSS of its workers, plus the largest
+    of them for the new one) would exceed `memory_budget`. Workers idle for
+    `idle_timeout` seconds are stopped, down to `min_workers`. A worker is recycled
+    (replaced by a fresh one) after `max_calls` calls, or once its RSS exceeds
+    `max_rss`, which bounds the growth of long-lived R sessions.
+
+    Every decision is logged and kept in `decisions`; `metrics()` summarizes the
+    pool's state.
+
+    Args:
+        func: The function to serve.
+        min_workers: Workers kept running, started with the pool.
+        max_workers: Upper bound on workers.
+        max_calls: Calls after which a worker is recycled (`None` for no limit).
+        max_rss: RSS after which a worker is recycled, in bytes or as e.g. `'2G'`.
+        memory_budget: Bound on the workers' total RSS when scaling up.
+        idle_timeout: Seconds a worker above `min_workers` may stay idle.
+        format: File format results are handed back in.
+        resources: Resources granted to each worker.
+    """
+
+    def __init__(
+        self,
+        func,
+        min_workers: int = 1,
+        max_workers: int = 4,
+        max_calls: Optional[int] = None,
+        max_rss: Union[int, str, None] = None,
+        memory_budget: Union[int, str, None] = None,
+        idle_timeout: float = 60.0,
+        format: str = 'csv',
+        resources: Optional[ResourceSpec] = None,
+    ):
+        if not 0 <= min_workers <= max_workers or max_workers < 1:
+            raise ValueError('Need 0 <= min_workers <= max_workers '
+                             'and max_workers >= 1.')
+        self.func = func
+        self.min_workers = min_workers
+        self.max_workers = max_workers
+        self.max_calls = max_calls
+        self.max_rss = parse_memory(max_rss) if max_rss is not None else None
+        self.memory_budget = (parse_memory(memory_budget) if memory_budget is not None
+                              else None)
+        self.idle_timeout = idle_timeout
+        self.format = format
+        self.resources = resources
+        self.decisions = deque(maxlen=1000)
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._slots = 0  # Worker threads, including those still starting their worker
+        self._busy = 0
+        self._rss: Dict[int, int] = {}  # Last observed RSS, by slot
+        self._slot_ids = itertools.count()
+        self._threads: List[threading.Thread] = []
+        self._counts = dict(calls=0, errors=0, scale_ups=0, scale_downs=0, recycled=0)
+        self._held = False
+        self._closed = False
+        for __ in range(min_workers):
+            self._spawn('min_workers')
+
+    def submit(self, input: Optional[Dict[str, Any]] = None) -> Future:
+        """Queues a call to the function; the future resolves to its result."""
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError('The pool is closed.')
+            self._queue.put((input, future))
+            self._scale_up()
+        return future
+
+    def call(self, input: Optional[Dict[str, Any]] = None):
+        return self.submit(input).result()
+
+    __call__ = call
+
+    def metrics(self) -> Dict[str, Any]:
+        """Current state and cumulative counts of the pool."""
+        with self._lock:
+            rss = dict(self._rss)
+            return dict(self._counts, workers=self._slots, busy=self._busy,
+                        idle=self._slots - self._busy, queue_depth=self._queue.qsize(),
+                        rss=sorted(rss.values()), rss_total=sum(rss.values()))
+
+    def close(self) -> None:
+        """Stops the workers once the queued calls are done."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            slots, threads = self._slots, list(self._threads)
+        for __ in range(slots):
+            self._queue.put(None)
+        for thread in threads:
+            thread.join()
+
+    def _scale_up(self) -> None:
+        idle = self._slots - self._busy
+        if self._queue.qsize() <= idle or self._slots >= self.max_workers:
+            return
+        if self.memory_budget is not None and self._rss:
+            estimate = sum(self._rss.values()) + max(self._rss.values())
+            if estimate > self.memory_budget:
+                # Recorded once until the pool scales again, not per call
+                if not self._held:
+                    self._record('hold', f'estimated RSS {estimate} '
+                                         f'over budget {self.memory_budget}')
+                    self._held = True
+                return
+        self._held = False
+        self._spawn(f'queue depth {self._queue.qsize()} with {idle} idle')
+
+    def _spawn(self, reason: str) -> None:
+        self._slots += 1
+        self._counts['scale_ups'] += 1
+        self._record('scale_up', reason)
+        thread = threading.Thread(target=self._serve, args=(next(self._slot_ids),),
+                                  daemon=True)
+        self._threads = [t for t in self._threads if t.is_alive()] + [thread]
+        thread.start()
+
+    def _serve(self, slot: int) -> None:
+        worker, calls, retired = None, 0, False
+        try:
+            while True:
+                try:
+                    task = self._queue.get(timeout=self.idle_timeout)
+                except queue.Empty:
+                    with self._lock:
+                        if self._slots > self.min_workers and not self._closed:
+                            self._slots -= 1
+                            self._counts['scale_downs'] += 1
+                            self._record('scale_down', f'idle for {self.idle_timeout}s')
+                            retired = True
+                            return
+                    continue
+                if task is None:
+                    return
+                input, future = task
+                with self._lock:
+                    self._busy += 1
+                try:
+                    if worker is None or not worker.alive:
+                        worker, calls = self._start_worker(), 0
+                    future.set_result(worker.call(self.func, input))
+                except Exception as e:
+                    with self._lock:
+                        self._counts['errors'] += 1
+                    future.set_exception(e)
+                finally:
+                    with self._lock:
+                        self._busy -= 1
+                        self._counts['calls'] += 1
+                calls += 1
+                if worker is not None and self._should_recycle(slot, worker, calls):
+                    worker.close()
+                    worker = None
+        finally:
+            if worker is not None:
+                worker.close()
+            with self._lock:
+                self._rss.pop(slot, None)
+                if not retired:
+                    self._slots -= 1
+
+    def _start_worker(self) -> Worker:
+        worker = Worker(self.func.env, self.func.script.lang, format=self.format,
+                        resources=self.resources)
+        worker.start()
+        worker.define(self.func)
+        return worker
+
+    def _should_recycle(self, slot: int, worker: Worker, calls: int) -> bool:
+        rss = process_rss(worker.pid) if worker.alive else None
+        with self._lock:
+            if rss is not None:
+                self._rss[slot] = rss
+            if not worker.alive:
+                reason = 'worker exited'
+            elif self.max_calls is not None and calls >= self.max_calls:
+                reason = f'{calls} calls'
+            elif self.max_rss is not None and rss is not None and rss > self.max_rss:
+                reason = f'RSS {rss} over {self.max_rss}'
+            else:
+                return False
+            self._rss.pop(slot, None)
+            self._counts['recycled'] += 1
+            self._record('recycle', reason)
+        return True
+
+    def _record(self, action: str, reason: str) -> None:
+        decision = PoolDecision(time.time(), action, reason, self._slots)
+        self.decisions.append(decision)
+        _logger.info(f'{self.func.alias} pool: {action} ({reason}); '
+                     f'{self._slots} workers.')
+
+    def __enter__(self) -> 'WorkerPool':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def __str__(self) -> str:
+        return (f'Worker pool for {self.func.alias} '
+                f'({self._slots}/{self.max_workers} workers)')
@@ -0,0 +1,80 @@
+import logging
+import subprocess
+import threading
+import time
+from concurrent.futures import Future
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from typing import Optional, Union
+
+_logger = logging.getLogger(__name__)
+
+SHARED_LIB_PATTERNS = ('*.so', '*.so.*', '*.dylib')
+
+
+def touch_shared_libs(prefix: Union[str, Path], max_bytes: Optional[int] = None,
+                      chunk_size: int = 1 << 20) -> int:
+    """Reads the shared libraries under `prefix/lib` into the page cache.
+
+    Returns the bytes read, at most `max_bytes` if given.
+    """
+    lib_dir = Path(prefix) / 'lib'
+    touched = 0
+    for pattern in SHARED_LIB_PATTERNS:
+        for path in lib_dir.rglob(pattern):
+            if max_bytes is not None and touched >= max_bytes:
+                return touched
+            try:
+                with open(path, 'rb', buffering=0) as f:
+                    while True:
+                        chunk = f.read(chunk_size)
+                        if not chunk:
+                            break
+                        touched += len(chunk)
+            except OSError:  # Dangling links, unreadable files
+                continue
+    return touched
+
+
+def load_libraries(env, writer, timeout: Optional[float] = 600.0) -> None:
+    """Starts the env's interpreter for `writer`'s language and loads its libraries."""
+    imports = writer.make_imports() if hasattr(writer, 'make_imports') else None
+    with TemporaryDirectory(prefix='pyrty-prewarm-') as tmpdirname:
+        script_path = Path(tmpdirname) / f'prewarm.{writer._ext}'
+        script_path.write_text((imports or '') + '\n')
+        cmd = env.get_run_in_env_cmd(f'{env.find_exe(type(writer)._exe)} {script_path}')
+        subprocess.run(cmd.split(' '), stdin=subprocess.DEVNULL,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                       timeout=timeout, check=True)
+
+
+def prewarm(func, shared_libs: bool = True, libraries: bool = True) -> Future:
+    """Warms up `func` in a background thread, so that its first call sees warm latency.
+
+    Touches the shared libraries of `func`'s env, then starts its interpreter once
+    and loads the script's libraries. The returned future resolves to the seconds
+    spent, or to the error; failures are only logged, as the first call will warm
+    up anyway.
+    """
+    future = Future()
+
+    def run():
+        start = time.perf_counter()
+        try:
+            if shared_libs:
+                touched = touch_shared_libs(func.env.prefix)
+                _logger.debug(f'Touched {touched} bytes of shared libraries '
+                              f'in {func.env.prefix}.')
+            if libraries:
+                load_libraries(func.env, func.script.script_writer)
+        except Exception as e:
+            _logger.warning(f'Could not prewarm {func.alias}: {e}')
+            future.set_exception(e)
+            return
+        elapsed = time.perf_counter() - start
+        _logger.info(f'Prewarmed {func.alias} in {elapsed:.2f}s.')
+        future.set_result(elapsed)
+
+    name = f'pyrty-prewarm-{func.alias}'
+    threading.Thread(target=run, name=name, daemon=True).start()
+    return future
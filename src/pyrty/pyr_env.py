@@ -28,6 +28,10 @@ class PyREnv:
         """Executes a command in the environment using the selected environment creator."""
         return self.env_manager.get_run_cmd(cmd)
     
+    def find_exe(self, name: str) -> str:
+        """Path of executable `name` inside the environment."""
+        return self.env_manager.find_exe(name)
+
     @classmethod
     def from_existing(cls, manager: str, name: str, prefix: str) -> 'PyREnv':
         """Creates a PyREnv object from an existing environment."""
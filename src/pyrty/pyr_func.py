@@ -1,21 +1,42 @@
 import atexit
 import logging
+import os
 import re
+import time
+from concurrent.futures import Future
 from pathlib import Path
-from typing import List, Union, Dict
+from typing import List, Optional, Union, Dict
 
+import pandas as pd
+
+from pyrty.accounting import CallMetadata, usage_log
+from pyrty.partitions import map_incremental, map_partitions
 from pyrty.pyr_env import PyREnv
+from pyrty.prewarm import prewarm
 from pyrty.pyr_script import PyRScript
 from pyrty.registry import DBManager, RegistryManager
+from pyrty.results import LazyResult, materialize, run_to_sink, spill_path
 from pyrty.run_manager import RunManager
 from pyrty.script_writers.base_script import OutputType
+from pyrty.server import DaemonClient
+from pyrty.utils import as_captured
+from pyrty.workers import ForkServer
 
 _logger = logging.getLogger(__name__)
 _reg_manager = RegistryManager()
 _db_manager = DBManager(db_dir=_reg_manager.pyrty_dir)
+HISTORY_ENV_VAR = 'PYRTY_CALL_HISTORY'  # Set to '0' to not record calls
 
 
 class PyRFunc:
+    # Set by `use_daemon`; not pickled
+    _daemon = None
+    _daemon_alias = None
+    _prewarm = None  # Set by `prewarm`; not pickled
+    # Where calls are recorded for `stats`; `None` to not record them. Not pickled
+    history: Optional[DBManager] = (
+        _db_manager if os.environ.get(HISTORY_ENV_VAR) != '0' else None)
+
     def __init__(self, alias: str, script: PyRScript = None, env: PyREnv = None, keep: bool = True):
         self.alias = alias
         self.script = script
@@ -25,10 +46,94 @@ class PyRFunc:
         self._args = []
         self._delete_funcs = set()
 
-    def __call__(self, input=None):
-        output = self.run_manager.run(input)
+    def __call__(self, input=None, resources=None, spill: bool = False,
+                 spill_format: str = 'arrow', sink: Union[str, Path] = None,
+                 compression: str = None, compact: bool = False,
+                 backend: str = 'pandas'):
+        """Runs the function.
+
+        With `spill=True`, the script writes its result to `pyrty.results.results_dir()`
+        and a `LazyResult` handle on the file is returned instead of a DataFrame.
+        With `sink`, the script writes its result to that file and only a `SinkResult`
+        (path, rows, bytes, duration) is returned; see `pyrty.results.run_to_sink`.
+        Otherwise the result is returned as a DataFrame, with compact dtypes if
+        `compact=True`, or as a table of another `backend`; see
+        `pyrty.results.materialize`.
+
+        After `use_daemon`, calls without `spill`, `sink` or `resources` go to the
+        daemon, unless the run manager has its own executor or resources. Their
+        results are returned as from a local run.
+
+        The call's resource usage is kept as a `CallMetadata` in `attrs['pyrty']` of
+        DataFrame results and in `metadata` of lazy and sink results, with the
+        result's size before and after materializing in its `memory`, and added to
+        the totals of the function's alias (see `usage`). Unless `history` is `None`,
+        the call is also recorded in its database (see `stats`).
+        """
+        metadata = CallMetadata(self.alias)
+        started, start = time.time(), time.perf_counter()
+        try:
+            if sink is not None:
+                output = run_to_sink(self.run_manager, input, sink,
+                                     compression=compression, resources=resources,
+                                     metadata=metadata)
+            elif spill:
+                output_path = self.run_manager.run(
+                    input, output_path=spill_path(self.alias, spill_format),
+                    resources=resources, metadata=metadata)
+                output = LazyResult(output_path)
+            elif self._daemon is not None and self._routable(resources):
+                output = self._call_daemon(input)
+            else:
+                output = self.run_manager.run(input, resources=resources,
+                                              metadata=metadata)
+        except Exception:
+            metadata.duration = time.perf_counter() - start
+            self._record_call(metadata, started, failed=True)
+            raise
+
+        executed = time.perf_counter()
+        if isinstance(output, pd.DataFrame) and (compact or backend != 'pandas'):
+            output = materialize(output, backend, compact=compact, metadata=metadata)
+        if isinstance(output, pd.DataFrame):
+            output.attrs['pyrty'] = metadata
+        elif isinstance(output, LazyResult):
+            output.metadata = metadata
+        metadata.phases['postprocess'] = time.perf_counter() - executed
+        metadata.duration = time.perf_counter() - start
+        self._record_call(metadata, started)
         return output
 
+    def usage(self) -> Dict:
+        """Totals of this process's calls to the function; see `pyrty.accounting`."""
+        return usage_log.totals(self.alias)
+
+    def stats(self, **kwargs):
+        """Latency and throughput of recorded calls; see `DBManager.stats`."""
+        return (self.history or _db_manager).stats(self.alias, **kwargs)
+
+    def map_partitions(self, df, arg: str, npartitions: int = None, by=None,
+                       max_workers: int = None, format: str = 'csv', resources=None,
+                       **kwargs):
+        """Calls the function on partitions of `df` in parallel, concatenating outputs.
+
+        See `pyrty.partitions.map_partitions`.
+        """
+        return map_partitions(self, df, arg, npartitions=npartitions, by=by,
+                              max_workers=max_workers, format=format,
+                              resources=resources, **kwargs)
+
+    def incremental(self, df, arg: str, by, combine=None, cache_dir=None,
+                    max_workers: int = None, format: str = 'parquet', resources=None,
+                    prune: bool = False, **kwargs):
+        """Calls the function on each group of `df`, rerunning new or changed groups.
+
+        See `pyrty.partitions.map_incremental`.
+        """
+        return map_incremental(self, df, arg, by, combine=combine, cache_dir=cache_dir,
+                               max_workers=max_workers, format=format,
+                               resources=resources, prune=prune, **kwargs)
+
     def __getstate__(self):
         if not all(hasattr(self, attr) for attr in ['env', 'script', 'run_manager', '_delete_funcs']):
             raise AttributeError("Object is missing required attributes for serialization.")
@@ -46,11 +151,46 @@ class PyRFunc:
     def add_script(self, lang: str, script_kwargs: Dict) -> None:
         self.script = PyRScript(lang, script_kwargs)
 
-    def register(self, overwrite: bool = False) -> None:
+    def fork_server(self, **kwargs) -> ForkServer:
+        """A fork-server for the function: libraries load once, each call forks a child.
+
+        Use as a context manager, or call `start()` and `close()` explicitly.
+        """
+        return ForkServer(self, **kwargs)
+
+    def use_daemon(self, socket_path: Union[str, Path] = None,
+                   alias: str = None) -> bool:
+        """Routes calls to the `pyrty serve` daemon on `socket_path`, if one is serving.
+
+        `alias` is the name the daemon knows the function by (default: `self.alias`).
+        Returns whether calls will be routed.
+        """
+        self._daemon = DaemonClient.connect(socket_path)
+        self._daemon_alias = alias or self.alias
+        if self._daemon is not None:
+            _logger.info(f'Routing calls to {self._daemon_alias} '
+                         f'through {self._daemon}.')
+        return self._daemon is not None
+
+    def prewarm(self, **kwargs) -> Future:
+        """Warms up the env and the script's libraries in the background.
+
+        See `pyrty.prewarm.prewarm`; the future resolves once warm.
+        """
+        self._prewarm = prewarm(self, **kwargs)
+        return self._prewarm
+
+    def set_executor(self, executor, **executor_kwargs) -> None:
+        """Selects where calls run: `'local'`, `'pool'`, `'batch'` or an executor."""
+        self.run_manager.set_executor(executor, **executor_kwargs)
+
+    def register(self, overwrite: bool = False, prewarm: bool = False) -> None:
         if self.registered and not overwrite:
             raise ValueError(f'{self.alias} is already registered.')
         self._create_func()
         _db_manager.register(self.alias, self)
+        if prewarm:
+            self.prewarm()
 
     def unregister(self):
         _db_manager.unregister(self.alias)
@@ -61,6 +201,36 @@ class PyRFunc:
                 func()
             self._delete_funcs.clear()
 
+    def _record_call(self, metadata: CallMetadata, started: float,
+                     failed: bool = False) -> None:
+        usage_log.record(metadata, failed=failed)
+        if self.history is None:
+            return
+        script_version = ''
+        if self.script is not None:
+            script_version = self.script.script_writer.versioned_path.name
+        env = str(self.env.prefix) if self.env is not None else ''
+        self.history.record_call(self.alias, metadata, started,
+                                 script_version=script_version, env=env, failed=failed)
+
+    def _routable(self, resources) -> bool:
+        # The daemon runs calls its own way, so calls needing a given backend or
+        # resources stay local
+        if resources is not None:
+            return False
+        return self.run_manager is None or (self.run_manager.executor is None and
+                                            self.run_manager.resources is None)
+
+    def _call_daemon(self, input):
+        try:
+            output = self._daemon.call(self._daemon_alias, input)
+        except (ConnectionError, FileNotFoundError) as e:
+            _logger.warning(f'Lost the daemon ({e}); running {self.alias} locally.')
+            self._daemon = None
+            return self.run_manager.run(input)
+        # The daemon hands back typed tables; match what a local run captures
+        return as_captured(output) if isinstance(output, pd.DataFrame) else output
+
     def _create_func(self):
         # Check for conflicts
         self._resolve_conflicts()
@@ -81,6 +251,7 @@ class PyRFunc:
         # --
         # TODO: Temp for development
         if self.script.lang == 'R':
+            csv_engine = self.script.script_writer.csv_engine
             if (self.env.manager in ['conda', 'mamba'] and
                 not self.env.env_manager.envfile and
                 not self.env.env_exists):
@@ -88,12 +259,17 @@ class PyRFunc:
                 self.env.env_manager.add_channel('r')
                 self.env.env_manager.add_dependency = 'r-essentials'
                 self.env.env_manager.add_dependency = 'r-base'
+                if csv_engine == 'data.table':
+                    self.env.env_manager.add_dependency = 'r-data.table'
 
             if self.script.script_writer.args:
                 self.script.script_writer.add_lib('optparse')
 
             if self.script.script_writer.ret:
-                if self.script.script_writer.output_type == OutputType.DF:
+                # data.table is only called through its namespace, not attached, so that
+                # it does not mask e.g. dplyr's `between` and `first` in the body
+                output_type = self.script.script_writer.output_type
+                if output_type == OutputType.DF and csv_engine == 'readr':
                     self.script.script_writer.add_lib('readr')
         # --
 
@@ -113,6 +289,9 @@ class PyRFunc:
         env_kwargs: Dict = None,
         script_kwargs: Dict = None,
         register: bool = True,
+        prewarm: bool = False,
+        blas: str = None,
+        csv_engine: str = None,
     ):        
         # --
         # TODO: Refactor this logic to use a builder pattern
@@ -121,6 +300,8 @@ class PyRFunc:
             env_kwargs['envfile'] = envfile
             env_kwargs['name'] = f'{alias}-env'
             env_kwargs['prefix'] = prefix or _reg_manager.envs / f'{alias}-env'
+            if blas:  # BLAS variant, see `CondaEnv.with_blas`
+                env_kwargs['blas'] = blas
             
             # `deps` parsing
             if isinstance(deps, dict):
@@ -149,6 +330,8 @@ class PyRFunc:
                     raise NotImplementedError
             elif isinstance(deps, list):
                 script_kwargs['libs'] = deps # Assume they're already parsed
+            if csv_engine:  # R only: 'readr' or 'data.table', see `RScriptWriter`
+                script_kwargs['csv_engine'] = csv_engine
         
         # --
         
@@ -156,20 +339,29 @@ class PyRFunc:
         pyr_func = cls(alias, keep=register)
         pyr_func.add_env(manager, env_kwargs)
         pyr_func.add_script(lang, script_kwargs)
-        pyr_func.register()
+        pyr_func.register(prewarm=prewarm)
 
         return pyr_func
 
     @classmethod
-    def from_registry(cls, alias: str, alias_new: str = None):
+    def from_registry(cls, alias: str, alias_new: str = None, daemon: bool = False,
+                      prewarm: bool = False):
         """
         Notes:
             Can rename the registered alias by passing in `alias_new`. Might be useful
             to allow for multiple aliases to point to the same function, multiple versions
             but with different python class attributes, etc.
+
+            With `daemon=True`, calls go to the `pyrty serve` daemon when it is running
+            (see `use_daemon`). With `prewarm=True`, calls running locally are warmed
+            up in the background (see `prewarm`).
         """
         func = _db_manager.from_registry(alias)
         setattr(func, 'alias', alias_new or alias)
+        if daemon:
+            func.use_daemon(alias=alias)
+        if prewarm and func._daemon is None:
+            func.prewarm()
         return func
 
     @property
@@ -0,0 +1,138 @@
+import hashlib
+from dataclasses import dataclass
+from numbers import Number
+from pathlib import Path
+from typing import Any, Optional, Sequence, Tuple, Union
+
+from pyrty.script_writers.base_script import OutputFormat
+from pyrty.utils import hash_file
+
+REF_SUFFIX = '.pyrtyref'
+FILTER_OPS = ('==', '!=', '<', '<=', '>', '>=', 'in')
+
+Filter = Tuple[str, str, Any]
+
+
+@dataclass(frozen=True)
+class FileRef:
+    """A table on disk, passed to a script by path instead of being loaded by pyrty.
+
+    The script's `pyrty_read` opens the file with the reader for its format. With
+    `columns` or `filters`, pyrty instead hands over a small `.pyrtyref` spec, and
+    `pyrty_read` opens the file as an Arrow dataset with the projection and filters
+    pushed down, so only the selected rows and columns are read.
+
+    Filters are `(column, op, value)` tuples, combined with "and"; `op` is one of
+    `FILTER_OPS`, and values are numbers or strings (a list of them for `'in'`).
+
+    Example:
+        ref = FileRef('events.parquet', columns=['user', 'ts'],
+                      filters=[('year', '>=', 2020)])
+        func({'x': ref})
+    """
+
+    path: Union[str, Path]
+    format: Optional[str] = None  # Inferred from the file extension
+    columns: Optional[Sequence[str]] = None
+    filters: Optional[Sequence[Filter]] = None
+
+    def __post_init__(self):
+        # Scripts may run from another directory
+        path = Path(self.path).expanduser().resolve()
+        if self.format is None:
+            try:
+                format = OutputFormat(path.suffix.lstrip('.'))
+            except ValueError:
+                raise ValueError(f'Cannot infer the format of {path}; pass `format`.')
+        else:
+            format = OutputFormat(self.format)
+        object.__setattr__(self, 'path', path)
+        object.__setattr__(self, 'format', format)
+        for column in self.columns or []:
+            _check_token(column, 'Column names')
+        for condition in self.filters or []:
+            _format_filter(condition)
+
+    @property
+    def needs_spec(self) -> bool:
+        """Whether the script needs a spec to open this reference, not the bare path."""
+        return (bool(self.columns or self.filters)
+                or self.path.suffix != self.format.suffix)
+
+    def spec(self) -> str:
+        """The reference as a DCF record, as read by the scripts' `pyrty_read`."""
+        lines = [f'path: {self.path}', f'format: {self.format.value}']
+        if self.columns:
+            lines.append(f'columns: {",".join(self.columns)}')
+        if self.filters:
+            lines.append(f'filter: {"; ".join(map(_format_filter, self.filters))}')
+        return '\n'.join(lines) + '\n'
+
+    def resolve(self, run_dir: Union[str, Path], name: str = 'ref') -> Path:
+        """The path handed to the script: the file, or a spec written to `run_dir`."""
+        if not self.needs_spec:
+            return self.path
+        spec_path = Path(run_dir) / f'{name}{REF_SUFFIX}'
+        spec_path.write_text(self.spec())
+        return spec_path
+
+    def fingerprint(self) -> str:
+        """Hash of the spec and the referenced data, for cache keys."""
+        digest = hashlib.sha256(self.spec().encode())
+        if self.path.is_file():
+            digest.update(hash_file(self.path).encode())
+        else:
+            for path in sorted(p for p in self.path.rglob('*') if p.is_file()):
+                stat = path.stat()
+                name = path.relative_to(self.path)
+                digest.update(f'{name}:{stat.st_size}:{stat.st_mtime_ns};'.encode())
+        return digest.hexdigest()
+
+
+@dataclass(frozen=True)
+class DatasetRef(FileRef):
+    """A directory of files read as one table, e.g. a Hive-partitioned Parquet dataset.
+
+    Partition columns (`year=2020/...`) are discovered from the directory names and
+    can be used in `columns` and `filters` like any other column.
+    """
+
+    format: Optional[str] = 'parquet'
+
+    @property
+    def needs_spec(self) -> bool:
+        return True
+
+
+def _format_filter(condition: Filter) -> str:
+    try:
+        column, op, value = condition
+    except (TypeError, ValueError):
+        raise ValueError(f'Filters must be (column, op, value) tuples, '
+                         f'got {condition!r}.')
+    _check_token(column, 'Column names')
+    if op not in FILTER_OPS:
+        raise ValueError(f'Unsupported filter operator {op!r}; '
+                         f'use one of {FILTER_OPS}.')
+    if op == 'in':
+        if (isinstance(value, (str, bytes)) or not isinstance(value, Sequence)
+                or not value):
+            raise ValueError(f"The 'in' filter on {column} needs a non-empty list "
+                             f"of values.")
+        return f'{column} in {",".join(map(_format_value, value))}'
+    return f'{column} {op} {_format_value(value)}'
+
+
+def _format_value(value) -> str:
+    if isinstance(value, str):
+        _check_token(value, 'String filter values', allow_space=True)
+        return f"'{value}'"
+    if isinstance(value, Number) and not isinstance(value, bool):
+        return str(value)
+    raise ValueError(f'Filter values must be numbers or strings, got {value!r}.')
+
+
+def _check_token(token: str, what: str, allow_space: bool = False) -> None:
+    reserved = ",;'\n" + ('' if allow_space else ' ')
+    if any(c in reserved for c in token):
+        raise ValueError(f'{what} may not contain any of {reserved!r}: {token!r}.')
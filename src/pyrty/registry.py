@@ -1,14 +1,139 @@
+import atexit
 import os
 import pickle
+import re
 import sqlite3
+import threading
+import time
+import weakref
 from pathlib import Path
+from typing import Any, Dict, List, Optional, Union
+
+import numpy as np
+import pandas as pd
+
+_window_units = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+# One `CallHistory` per database table, shared by the `DBManager`s using it
+_histories: 'weakref.WeakValueDictionary[tuple, CallHistory]' = (
+    weakref.WeakValueDictionary())
+_histories_lock = threading.Lock()
+
+
+class CallHistory:
+    """Per-call records in a table of the registry database, written in batches.
+
+    Records are buffered and inserted together once `batch_size` are pending,
+    `flush_interval` seconds after the first of them, or at interpreter exit, so
+    calls do not wait on the database. Only the latest `max_rows` records are kept
+    (all if `None`).
+    """
+
+    columns = ('alias', 'script_version', 'env', 'started', 'duration', 'prepare',
+               'execute', 'postprocess', 'bytes_in', 'bytes_out', 'cpu_time', 'max_rss',
+               'returncode', 'failed')
+
+    def __init__(self, db_filename: str, table_name: str = 'calls',
+                 batch_size: int = 100, flush_interval: float = 5.0,
+                 max_rows: Optional[int] = 100_000):
+        self.db_filename = db_filename
+        self.table_name = table_name
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_rows = max_rows
+        self._pending: List[tuple] = []
+        self._lock = threading.Lock()
+        self._timer = None
+        self._init_table()
+
+    @classmethod
+    def shared(cls, db_filename: str, table_name: str = 'calls') -> 'CallHistory':
+        """The history of `table_name` in `db_filename`, created on first use."""
+        key = (os.path.realpath(db_filename), table_name)
+        with _histories_lock:
+            history = _histories.get(key)
+            if history is None:
+                history = _histories[key] = cls(db_filename, table_name)
+            return history
+
+    def add(self, **record) -> None:
+        """Buffers a record; missing columns are stored as NULL."""
+        row = tuple(record.get(column) for column in self.columns)
+        with self._lock:
+            self._pending.append(row)
+            full = len(self._pending) >= self.batch_size
+            if not full and self._timer is None:
+                self._timer = threading.Timer(self.flush_interval, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+        if full:
+            self.flush()
+
+    def flush(self) -> int:
+        """Writes the buffered records, and returns how many there were."""
+        with self._lock:
+            rows, self._pending = self._pending, []
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        if rows:
+            placeholders = ', '.join('?' * len(self.columns))
+            with sqlite3.connect(self.db_filename) as conn:
+                conn.executemany(f"INSERT INTO {self.table_name} "
+                                 f"({', '.join(self.columns)}) VALUES ({placeholders})",
+                                 rows)
+                if self.max_rows is not None:
+                    conn.execute(f"DELETE FROM {self.table_name} WHERE id <= "
+                                 f"(SELECT id FROM {self.table_name} ORDER BY id DESC "
+                                 f"LIMIT 1 OFFSET ?)", (self.max_rows,))
+        return len(rows)
+
+    def records(self, alias: Optional[str] = None,
+                since: Optional[float] = None) -> pd.DataFrame:
+        """Records of `alias` (or all), started at or after the Unix time `since`."""
+        self.flush()
+        query = f"SELECT {', '.join(self.columns)} FROM {self.table_name} WHERE 1 = 1"
+        params = []
+        if alias is not None:
+            query += " AND alias = ?"
+            params.append(alias)
+        if since is not None:
+            query += " AND started >= ?"
+            params.append(since)
+        with sqlite3.connect(self.db_filename) as conn:
+            return pd.read_sql_query(query + " ORDER BY started", conn, params=params)
+
+    def _init_table(self):
+        with sqlite3.connect(self.db_filename) as conn:
+            conn.execute(f'''
+                CREATE TABLE IF NOT EXISTS {self.table_name} (
+                    id INTEGER PRIMARY KEY,
+                    alias TEXT NOT NULL,
+                    script_version TEXT,
+                    env TEXT,
+                    started REAL NOT NULL,
+                    duration REAL,
+                    prepare REAL,
+                    execute REAL,
+                    postprocess REAL,
+                    bytes_in INTEGER,
+                    bytes_out INTEGER,
+                    cpu_time REAL,
+                    max_rss INTEGER,
+                    returncode INTEGER,
+                    failed INTEGER
+                )
+            ''')
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {self.table_name}_alias_started "
+                         f"ON {self.table_name} (alias, started)")
 
 
 class DBManager:
-    def __init__(self, db_filename='registry.db', table_name='registry', db_dir: Path = None):
+    def __init__(self, db_filename='registry.db', table_name='registry',
+                 db_dir: Path = None, history_table='calls'):
         self.db_filename = str(db_dir / db_filename) if db_dir is not None else str(_get_default_dir() / db_filename)
         self.table_name = table_name
         self._init_db()
+        self.history = CallHistory.shared(self.db_filename, history_table)
 
     def entry_exists(self, name):
         with sqlite3.connect(self.db_filename) as conn:
@@ -55,6 +180,67 @@ class DBManager:
             pyr_func.cleanup()
             pyr_func.unregister()
 
+    def record_call(self, alias: str, metadata, started: float,
+                    script_version: str = '', env: str = '',
+                    failed: bool = False) -> None:
+        """Adds a call, described by its `pyrty.accounting.CallMetadata`, to history."""
+        self.history.add(alias=alias, script_version=script_version, env=env,
+                         started=started, duration=metadata.duration,
+                         bytes_in=metadata.bytes_in, bytes_out=metadata.bytes_out,
+                         cpu_time=metadata.cpu_time,
+                         max_rss=metadata.max_rss, returncode=metadata.returncode,
+                         failed=int(failed), **metadata.phases)
+
+    def stats(self, alias: str, window: Union[str, float, None] = None,
+              since: Union[str, float, None] = None,
+              by_version: bool = False) -> pd.DataFrame:
+        """Latency percentiles (in seconds) and throughput of `alias`'s recorded calls.
+
+        Args:
+            alias: The function.
+            window: Length of the time windows to summarize separately, in seconds or
+                as e.g. `'15m'`, `'1h'` or `'1d'`; `None` for a single summary.
+            since: Only calls from the last `since` (e.g. `'7d'`), or after a Unix time
+                when given a number.
+            by_version: Summarize each script version separately, e.g. to spot a
+                regression after the script changed.
+
+        Returns:
+            One row per window (indexed by its start) and/or script version, with the
+            number of calls and failures, p50/p95/p99 and mean duration, mean CPU time,
+            and throughput in calls per second.
+        """
+        if isinstance(since, str):
+            since = time.time() - _parse_window(since)
+        df = self.history.records(alias, since=since)
+        keys = []
+        if window is not None:
+            seconds = _parse_window(window)
+            df['window'] = pd.to_datetime(df.started // seconds * seconds, unit='s')
+            keys.append('window')
+        if by_version:
+            keys.append('script_version')
+        if not keys:
+            df['alias'] = alias
+            keys.append('alias')
+
+        def summarize(group: pd.DataFrame) -> pd.Series:
+            durations = group.duration.to_numpy(dtype=float)
+            p50, p95, p99 = np.percentile(durations, [50, 95, 99])
+            if window is not None:
+                span = seconds
+            else:
+                span = (group.started + group.duration).max() - group.started.min()
+            return pd.Series(dict(calls=len(group), failures=int(group.failed.sum()),
+                                  p50=p50, p95=p95, p99=p99, mean=durations.mean(),
+                                  cpu_time=group.cpu_time.mean(),
+                                  throughput=(len(group) / span if span and span > 0
+                                              else np.nan)))
+        if df.empty:
+            return pd.DataFrame(columns=['calls', 'failures', 'p50', 'p95', 'p99',
+                                         'mean', 'cpu_time', 'throughput'])
+        return df.groupby(keys).apply(summarize).astype({'calls': int, 'failures': int})
+
     def _init_db(self):
         with sqlite3.connect(self.db_filename) as conn:
             conn.execute(f'''
@@ -99,6 +285,21 @@ class RegistryManager:
                f"Scripts directory: {self.scripts}"
 
 
+def _parse_window(window: Union[str, float]) -> float:
+    """Seconds in `window`, given in seconds or as e.g. `'90s'`, `'15m'` or `'7d'`."""
+    if isinstance(window, (int, float)):
+        return float(window)
+    match = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*([smhdw]?)\s*', window)
+    if not match:
+        raise ValueError(f'Invalid time window {window!r}.')
+    return float(match.group(1)) * _window_units[match.group(2) or 's']
+
+@atexit.register
+def _flush_histories():
+    for history in list(_histories.values()):
+        history.flush()
+
+
 def _get_default_dir():
     return Path(os.path.dirname(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))) / 'usr'
 
@@ -0,0 +1,140 @@
+import os
+import queue
+import re
+import shutil
+from contextlib import contextmanager
+from dataclasses import dataclass, replace
+from functools import lru_cache
+from typing import Dict, List, Optional, Sequence, Union
+
+THREAD_ENV_VARS = (
+    'OMP_NUM_THREADS',
+    'OPENBLAS_NUM_THREADS',
+    'MKL_NUM_THREADS',
+    'VECLIB_MAXIMUM_THREADS',
+    'NUMEXPR_NUM_THREADS',
+    'R_DATATABLE_NUM_THREADS',
+)
+
+_memory_units = {'': 1, 'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30, 'T': 1 << 40}
+
+
+@dataclass(frozen=True)
+class ResourceSpec:
+    """Resources granted to a script's process.
+
+    CPU affinity and the memory limit are set by wrapping the command in `taskset`
+    and `prlimit` (see `command`), so they hold from the first instruction, and
+    never by running code in the forked child, which is unsafe while other threads
+    run. Asking for either without its tool installed is an error.
+
+    Attributes:
+        threads: Threads for BLAS/OpenMP and friends. Defaults to `len(cpus)` when
+            `cpus` is set.
+        cpus: CPU ids the process (and its children) are pinned to.
+        memory: Address-space limit (`RLIMIT_AS`) of each process, in bytes or as
+            e.g. `'4G'`.
+    """
+
+    threads: Optional[int] = None
+    cpus: Optional[Sequence[int]] = None
+    memory: Union[int, str, None] = None
+
+    @classmethod
+    def available(cls) -> 'ResourceSpec':
+        """All CPUs this process may run on, as threads only if they can't be pinned."""
+        if hasattr(os, 'sched_getaffinity'):
+            cpus = tuple(sorted(os.sched_getaffinity(0)))
+            return cls(cpus=cpus) if _which('taskset') else cls(threads=len(cpus))
+        return cls(threads=os.cpu_count())
+
+    @property
+    def n_threads(self) -> Optional[int]:
+        if self.threads is not None:
+            return self.threads
+        return len(self.cpus) if self.cpus else None
+
+    @property
+    def memory_bytes(self) -> Optional[int]:
+        return parse_memory(self.memory) if self.memory is not None else None
+
+    def env(self, base: Optional[Dict[str, str]] = None) -> Dict[str, str]:
+        """Environment for the child, with thread counts pinned."""
+        env = dict(os.environ if base is None else base)
+        if self.n_threads is not None:
+            env.update({var: str(self.n_threads) for var in THREAD_ENV_VARS})
+        return env
+
+    def command(self, args: List[str]) -> List[str]:
+        """`args` prefixed with `taskset` and `prlimit` to pin CPUs and limit memory.
+
+        Raises:
+            RuntimeError: If `cpus` or `memory` is set and `taskset` or `prlimit`
+                (util-linux) is not installed.
+        """
+        prefix = []
+        if self.cpus:
+            prefix.extend([_require('taskset', 'cpus'), '-c',
+                           ','.join(map(str, self.cpus))])
+        if self.memory_bytes is not None:
+            prefix.extend([_require('prlimit', 'memory'), f'--as={self.memory_bytes}',
+                           '--'])
+        return prefix + list(args)
+
+    def split(self, n: int) -> List['ResourceSpec']:
+        """Divides these resources among `n` concurrent runs.
+
+        CPUs are dealt out in disjoint, contiguous slices (runs share CPUs only when
+        there are more runs than CPUs) and each run gets threads for its own slice.
+        The memory limit applies to each process, so every run keeps it as is.
+        """
+        if self.cpus:
+            cpus = list(self.cpus)
+            if n >= len(cpus):
+                return [replace(self, threads=1, cpus=(cpus[i % len(cpus)],))
+                        for i in range(n)]
+            slices = [cpus[i * len(cpus) // n:(i + 1) * len(cpus) // n]
+                      for i in range(n)]
+            return [replace(self, threads=len(s), cpus=tuple(s)) for s in slices]
+        threads = max(1, (self.n_threads or os.cpu_count() or 1) // n)
+        return [replace(self, threads=threads) for __ in range(n)]
+
+
+class ResourcePool:
+    """Hands out disjoint shares of `resources` to at most `n` concurrent runs."""
+
+    def __init__(self, resources: ResourceSpec, n: int):
+        self._slots = queue.Queue()
+        for spec in resources.split(n):
+            self._slots.put(spec)
+
+    @contextmanager
+    def acquire(self):
+        spec = self._slots.get()
+        try:
+            yield spec
+        finally:
+            self._slots.put(spec)
+
+
+@lru_cache(maxsize=None)
+def _which(name: str) -> Optional[str]:
+    return shutil.which(name)
+
+
+def _require(tool: str, field: str) -> str:
+    if not _which(tool):
+        raise RuntimeError(f'`{field}` needs `{tool}` (util-linux), which is not '
+                           f'installed.')
+    return tool
+
+
+def parse_memory(memory: Union[int, str]) -> int:
+    """Parses a memory size such as `1024`, `'512M'` or `'4G'` into bytes."""
+    if isinstance(memory, int):
+        return memory
+    match = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*([KMGT]?)i?B?\s*', str(memory),
+                         re.IGNORECASE)
+    if not match:
+        raise ValueError(f'Invalid memory size: {memory}')
+    return int(float(match.group(1)) * _memory_units[match.group(2).upper()])
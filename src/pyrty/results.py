@@ -0,0 +1,350 @@
+import logging
+import os
+import re
+import time
+import uuid
+import weakref
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import List, Optional, Union
+
+import numpy as np
+import pandas as pd
+
+from pyrty.accounting import CallMetadata
+from pyrty.registry import RegistryManager
+from pyrty.script_writers.base_script import COMPRESSION_ENV_VAR, OutputFormat
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+    import pyarrow.dataset as pa_ds
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pa_csv = pa_ds = pq = None
+
+_logger = logging.getLogger(__name__)
+_reg_manager = RegistryManager()
+
+SPILL_FORMATS = (OutputFormat.ARROW, OutputFormat.PARQUET)
+BACKENDS = ('pandas', 'pyarrow', 'polars')
+
+# Strings captured from scripts' stdout that stand for missing values
+_NA_STRINGS = frozenset(['', 'NA', 'NaN', 'nan', 'None', 'null', 'NULL', '<NA>'])
+_BOOL_STRINGS = {'TRUE': True, 'FALSE': False, 'True': True, 'False': False,
+                 'true': True, 'false': False}
+_ZERO_PADDED = re.compile(r'^[+-]?0\d')  # Identifiers like '007' are kept as strings
+_DATE_PATTERN = re.compile(r'^\d{4}-\d{2}-\d{2}'
+                           r'([ T]\d{2}:\d{2}(:\d{2}(\.\d+)?)?)?(Z|[+-]\d{2}:?\d{2})?$')
+
+
+def results_dir() -> Path:
+    """Directory spilled results are written to."""
+    return _reg_manager.pyrty_dir / 'results'
+
+
+def spill_path(alias: str, format: str = 'arrow') -> Path:
+    """A fresh path in `results_dir()` for a result of `alias`."""
+    format = OutputFormat(format)
+    if format not in SPILL_FORMATS:
+        raise ValueError(f'Cannot spill results as {format.value}; use one of '
+                         f'{[f.value for f in SPILL_FORMATS]}.')
+    path = results_dir() / f'{alias}-{uuid.uuid4().hex[:12]}{format.suffix}'
+    path.parent.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+class LazyResult:
+    """Handle on a result a script wrote to disk, loaded only when accessed.
+
+    Arrow IPC files (`.arrow`, written uncompressed) are memory-mapped, so `table`
+    is zero-copy and pages are read from disk as they are touched. Parquet files
+    are decoded on access; use `dataset()` to scan them with projections and filters.
+
+    The file is deleted by `release()` (or on leaving a `with` block), and as a last
+    resort when the handle is garbage collected, unless `owned=False`. Tables taken
+    from the handle keep their memory map alive after release.
+
+    Example:
+        with func(input, spill=True) as res:
+            res.dataset().to_table(columns=['a'], filter=pa_ds.field('b') > 0)
+    """
+
+    def __init__(self, path: Union[str, Path], owned: bool = True):
+        if pa is None:
+            raise ImportError('pyarrow is required for spilled results.')
+        self.path = Path(path)
+        self.owned = owned
+        self.metadata: Optional[CallMetadata] = None  # Of the call that wrote the file
+        self._mmap = None
+        self._table = None
+        self._finalizer = weakref.finalize(self, _delete, self.path) if owned else None
+
+    @property
+    def format(self) -> OutputFormat:
+        return OutputFormat(self.path.suffix.lstrip('.'))
+
+    @property
+    def released(self) -> bool:
+        return not self.path.exists()
+
+    @property
+    def table(self) -> 'pa.Table':
+        """The whole result as an Arrow table (zero-copy for `.arrow` files)."""
+        if self._table is None:
+            self._check_available()
+            if self.format == OutputFormat.PARQUET:
+                self._table = pq.read_table(self.path, memory_map=True)
+            else:
+                self._mmap = pa.memory_map(str(self.path))
+                self._table = pa.ipc.open_file(self._mmap).read_all()
+        return self._table
+
+    def dataset(self) -> 'pa_ds.Dataset':
+        """The result as an Arrow dataset, for lazy scans with pushed-down filters."""
+        self._check_available()
+        format = 'parquet' if self.format == OutputFormat.PARQUET else 'ipc'
+        return pa_ds.dataset(self.path, format=format)
+
+    def to_pandas(self, columns: Optional[List[str]] = None, **kwargs) -> pd.DataFrame:
+        """Materializes (some columns of) the result as a DataFrame."""
+        table = self.table if columns is None else self.table.select(columns)
+        return table.to_pandas(**kwargs)
+
+    @property
+    def schema(self) -> 'pa.Schema':
+        return self.table.schema
+
+    @property
+    def num_rows(self) -> int:
+        return self.table.num_rows
+
+    @property
+    def nbytes(self) -> int:
+        """Size of the file on disk."""
+        return self.path.stat().st_size
+
+    def release(self) -> None:
+        """Drops this handle's references and deletes the file (if owned)."""
+        self._table = None
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        if self._finalizer is not None:
+            self._finalizer()
+
+    close = release
+
+    def _check_available(self) -> None:
+        if self.released:
+            raise ValueError(f'Result {self.path} has been released.')
+
+    def __enter__(self) -> 'LazyResult':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.release()
+
+    def __repr__(self) -> str:
+        state = 'released' if self.released else f'{self.nbytes} bytes'
+        return f'LazyResult({self.path}, {state})'
+
+
+@dataclass(frozen=True)
+class SinkResult:
+    """Metadata on a result a script wrote straight to its destination."""
+
+    path: Path
+    rows: Optional[int]  # `None` if it cannot be determined (pyarrow is not installed)
+    bytes: int
+    duration: float  # Seconds, including interpreter startup
+    metadata: Optional[CallMetadata] = field(default=None, compare=False)
+
+    def __fspath__(self) -> str:
+        return str(self.path)
+
+
+def run_to_sink(run_manager, input, sink: Union[str, Path],
+                compression: Optional[str] = None, resources=None,
+                metadata: Optional[CallMetadata] = None) -> SinkResult:
+    """Runs a script that writes its result to `sink`, without loading it here.
+
+    The format follows the extension of `sink`: `.parquet`, `.feather`, `.arrow` or
+    `.csv`. `compression` is the Parquet or Feather codec (e.g. `'zstd'`), and a
+    `ValueError` for other formats; CSV is compressed according to a further
+    extension, as in `out.csv.gz`. The result is written to a hidden file next to
+    `sink` and moved into place once complete.
+    """
+    sink = Path(sink).expanduser().resolve()
+    format = _sink_format(sink)
+    if compression and format not in (OutputFormat.PARQUET, OutputFormat.FEATHER):
+        raise ValueError(f'`compression` applies to .parquet and .feather sinks, '
+                         f'not {sink.name}.')
+    sink.parent.mkdir(parents=True, exist_ok=True)
+    partial = sink.with_name(f'.pyrty-{uuid.uuid4().hex[:12]}-{sink.name}')
+    env_vars = {COMPRESSION_ENV_VAR: compression} if compression else None
+
+    start = time.perf_counter()
+    try:
+        run_manager.run(input, output_path=partial, resources=resources,
+                        env_vars=env_vars, metadata=metadata)
+        os.replace(partial, sink)
+    finally:
+        _delete(partial)
+    duration = time.perf_counter() - start
+    return SinkResult(sink, count_rows(sink), sink.stat().st_size, duration, metadata)
+
+
+def count_rows(path: Union[str, Path]) -> Optional[int]:
+    """Number of rows in a table file, from metadata where the format has it."""
+    if pa is None:
+        return None
+    path = Path(path)
+    format = _sink_format(path)
+    if format == OutputFormat.PARQUET:
+        return pq.ParquetFile(path).metadata.num_rows
+    if format == OutputFormat.CSV:
+        stream = pa.input_stream(str(path), compression='detect')
+        with pa_csv.open_csv(stream) as reader:
+            return sum(batch.num_rows for batch in reader)
+    with pa.memory_map(str(path)) as source:
+        reader = pa.ipc.open_file(source)
+        return sum(reader.get_batch(i).num_rows
+                   for i in range(reader.num_record_batches))
+
+
+def _sink_format(path: Path) -> OutputFormat:
+    suffixes = [s.lstrip('.') for s in path.suffixes]
+    for suffix in reversed(suffixes):
+        try:
+            return OutputFormat(suffix)
+        except ValueError:
+            continue
+    raise ValueError(f'Cannot tell the format of {path.name}; use one of '
+                     f'{[f.suffix for f in OutputFormat]}.')
+
+
+@dataclass(frozen=True)
+class MemoryReport:
+    """Memory taken by a result before and after materialization, in bytes."""
+
+    before: int
+    after: int
+
+    @property
+    def ratio(self) -> float:
+        return self.after / self.before if self.before else 1.0
+
+    def __str__(self) -> str:
+        return (f'{_format_bytes(self.before)} -> {_format_bytes(self.after)} '
+                f'({self.ratio:.0%})')
+
+
+def materialize(df: pd.DataFrame, backend: str = 'pandas', compact: bool = True,
+                category_threshold: float = 0.5,
+                metadata: Optional[CallMetadata] = None):
+    """Converts a captured result to compact dtypes and to the table type of `backend`.
+
+    Args:
+        df: Result as returned by the script run (typically all strings).
+        backend: `'pandas'`, `'pyarrow'` (a `pa.Table`) or `'polars'` (a
+            `pl.DataFrame`).
+        compact: Whether to infer compact dtypes first; see `compact_dtypes`.
+        category_threshold: See `compact_dtypes`.
+        metadata: The call's metadata, whose `memory` is set to the `MemoryReport`
+            of the result's size before and after.
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f'Backend {backend} is not supported; use one of {BACKENDS}.')
+    before = memory_usage(df)
+    if compact:
+        df = compact_dtypes(df, category_threshold=category_threshold)
+    if backend == 'pyarrow':
+        if pa is None:
+            raise ImportError('pyarrow is required for the pyarrow backend.')
+        df = pa.Table.from_pandas(df, preserve_index=False)
+    elif backend == 'polars':
+        try:
+            import polars as pl
+        except ImportError:
+            raise ImportError('polars is required for the polars backend.')
+        df = pl.from_pandas(df)
+    report = MemoryReport(before, memory_usage(df))
+    _logger.info(f'Materialized result as {backend}: {report}')
+    if metadata is not None:
+        metadata.memory = report
+    return df
+
+
+def compact_dtypes(df: pd.DataFrame, category_threshold: float = 0.5) -> pd.DataFrame:
+    """Infers the smallest dtypes that hold each column without loss.
+
+    String columns are parsed as numbers, booleans or dates where every value
+    parses, and otherwise become categoricals when at most `category_threshold` of
+    their values are distinct. Integers are downcast, and so are floats that fit
+    `float32` exactly; floats holding only whole numbers and missing values become
+    nullable integers.
+    """
+    return pd.DataFrame({col: _compact_column(df[col], category_threshold)
+                         for col in df.columns}, index=df.index)
+
+
+def memory_usage(obj) -> int:
+    """Bytes taken by a pandas DataFrame (with its strings), Arrow or polars table."""
+    if isinstance(obj, pd.DataFrame):
+        return int(obj.memory_usage(deep=True).sum())
+    if hasattr(obj, 'estimated_size'):  # polars
+        return int(obj.estimated_size())
+    return int(obj.nbytes)
+
+
+def _compact_column(col: pd.Series, category_threshold: float) -> pd.Series:
+    if col.dtype == object or pd.api.types.is_string_dtype(col):
+        values = col.where(~col.isin(_NA_STRINGS) & col.notna())
+        present = values.dropna()
+        if present.empty:
+            return col
+        if present.map(type).eq(str).all():
+            if present.isin(_BOOL_STRINGS.keys()).all():
+                return values.map(_BOOL_STRINGS, na_action='ignore').astype('boolean')
+            numbers = pd.to_numeric(values, errors='coerce')
+            if (numbers.notna().sum() == len(present)
+                    and not present.str.match(_ZERO_PADDED).any()):
+                return _compact_column(numbers, category_threshold)
+            if present.str.match(_DATE_PATTERN).all():
+                try:
+                    return pd.to_datetime(values, format='ISO8601')
+                except (ValueError, TypeError):
+                    pass
+        if present.nunique() <= category_threshold * len(present):
+            return values.astype('category')
+        return col
+    if pd.api.types.is_bool_dtype(col) or not pd.api.types.is_numeric_dtype(col):
+        return col
+    if pd.api.types.is_integer_dtype(col):
+        return pd.to_numeric(col, downcast='unsigned' if col.min() >= 0 else 'integer')
+    if pd.api.types.is_float_dtype(col):
+        present = col.dropna()
+        if present.empty:
+            return col
+        if col.hasnans and np.array_equal(present, np.round(present)):
+            ints = pd.to_numeric(present.astype('int64'), downcast='integer')
+            return col.astype(ints.dtype.name.capitalize())  # e.g. int8 -> Int8
+        if np.array_equal(present.astype('float32'), present):
+            return col.astype('float32')
+    return col
+
+
+def _format_bytes(n: int) -> str:
+    for unit in ('B', 'KiB', 'MiB', 'GiB'):
+        if abs(n) < 1024 or unit == 'GiB':
+            return f'{n:.1f} {unit}' if unit != 'B' else f'{n} B'
+        n /= 1024
+
+
+def _delete(path: Path) -> None:
+    try:
+        path.unlink()
+        _logger.debug(f'Deleted spilled result {path}.')
+    except FileNotFoundError:
+        pass
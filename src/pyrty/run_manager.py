@@ -1,40 +1,53 @@
-import copy
 import csv
 import logging
+import time
 from csv import reader
 from functools import wraps
 from io import TextIOWrapper
 from os import linesep
 from pathlib import Path
 from subprocess import PIPE, Popen
-from tempfile import TemporaryDirectory
-from typing import List, Union
+from typing import Dict, List, Union
 
 import pandas as pd
 
-from pyrty.utils import run_capture
+from pyrty.accounting import CallMetadata
+from pyrty.executors import _executors, BaseExecutor, LocalExecutor
+from pyrty.executors.base_executor import temporary_run_dir
 from pyrty.pyr_env import PyREnv
 from pyrty.pyr_script import PyRScript
+from pyrty.refs import FileRef
+from pyrty.resources import ResourceSpec
 from pyrty.script_writers.base_script import OutputType
 
 _logger = logging.getLogger(__name__)
 
 
 def in_run_dir(func):
+    """Gives each call its own directory from `RunManager.run_dir`, passed as `run_dir`.
+
+    The directory is not stored on the instance, so concurrent calls from several
+    threads do not see each other's intermediates.
+    """
     @wraps(func)
     def wrapper(self, *args, **kwargs):
-        with TemporaryDirectory() as tmpdirname:
-            # Save the temporary directory name to the instance
-            self.tmpdirname = Path(tmpdirname)
-            return func(self, *args, **kwargs)
+        with self.run_dir() as run_dir:
+            return func(self, *args, run_dir=run_dir, **kwargs)
     return wrapper
 
 
 class RunManager:
-    def __init__(self, env: PyREnv, script: PyRScript, skip_lines_output: int = 0):
+    # Defaults for run managers pickled before these attributes existed
+    executor = None
+    resources = None
+
+    def __init__(self, env: PyREnv, script: PyRScript, skip_lines_output: int = 0,
+                 resources: ResourceSpec = None, executor: BaseExecutor = None):
         self.env = env
         self.script = script
         self.skip_lines_output = skip_lines_output
+        self.resources = resources
+        self.executor = executor
         self._has_args = bool(script.script_args)
         self._has_ret = script.script_ret
         if self._has_ret:
@@ -42,22 +55,22 @@ class RunManager:
 
         # TODO:
         # Set executable for script to environment's executable
-        import subprocess
         script_exe_stem = self.script.script_writer._exe
-        ret = subprocess.run(self.make_run_cmd(f'which {script_exe_stem}').split(' '), capture_output=True)
-        script_exe = ret.stdout.decode('utf-8').replace('\n', '')
-        self.script.script_writer._exe = script_exe
+        self.script.script_writer._exe = self.env.find_exe(script_exe_stem)
 
     def make_run_cmd(self, cmd):
         return self.env.get_run_in_env_cmd(cmd)
 
-    def parse_argval_intermediates(self, input):
-        input_copy = copy.deepcopy(input)
+    def parse_argval_intermediates(self, input, run_dir: Path):
+        # Shallow copy: only values are replaced, and inputs may be large
+        input_copy = dict(input)
         for arg_name, arg_val in input_copy.items():
             if isinstance(arg_val, pd.DataFrame):
-                arg_tmpfile = self.tmpdirname / f'{arg_name}.csv'
+                arg_tmpfile = run_dir / f'{arg_name}.csv'
                 arg_val.to_csv(arg_tmpfile, index=False)
                 input_copy[arg_name] = arg_tmpfile
+            elif isinstance(arg_val, FileRef):
+                input_copy[arg_name] = arg_val.resolve(run_dir, arg_name)
         return input_copy
 
     def add_args(self, args):
@@ -67,14 +80,30 @@ class RunManager:
         return ' '.join(cmd_w_args)
     
     @in_run_dir
-    def run(self, input={}, dry_run=False):
+    def run(self, input={}, dry_run=False, output_path=None,
+            resources: ResourceSpec = None, env_vars: Dict[str, str] = None,
+            metadata: CallMetadata = None, run_dir: Path = None):
+        """Runs the script on `input`, adding its resource usage to any `metadata`."""
+        if self._has_args and not input:
+            raise ValueError('Script has arguments, but none were provided.')
+        start = time.perf_counter()
+        if not dry_run and self.executor is not None and self.executor.supports(self):
+            # In-process backends take the inputs as they are, without a command
+            if output_path is not None and not self._has_ret:
+                raise ValueError('Script does not return a value to write.')
+            output = self.executor.call(self, input, run_dir, output_path=output_path,
+                                        env_vars=env_vars)
+            if metadata is not None:
+                metadata.phases['execute'] = time.perf_counter() - start
+            return output
         if self._has_args:
             cmd_stub = self.add_args(input.keys())
-            if input:
-                input_parsed = self.parse_argval_intermediates(input)
-                cmd_stub = cmd_stub.format(**input_parsed)
-            else:
-                raise ValueError('Script has arguments, but none were provided.')
+            input_parsed = self.parse_argval_intermediates(input, run_dir)
+            cmd_stub = cmd_stub.format(**input_parsed)
+            if metadata is not None:
+                metadata.bytes_in += sum(input_parsed[arg].stat().st_size
+                                         for arg, value in input.items()
+                                         if isinstance(value, pd.DataFrame))
         else:
             cmd_stub = self.cmd_stub            
 
@@ -82,20 +111,51 @@ class RunManager:
         _logger.info(f'Running ...\n\tCommand: {run_cmd}')
         if dry_run:
             return run_cmd
-        return self._run_script(run_cmd)
-    
-    def _run_script(self, cmd: str) -> Union[OutputType, None]:
-        if not self._has_ret:
-            with Popen(cmd.split(' ')) as p:
-                p.wait()
-        elif self._has_ret and self._output_type == OutputType.DF:
-            return run_capture(cmd, skip=self.skip_lines_output)
-        else:
+        prepared = time.perf_counter()
+        output = self._execute(run_cmd, output_path=output_path, resources=resources,
+                               env_vars=env_vars, metadata=metadata)
+        if metadata is not None:
+            metadata.phases['prepare'] = prepared - start
+            metadata.phases['execute'] = time.perf_counter() - prepared
+            if output_path is not None:
+                metadata.bytes_out += Path(output_path).stat().st_size
+        return output
+
+    def run_dir(self):
+        """Context manager giving a call a directory for inputs the executor can see."""
+        if self.executor is not None:
+            return self.executor.run_dir()
+        return temporary_run_dir()
+
+    def set_executor(self, executor: Union[str, BaseExecutor],
+                     **executor_kwargs) -> None:
+        """Sets the backend running this script, by name (see `_executors`) or as is."""
+        if isinstance(executor, str):
+            executor = fetch_executor(executor)(**executor_kwargs)
+        self.executor = executor
+
+    def _execute(self, cmd: str, output_path=None, resources: ResourceSpec = None,
+                 env_vars: Dict[str, str] = None, metadata: CallMetadata = None):
+        if output_path is not None and not self._has_ret:
+            raise ValueError('Script does not return a value to write.')
+        if self._has_ret and output_path is None and self._output_type != OutputType.DF:
             raise NotImplementedError
+        capture = self._has_ret and output_path is None
+        executor = self.executor or LocalExecutor()
+        return executor.execute(cmd, capture=capture, output_path=output_path,
+                                resources=resources or self.resources,
+                                skip=self.skip_lines_output, env_vars=env_vars,
+                                metadata=metadata)
 
     @property
     def cmd_stub(self):
         return f'{self.script.script_exe} {self.script.script_path}'
 
     def __str__(self):
-        return f'RunManager for {self.script.script_path} in {self.env.env_name}'
\ No newline at end of file
+        return f'RunManager for {self.script.script_path} in {self.env.env_name}'
+
+def fetch_executor(name: str) -> BaseExecutor:
+    try:
+        return _executors[name]
+    except KeyError:
+        raise ValueError(f'Executor {name} is not supported.')
\ No newline at end of file
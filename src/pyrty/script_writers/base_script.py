@@ -8,10 +8,26 @@ from typing import Union, List, Dict, Optional
 _logger = logging.getLogger(__name__)
 
 
+# Scripts write their result to this path (instead of stdout) when it is set
+OUTPUT_ENV_VAR = 'PYRTY_OUTPUT'
+COMPRESSION_ENV_VAR = 'PYRTY_COMPRESSION'
+
+
 class OutputType(str, Enum):
     DF = 'df'
 
 
+class OutputFormat(str, Enum):
+    ARROW = 'arrow'  # Uncompressed Arrow IPC file, can be memory-mapped
+    CSV = 'csv'
+    FEATHER = 'feather'
+    PARQUET = 'parquet'
+
+    @property
+    def suffix(self) -> str:
+        return f'.{self.value}'
+
+
 class BaseScriptWriter(ABC):
     _default_footer = '\n# ~*~ End of script ~*~\n'
     _version = 0
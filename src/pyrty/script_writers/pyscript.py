@@ -2,13 +2,174 @@ import re
 from pathlib import Path
 from typing import Union, List, Dict, Optional
 
-from pyrty.script_writers.base_script import OutputType, BaseScriptWriter
+from pyrty.script_writers.base_script import (OUTPUT_ENV_VAR, OutputType,
+                                              BaseScriptWriter)
 
 
 class PyScriptWriter(BaseScriptWriter):
     _exe = 'python'
     _ext = 'py'
-    
+    _io_helpers = (
+        '# pyrty I/O helpers: dispatch on file extension\n'
+        'def pyrty_read(x):\n'
+        '    if not isinstance(x, str):\n'
+        '        return x\n'
+        '    import pandas as pd\n'
+        "    if x.endswith('.pyrtyref'):\n"
+        '        return pyrty_open_ref(x)\n'
+        "    if x.endswith('.parquet'):\n"
+        '        return pd.read_parquet(x)\n'
+        "    if x.endswith(('.feather', '.arrow')):\n"
+        '        return pd.read_feather(x)\n'
+        '    return pd.read_csv(x)\n'
+        'def pyrty_open_ref(x):\n'
+        '    import operator, os\n'
+        '    import pyarrow.dataset as ds\n'
+        '    with open(x) as f:\n'
+        '        lines = f.read().splitlines()\n'
+        "    spec = dict(line.split(': ', 1) for line in lines if ': ' in line)\n"
+        '    def value(v):\n'
+        '        v = v.strip()\n'
+        "        if v.startswith(\"'\"):\n"
+        '            return v[1:-1]\n'
+        '        try:\n'
+        '            return int(v)\n'
+        '        except ValueError:\n'
+        '            return float(v)\n'
+        "    ops = {'==': operator.eq, '!=': operator.ne, '<': operator.lt,\n"
+        "           '<=': operator.le, '>': operator.gt, '>=': operator.ge}\n"
+        '    expr = None\n'
+        "    conds = spec.get('filter', '').split(';')\n"
+        '    for cond in filter(None, map(str.strip, conds)):\n'
+        "        col, op, v = cond.split(' ', 2)\n"
+        "        if op == 'in':\n"
+        "            e = ds.field(col).isin([value(u) for u in v.split(',')])\n"
+        '        else:\n'
+        '            e = ops[op](ds.field(col), value(v))\n'
+        '        expr = e if expr is None else expr & e\n'
+        "    columns = spec['columns'].split(',') if spec.get('columns') else None\n"
+        "    partitioning = 'hive' if os.path.isdir(spec['path']) else None\n"
+        "    dataset = ds.dataset(spec['path'], format=spec['format'],\n"
+        '                         partitioning=partitioning)\n'
+        '    return dataset.to_table(columns=columns, filter=expr).to_pandas()\n'
+        'def pyrty_write(x, path, compression=None):\n'
+        '    import os\n'
+        "    codec = compression or os.environ.get('PYRTY_COMPRESSION') or None\n"
+        "    if path.endswith('.parquet'):\n"
+        "        x.to_parquet(path, index=False, compression=codec or 'snappy')\n"
+        "    elif path.endswith('.arrow'):\n"
+        '        x.reset_index(drop=True).to_feather(\n'
+        "            path, compression='uncompressed')\n"
+        "    elif path.endswith('.feather'):\n"
+        '        x.reset_index(drop=True).to_feather(path, compression=codec)\n'
+        '    else:\n'
+        '        x.to_csv(path, index=False)'
+    )
+
+    _worker_loop = r"""# pyrty worker: serves calls read from a request FIFO
+import ast as _pyrty_ast, os as _pyrty_os, signal as _pyrty_signal, sys as _pyrty_sys
+from types import SimpleNamespace as _PyrtyNamespace
+_pyrty_fork = _pyrty_sys.argv[3:4] == ['fork']
+pyrty_fns, pyrty_store = {}, {}
+_pyrty_req = open(_pyrty_sys.argv[1])
+_pyrty_resp = _pyrty_os.open(_pyrty_sys.argv[2], _pyrty_os.O_WRONLY)
+def _pyrty_respond(*fields):
+    _pyrty_os.write(_pyrty_resp, ('\t'.join(map(str, fields)) + '\n').encode())
+def _pyrty_error(e):
+    return 'error\t' + ' '.join(f'{type(e).__name__}: {e}'.split())
+def _pyrty_parse(path):
+    args = {}
+    if path:
+        with open(path) as f:
+            for line in f:
+                key, __, value = line.rstrip('\n').partition(': ')
+                try:
+                    value = _pyrty_ast.literal_eval(value)
+                except (ValueError, SyntaxError):
+                    pass
+                if isinstance(value, str) and value.startswith('pyrty-store://'):
+                    value = pyrty_store[value[len('pyrty-store://'):]]
+                args[key] = value
+    return _PyrtyNamespace(**args)
+def _pyrty_do(id, fn):
+    try:
+        fn()
+        status = 'ok'
+    except Exception as e:
+        status = _pyrty_error(e)
+    _pyrty_respond('DONE', id, status)
+def _pyrty_source(path):
+    with open(path) as f:
+        exec(compile(f.read(), path, 'exec'), globals())
+def _pyrty_put(key, path):
+    pyrty_store[key] = pyrty_read(path)
+def _pyrty_get(key, path):
+    pyrty_write(pyrty_store[key], path)
+def _pyrty_call(id, fn, args_path, out_path, store_as):
+    try:
+        res = pyrty_fns[fn](_pyrty_parse(args_path))
+        if store_as:
+            pyrty_store[store_as] = res
+        if out_path:
+            pyrty_write(res, out_path)
+        status = 'ok'
+    except BaseException as e:  # Including `SystemExit`, so that the call still answers
+        status = _pyrty_error(e)
+    _pyrty_respond('DONE', id, status)
+_pyrty_children = {}  # Call children by pid, to their request id
+_pyrty_sigchld = [_pyrty_signal.SIGCHLD]
+def _pyrty_reap(*__):
+    # A child that exits cleanly has already written its DONE; one that was killed
+    # or exited non-zero (crashed, `os._exit`) gets an error instead
+    while True:
+        try:
+            pid, status = _pyrty_os.waitpid(-1, _pyrty_os.WNOHANG)
+        except ChildProcessError:
+            return
+        if not pid:
+            return
+        _pyrty_id = _pyrty_children.pop(pid, None)
+        if _pyrty_id is None or (_pyrty_os.WIFEXITED(status)
+                                 and not _pyrty_os.WEXITSTATUS(status)):
+            continue
+        if _pyrty_os.WIFSIGNALED(status):
+            how = f'was killed by signal {_pyrty_os.WTERMSIG(status)}'
+        else:
+            how = f'exited with status {_pyrty_os.WEXITSTATUS(status)}'
+        _pyrty_respond('DONE', _pyrty_id, 'error', f'Call process {pid} {how}.')
+if _pyrty_fork:
+    _pyrty_signal.signal(_pyrty_signal.SIGCHLD, _pyrty_reap)
+_pyrty_respond('READY', _pyrty_os.getpid())
+while True:
+    _pyrty_line = _pyrty_req.readline()
+    if not _pyrty_line or _pyrty_line.strip() == 'QUIT':
+        break
+    _pyrty_msg = _pyrty_line.rstrip('\n').split('\t') + [''] * 6
+    if _pyrty_msg[0] == 'DEF':
+        _pyrty_do(_pyrty_msg[1], lambda: _pyrty_source(_pyrty_msg[2]))
+    elif _pyrty_msg[0] == 'PUT':
+        _pyrty_do(_pyrty_msg[1], lambda: _pyrty_put(_pyrty_msg[2], _pyrty_msg[3]))
+    elif _pyrty_msg[0] == 'GET':
+        _pyrty_do(_pyrty_msg[1], lambda: _pyrty_get(_pyrty_msg[2], _pyrty_msg[3]))
+    elif _pyrty_msg[0] == 'DROP':
+        _pyrty_do(_pyrty_msg[1], lambda: pyrty_store.pop(_pyrty_msg[2]))
+    elif _pyrty_msg[0] == 'CALL' and _pyrty_fork:
+        # SIGCHLD is held until the child is recorded, in case it exits straight away
+        _pyrty_signal.pthread_sigmask(_pyrty_signal.SIG_BLOCK, _pyrty_sigchld)
+        _pyrty_pid = _pyrty_os.fork()
+        if _pyrty_pid == 0:
+            try:
+                _pyrty_signal.signal(_pyrty_signal.SIGCHLD, _pyrty_signal.SIG_DFL)
+                _pyrty_signal.pthread_sigmask(_pyrty_signal.SIG_UNBLOCK, _pyrty_sigchld)
+                _pyrty_call(*_pyrty_msg[1:6])
+            finally:
+                _pyrty_os._exit(0)
+        _pyrty_children[_pyrty_pid] = _pyrty_msg[1]
+        _pyrty_respond('STARTED', _pyrty_msg[1], _pyrty_pid)
+        _pyrty_signal.pthread_sigmask(_pyrty_signal.SIG_UNBLOCK, _pyrty_sigchld)
+    elif _pyrty_msg[0] == 'CALL':
+        _pyrty_call(*_pyrty_msg[1:6])"""
+
     def __init__(self, path: Union[str, Path], **kwargs):
         super().__init__(path, self._ext, **kwargs)
 
@@ -17,10 +178,23 @@ class PyScriptWriter(BaseScriptWriter):
             self.make_header(self._exe),
             self.make_imports(),
             self.make_argparsing(),
+            self.make_prologue(),
             self.make_body(),
             self.make_footer()
         ]))
 
+    def build_worker_script(self) -> str:
+        """Script for a long-lived worker, loading functions from `make_worker_def`."""
+        return '\n'.join([self._io_helpers, self._worker_loop])
+
+    def make_worker_def(self, name: str) -> str:
+        """Imports the libraries and registers the body as worker function `name`."""
+        return '\n'.join(filter(None, [
+            self.make_imports(),
+            self.make_function_def('_pyrty_fn'),
+            f"pyrty_fns[{name!r}] = _pyrty_fn",
+        ]))
+
     def make_imports(self) -> Optional[str]:
         if self.libs:
             return '\n'.join(f"import {lib}" for lib in self.libs)
@@ -44,11 +218,35 @@ class PyScriptWriter(BaseScriptWriter):
                     f'{arg_parsing_script}\n'
                     'args = parser.parse_args()')
 
+    def make_prologue(self) -> str:
+        return self._io_helpers
+
     def make_body(self) -> str:
         return self.code_body
 
+    def make_function_def(self, name: str) -> str:
+        """Wraps the body in a function of `args` that returns the script's result."""
+        lines = [f'def {name}(args):']
+        lines.extend(f'    {line}' if line else line
+                     for line in self.code_body.splitlines())
+        lines.append(f'    return {self.ret_name}' if self.ret else '    return None')
+        return '\n'.join(lines)
+
     def make_footer(self) -> str:
-        return self._default_footer
+        footer = []
+        if self.ret:
+            footer.append("# Printing values")
+            if self.output_type == OutputType.DF:
+                footer.append("import os as _pyrty_os, sys as _pyrty_sys")
+                footer.append(
+                    f"_pyrty_output = _pyrty_os.environ.get('{OUTPUT_ENV_VAR}')")
+                footer.append(f"pyrty_write({self.ret_name}, _pyrty_output) "
+                              f"if _pyrty_output else "
+                              f"{self.ret_name}.to_csv(_pyrty_sys.stdout, index=False)")
+            else:
+                raise NotImplementedError
+        footer.append(self._default_footer)
+        return '\n'.join(footer)
 
     def get_args(self) -> List[str]:
         return re.findall("'--(.*?)'", str(self))
\ No newline at end of file
@@ -2,16 +2,155 @@ import re
 from pathlib import Path
 from typing import Union, List
 
-from pyrty.script_writers.base_script import OutputType, BaseScriptWriter
+from pyrty.script_writers.base_script import (OUTPUT_ENV_VAR, OutputType,
+                                              BaseScriptWriter)
+
+
+# R packages scripts can read and write CSV tables with
+CSV_ENGINES = ('readr', 'data.table')
 
 
 class RScriptWriter(BaseScriptWriter):
     _exe = 'Rscript'
     _ext = 'R'
+    csv_engine = 'readr'  # Default for scripts pickled before the option existed
+    # Per engine: read a table from path `x`, write table `x` to `path`, and print
+    # table `{}` to stdout
+    _csv_io = {
+        'readr': ('readr::read_csv(x, col_types = readr::cols())',
+                  'readr::write_csv(x, path)',
+                  'writeLines(readr::format_csv({}), stdout())'),
+        # Multi-threaded, and streams rows to stdout rather than building one string
+        'data.table': ('data.table::fread(x, data.table = FALSE)',
+                       'data.table::fwrite(x, path)',
+                       "data.table::fwrite({}, '')"),
+    }
     _suppress_warnings = '# Suppress all output to keep stdout clean\noptions(warn=-1)'
+    # `@READ_CSV@` and `@WRITE_CSV@` are filled in from `_csv_io`, see `make_prologue`
+    _io_helpers = (
+        '# pyrty I/O helpers: dispatch on file extension\n'
+        'pyrty_read <- function(x) {\n'
+        '  if (!is.character(x)) return(x)\n'
+        "  if (grepl('\\\\.pyrtyref$', x)) return(pyrty_open_ref(x))\n"
+        "  if (grepl('\\\\.parquet$', x)) return(arrow::read_parquet(x))\n"
+        "  if (grepl('\\\\.(feather|arrow)$', x)) return(arrow::read_feather(x))\n"
+        '  @READ_CSV@\n'
+        '}\n'
+        'pyrty_open_ref <- function(x) {\n'
+        '  spec <- as.list(read.dcf(x)[1, ])\n'
+        '  value <- function(v) {\n'
+        '    v <- trimws(v)\n'
+        "    if (substr(v, 1, 1) == \"'\") return(substr(v, 2, nchar(v) - 1))\n"
+        '    as.numeric(v)\n'
+        '  }\n'
+        "  filters <- if (is.null(spec$filter)) '' else spec$filter\n"
+        '  cond <- NULL\n'
+        "  for (f in trimws(strsplit(filters, ';', fixed = TRUE)[[1]])) {\n"
+        '    if (!nzchar(f)) next\n'
+        "    p <- strsplit(f, ' ', fixed = TRUE)[[1]]\n"
+        "    v <- paste(p[-(1:2)], collapse = ' ')\n"
+        '    field <- arrow::Expression$field_ref(p[1])\n'
+        "    e <- if (p[2] == 'in') {\n"
+        "      vals <- sapply(strsplit(v, ',', fixed = TRUE)[[1]], value,\n"
+        '                     USE.NAMES = FALSE)\n'
+        '      set <- arrow::Array$create(vals)\n'
+        "      arrow::Expression$create('is_in', field,\n"
+        '                               options = list(value_set = set))\n'
+        '    } else {\n'
+        '      get(p[2])(field, value(v))\n'
+        '    }\n'
+        '    cond <- if (is.null(cond)) e else cond & e\n'
+        '  }\n'
+        '  cols <- if (is.null(spec$columns)) NULL else\n'
+        "    strsplit(spec$columns, ',', fixed = TRUE)[[1]]\n"
+        '  ds <- arrow::open_dataset(spec$path, format = spec$format)\n'
+        '  if (is.null(cond)) cond <- TRUE\n'
+        '  scanner <- arrow::Scanner$create(ds, projection = cols, filter = cond)\n'
+        '  as.data.frame(scanner$ToTable())\n'
+        '}\n'
+        'pyrty_write <- function(x, path) {\n'
+        "  codec <- Sys.getenv('PYRTY_COMPRESSION')\n"
+        "  if (grepl('\\\\.parquet$', path)) {\n"
+        "    if (!nzchar(codec)) codec <- 'snappy'\n"
+        '    arrow::write_parquet(x, path, compression = codec)\n'
+        "  } else if (grepl('\\\\.arrow$', path)) {\n"
+        "    arrow::write_feather(x, path, compression = 'uncompressed')\n"
+        "  } else if (grepl('\\\\.feather$', path)) {\n"
+        "    if (!nzchar(codec)) codec <- 'default'\n"
+        '    arrow::write_feather(x, path, compression = codec)\n'
+        '  } else {\n'
+        '    @WRITE_CSV@\n'
+        '  }\n'
+        '}'
+    )
+
+    _worker_loop = r"""# pyrty worker: serves calls read from a request FIFO
+.pyrty_argv <- commandArgs(trailingOnly = TRUE)
+.pyrty_fork <- identical(.pyrty_argv[3], 'fork')
+pyrty_fns <- list()
+pyrty_store <- new.env()
+.pyrty_req <- fifo(.pyrty_argv[1], open = 'r', blocking = TRUE)
+.pyrty_resp <- fifo(.pyrty_argv[2], open = 'w', blocking = TRUE)
+.pyrty_respond <- function(...) {
+  writeLines(paste(..., sep = '\t'), .pyrty_resp)
+  flush(.pyrty_resp)
+}
+.pyrty_error <- function(e) {
+  paste('error', gsub('[\t\r\n]+', ' ', conditionMessage(e)), sep = '\t')
+}
+.pyrty_get <- function(name) get(name, envir = pyrty_store, inherits = FALSE)
+.pyrty_parse <- function(path) {
+  if (!nzchar(path)) return(list())
+  lapply(as.list(read.dcf(path, keep.white = TRUE)[1, ]), function(v) {
+    v <- type.convert(v, as.is = TRUE)
+    if (is.character(v) && startsWith(v, 'pyrty-store://'))
+      .pyrty_get(substring(v, nchar('pyrty-store://') + 1))
+    else v
+  })
+}
+.pyrty_do <- function(id, expr) {
+  .pyrty_respond('DONE', id, tryCatch({ expr; 'ok' }, error = .pyrty_error))
+}
+.pyrty_call <- function(id, fn, args_path, out_path, store_as) {
+  status <- tryCatch({
+    res <- pyrty_fns[[fn]](.pyrty_parse(args_path))
+    if (nzchar(store_as)) assign(store_as, res, envir = pyrty_store)
+    if (nzchar(out_path)) pyrty_write(res, out_path)
+    'ok'
+  }, error = .pyrty_error, interrupt = function(e) 'error\tInterrupted')
+  .pyrty_respond('DONE', id, status)
+}
+.pyrty_respond('READY', Sys.getpid())
+repeat {
+  .pyrty_line <- readLines(.pyrty_req, n = 1)
+  if (length(.pyrty_line) == 0 || .pyrty_line == 'QUIT') break
+  .pyrty_msg <- c(strsplit(.pyrty_line, '\t', fixed = TRUE)[[1]], rep('', 6))
+  if (.pyrty_msg[1] == 'DEF') {
+    .pyrty_do(.pyrty_msg[2], source(.pyrty_msg[3]))
+  } else if (.pyrty_msg[1] == 'PUT') {
+    .pyrty_do(.pyrty_msg[2],
+              assign(.pyrty_msg[3], pyrty_read(.pyrty_msg[4]), envir = pyrty_store))
+  } else if (.pyrty_msg[1] == 'GET') {
+    .pyrty_do(.pyrty_msg[2], pyrty_write(.pyrty_get(.pyrty_msg[3]), .pyrty_msg[4]))
+  } else if (.pyrty_msg[1] == 'DROP') {
+    .pyrty_do(.pyrty_msg[2], rm(list = .pyrty_msg[3], envir = pyrty_store))
+  } else if (.pyrty_msg[1] == 'CALL' && .pyrty_fork) {
+    # R reaps detached children itself; the caller watches the pid for calls that die
+    .pyrty_args <- as.list(.pyrty_msg[2:6])
+    .pyrty_job <- parallel::mcparallel(do.call(.pyrty_call, .pyrty_args),
+                                       detached = TRUE)
+    .pyrty_respond('STARTED', .pyrty_msg[2], .pyrty_job$pid)
+  } else if (.pyrty_msg[1] == 'CALL') {
+    do.call(.pyrty_call, as.list(.pyrty_msg[2:6]))
+  }
+}"""
 
-    def __init__(self, path: Union[str, Path], **kwargs):
+    def __init__(self, path: Union[str, Path], csv_engine: str = 'readr', **kwargs):
+        if csv_engine not in CSV_ENGINES:
+            raise ValueError(f'CSV engine {csv_engine} is not supported; '
+                             f'use one of {", ".join(CSV_ENGINES)}.')
         super().__init__(path, self._ext, **kwargs)
+        self.csv_engine = csv_engine
 
     def make_header(self, exe) -> str:
         return super().make_header(exe) + self._suppress_warnings if self.suppress_warnings else ''
@@ -21,10 +160,23 @@ class RScriptWriter(BaseScriptWriter):
             self.make_header(self._exe),
             self.make_imports(),
             self.make_argparsing(),
+            self.make_prologue(),
             self.make_body(),
             self.make_footer()
         ]))
 
+    def build_worker_script(self) -> str:
+        """Script for a long-lived worker, loading functions from `make_worker_def`."""
+        return '\n'.join([self._suppress_warnings, self.make_prologue(),
+                          self._worker_loop])
+
+    def make_worker_def(self, name: str) -> str:
+        """Loads the libraries and registers the body as worker function `name`."""
+        return '\n'.join(filter(None, [
+            self.make_imports(),
+            self.make_function_def(f"pyrty_fns[['{name}']]"),
+        ]))
+
     def make_argparsing(self) -> str:
         if self.args:
             _option_str = ("make_option('--{name}', type = {type}, "
@@ -45,15 +197,34 @@ class RScriptWriter(BaseScriptWriter):
     def make_imports(self) -> str:
         return '\n'.join(f"suppressPackageStartupMessages(library({lib}))" for lib in self.libs)
 
+    def make_prologue(self) -> str:
+        read, write, __ = self._csv_io[self.csv_engine]
+        helpers = self._io_helpers.replace('@READ_CSV@', read)
+        return helpers.replace('@WRITE_CSV@', write)
+
     def make_body(self) -> str:
         return self.code_body
 
+    def make_function_def(self, name: str) -> str:
+        """Wraps the body in a function of `opt` that returns the script's result."""
+        lines = [f'{name} <- function(opt) {{']
+        lines.extend(f'  {line}' if line else line
+                     for line in self.code_body.splitlines())
+        if self.ret:
+            lines.append(f'  {self.ret_name}')
+        lines.append('}')
+        return '\n'.join(lines)
+
     def make_footer(self) -> str:
         footer = []
         if self.ret:
             footer.append("# Printing values")
             if self.output_type == OutputType.DF:
-                footer.append(f"try(writeLines(readr::format_csv({self.ret_name}), stdout()), silent=TRUE)")
+                footer.append(f".pyrty_output <- Sys.getenv('{OUTPUT_ENV_VAR}')")
+                print_csv = self._csv_io[self.csv_engine][2].format(self.ret_name)
+                footer.append(f"if (nzchar(.pyrty_output)) "
+                              f"pyrty_write({self.ret_name}, .pyrty_output) else "
+                              f"try({print_csv}, silent=TRUE)")
             else:
                 raise NotImplementedError
         footer.append(self._default_footer)
@@ -0,0 +1,396 @@
+"""A local daemon serving registered functions over a Unix domain socket.
+
+The daemon loads functions from the registry once and keeps a warm fork-server per
+function, so that callers skip registry loading, interpreter startup and library
+loading. Start it with `pyrty serve`; `PyRFunc.from_registry(alias, daemon=True)`
+then routes calls to it whenever its socket exists (see `PyRFunc.use_daemon`).
+
+Messages are framed as a 4-byte big-endian header length, a JSON header and the
+tables listed in the header, each an Arrow IPC stream of the given byte length.
+"""
+import json
+import logging
+import os
+import signal
+import socket
+import socketserver
+import struct
+import threading
+from pathlib import Path
+from typing import Any, Dict, Iterable, Optional, Tuple, Union
+
+import pandas as pd
+
+from pyrty.pool import WorkerPool
+from pyrty.pyr_script import fetch_script_writer
+from pyrty.refs import FileRef
+from pyrty.registry import DBManager, RegistryManager
+from pyrty.workers import ForkServer
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+_logger = logging.getLogger(__name__)
+_reg_manager = RegistryManager()
+
+SOCKET_ENV_VAR = 'PYRTY_SOCKET'
+
+_HEADER = struct.Struct('!I')
+# Extra seconds a client waits for the answer to a call with a timeout
+_TIMEOUT_MARGIN = 30.0
+
+
+class DaemonError(RuntimeError):
+    """Raised when a call served by the daemon fails."""
+
+
+def default_socket_path() -> Path:
+    """`$PYRTY_SOCKET`, or `pyrty.sock` in the pyrty directory."""
+    return Path(os.environ.get(SOCKET_ENV_VAR) or _reg_manager.pyrty_dir / 'pyrty.sock')
+
+
+def send_message(sock: socket.socket, header: Dict[str, Any],
+                 tables: Optional[Dict[str, pd.DataFrame]] = None) -> None:
+    blobs = [(name, _to_ipc(df)) for name, df in (tables or {}).items()]
+    header = dict(header, tables=[[name, blob.size] for name, blob in blobs])
+    head = json.dumps(header).encode()
+    sock.sendall(_HEADER.pack(len(head)) + head)
+    for __, blob in blobs:
+        sock.sendall(blob)
+
+
+def recv_message(sock: socket.socket) -> Tuple[Dict[str, Any], Dict[str, pd.DataFrame]]:
+    """Reads one message; raises `ConnectionError` if the peer closed the connection."""
+    size, = _HEADER.unpack(_recv_exact(sock, _HEADER.size))
+    header = json.loads(_recv_exact(sock, size))
+    tables = {name: _from_ipc(_recv_exact(sock, nbytes))
+              for name, nbytes in header.pop('tables', [])}
+    return header, tables
+
+
+def encode_input(
+    input: Optional[Dict[str, Any]],
+) -> Tuple[Dict[str, Any], Dict[str, pd.DataFrame]]:
+    """Splits call inputs into JSON-able arguments and tables."""
+    args, tables = {}, {}
+    for name, value in (input or {}).items():
+        if isinstance(value, pd.DataFrame):
+            tables[name] = value
+        elif isinstance(value, FileRef):
+            filters = value.filters and [list(f) for f in value.filters]
+            args[name] = {'ref': dict(path=str(value.path), format=value.format.value,
+                                      columns=value.columns and list(value.columns),
+                                      filters=filters)}
+        elif isinstance(value, Path):
+            args[name] = str(value)
+        elif value is None or isinstance(value, (str, int, float, bool)):
+            args[name] = value
+        else:
+            raise TypeError(f'Cannot send argument {name} of type '
+                            f'{type(value).__name__} to the daemon.')
+    return args, tables
+
+
+def decode_input(args: Dict[str, Any],
+                 tables: Dict[str, pd.DataFrame]) -> Dict[str, Any]:
+    input = {name: FileRef(**value['ref']) if isinstance(value, dict) else value
+             for name, value in args.items()}
+    input.update(tables)
+    return input
+
+
+class PyRDaemon:
+    """Serves calls to registered functions on a Unix domain socket.
+
+    Functions are loaded from the registry on their first call, or at start-up for
+    `aliases`, and R and Python functions get a `ForkServer` each, so every call runs
+    in a fresh child of a warm interpreter. With `pool`, they get an autoscaling
+    `WorkerPool` instead, created with `pool` as keyword arguments. Functions of
+    other languages, and all functions with `fork=False` and no `pool`, are called
+    as usual in the daemon's process.
+
+    Args:
+        socket_path: Where to listen (default: `default_socket_path()`).
+        aliases: Functions to load and warm up at start-up.
+        fork: Whether to serve R and Python functions from fork-servers.
+        pool: Keyword arguments of `WorkerPool`, to serve them from worker pools.
+        funcs: Functions to serve by alias, instead of loading them from the registry.
+    """
+
+    def __init__(
+        self,
+        socket_path: Union[str, Path, None] = None,
+        aliases: Iterable[str] = (),
+        fork: bool = True,
+        pool: Optional[Dict[str, Any]] = None,
+        funcs: Optional[Dict[str, Any]] = None,
+    ):
+        if pa is None:
+            raise ImportError('The pyrty daemon needs pyarrow.')
+        if socket_path is None:
+            socket_path = default_socket_path()
+        self.socket_path = Path(socket_path)
+        self.aliases = list(aliases)
+        self.fork = fork
+        self.pool = pool
+        self._funcs: Dict[str, Any] = dict(funcs or {})
+        self._servers: Dict[str, Union[ForkServer, WorkerPool]] = {}
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+        self._db_manager = None
+
+    def start(self) -> 'PyRDaemon':
+        """Starts serving in a background thread."""
+        self._bind()
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def serve_forever(self) -> None:
+        """Serves until `close()`, SIGINT or SIGTERM."""
+        self._bind()
+
+        def shutdown(*__):
+            threading.Thread(target=self._server.shutdown).start()
+
+        signal.signal(signal.SIGTERM, shutdown)
+        try:
+            self._server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        if self._server is None:
+            return
+        if self._thread is not None:
+            self._server.shutdown()
+            self._thread.join()
+        self._server.server_close()
+        self._server = self._thread = None
+        with self._lock:
+            for server in self._servers.values():
+                server.close()
+            self._servers.clear()
+        try:
+            self.socket_path.unlink()
+        except FileNotFoundError:
+            pass
+        _logger.info(f'Stopped serving on {self.socket_path}.')
+
+    def call(self, alias: str, input: Optional[Dict[str, Any]] = None,
+             timeout: Optional[float] = None):
+        """Calls function `alias` as a request from a client would.
+
+        `timeout` stops calls served from a fork-server (killing their child), and
+        stops waiting for calls served from a worker pool; functions called in the
+        daemon's process run to completion.
+        """
+        runner = self._runner(alias)
+        if isinstance(runner, ForkServer):
+            return runner.call(input, timeout=timeout)
+        if isinstance(runner, WorkerPool):
+            return runner.submit(input).result(timeout=timeout)
+        return runner(input)
+
+    def metrics(self) -> Dict[str, Dict[str, Any]]:
+        """`WorkerPool.metrics()` of each function served from a pool."""
+        with self._lock:
+            pools = {alias: server for alias, server in self._servers.items()
+                     if isinstance(server, WorkerPool)}
+        return {alias: pool.metrics() for alias, pool in pools.items()}
+
+    def handle(self, header: Dict[str, Any], tables: Dict[str, pd.DataFrame]):
+        """Answers one request, as a `(header, tables)` response."""
+        op = header.get('op')
+        try:
+            if op == 'ping':
+                return {'ok': True, 'pid': os.getpid(),
+                        'aliases': sorted(self._funcs)}, {}
+            if op == 'metrics':
+                return {'ok': True, 'metrics': self.metrics()}, {}
+            if op == 'call':
+                input = decode_input(header.get('args', {}), tables)
+                res = self.call(header['alias'], input, timeout=header.get('timeout'))
+                if isinstance(res, pd.DataFrame):
+                    return {'ok': True}, {'result': res}
+                return {'ok': True, 'result': res}, {}
+            if op == 'shutdown':
+                threading.Thread(target=self._server.shutdown).start()
+                return {'ok': True}, {}
+            raise ValueError(f'Unknown request {op!r}.')
+        except Exception as e:
+            _logger.info(f'Request {op} failed: {e!r}')
+            return {'ok': False, 'error': f'{type(e).__name__}: {e}'}, {}
+
+    def _bind(self) -> None:
+        if self._server is not None:
+            return
+        if self.socket_path.exists():
+            if DaemonClient.connect(self.socket_path) is not None:
+                raise RuntimeError(f'A daemon is already serving '
+                                   f'on {self.socket_path}.')
+            self.socket_path.unlink()  # Left over by a daemon that did not shut down
+        self.socket_path.parent.mkdir(parents=True, exist_ok=True)
+        self._server = _UnixServer(str(self.socket_path), _Handler)
+        self._server.daemon = self
+        for alias in self.aliases:
+            self._runner(alias)
+        served = ', '.join(self.aliases) or 'registered functions'
+        _logger.info(f'Serving {served} on {self.socket_path}.')
+
+    def _runner(self, alias: str):
+        with self._lock:
+            if alias not in self._funcs:
+                if self._db_manager is None:
+                    self._db_manager = DBManager(db_dir=_reg_manager.pyrty_dir)
+                self._funcs[alias] = self._db_manager.from_registry(alias)
+            func = self._funcs[alias]
+            writer_cls = fetch_script_writer(func.script.lang)
+            if not hasattr(writer_cls, 'build_worker_script'):
+                return func
+            server = self._servers.get(alias)
+            if self.pool is not None:
+                if server is None:
+                    server = WorkerPool(func, **{'format': 'arrow', **self.pool})
+                    self._servers[alias] = server
+                return server
+            if not self.fork:
+                return func
+            if server is None or not server.alive:
+                if server is not None:
+                    server.close()  # Releases the dead server's pipes and run dir
+                server = self._servers[alias] = ForkServer(func, format='arrow').start()
+            return server
+
+    def __enter__(self) -> 'PyRDaemon':
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+class DaemonClient:
+    """Connection to a `PyRDaemon`; each thread uses its own socket connection.
+
+    `timeout` bounds each socket operation, and is the default timeout of calls.
+    """
+
+    def __init__(self, socket_path: Union[str, Path, None] = None,
+                 timeout: Optional[float] = None):
+        if pa is None:
+            raise ImportError('The pyrty daemon needs pyarrow.')
+        if socket_path is None:
+            socket_path = default_socket_path()
+        self.socket_path = Path(socket_path)
+        self.timeout = timeout
+        self._local = threading.local()
+
+    @classmethod
+    def connect(cls, socket_path: Union[str, Path, None] = None,
+                timeout: Optional[float] = None) -> Optional['DaemonClient']:
+        """A client for the daemon on `socket_path`, or `None` if none serves there."""
+        client = cls(socket_path, timeout=timeout) if pa is not None else None
+        if client is None or not client.socket_path.exists():
+            return None
+        try:
+            client.ping()
+        except OSError:
+            return None
+        return client
+
+    def ping(self) -> Dict[str, Any]:
+        return self._request({'op': 'ping'})[0]
+
+    def metrics(self) -> Dict[str, Dict[str, Any]]:
+        """Metrics of the daemon's worker pools, by alias; see `PyRDaemon.metrics`."""
+        return self._request({'op': 'metrics'})[0]['metrics']
+
+    def call(self, alias: str, input: Optional[Dict[str, Any]] = None,
+             timeout: Optional[float] = None):
+        """Calls function `alias`; the daemon stops it after `timeout` seconds.
+
+        See `PyRDaemon.call`; `timeout` defaults to the client's.
+        """
+        timeout = timeout if timeout is not None else self.timeout
+        args, tables = encode_input(input)
+        header = {'op': 'call', 'alias': alias, 'args': args, 'timeout': timeout}
+        sock_timeout = timeout + _TIMEOUT_MARGIN if timeout is not None else None
+        header, tables = self._request(header, tables, sock_timeout=sock_timeout)
+        return tables.get('result', header.get('result'))
+
+    def shutdown(self) -> None:
+        self._request({'op': 'shutdown'})
+
+    def close(self) -> None:
+        sock = getattr(self._local, 'sock', None)
+        if sock is not None:
+            sock.close()
+            self._local.sock = None
+
+    def _request(self, header: Dict[str, Any],
+                 tables: Optional[Dict[str, pd.DataFrame]] = None,
+                 sock_timeout: Optional[float] = None):
+        sock = getattr(self._local, 'sock', None)
+        if sock is None:
+            sock = self._local.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self.timeout)
+            try:
+                sock.connect(str(self.socket_path))
+            except OSError:
+                self.close()
+                raise
+        try:
+            sock.settimeout(sock_timeout if sock_timeout is not None else self.timeout)
+            send_message(sock, header, tables)
+            header, tables = recv_message(sock)
+        except OSError:
+            self.close()  # Reconnect on the next request
+            raise
+        if not header.pop('ok', False):
+            raise DaemonError(header.get('error', 'Request failed.'))
+        return header, tables
+
+    def __str__(self) -> str:
+        return f'pyrty daemon client for {self.socket_path}'
+
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    def handle(self) -> None:
+        while True:  # Clients keep their connection open across requests
+            try:
+                header, tables = recv_message(self.request)
+            except (ConnectionError, OSError):
+                return
+            send_message(self.request, *self.server.daemon.handle(header, tables))
+
+
+def _to_ipc(df: pd.DataFrame):
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue()
+
+
+def _from_ipc(data: bytes) -> pd.DataFrame:
+    return pa.ipc.open_stream(pa.py_buffer(data)).read_all().to_pandas()
+
+
+def _recv_exact(sock: socket.socket, n: int) -> bytearray:
+    buffer = bytearray(n)
+    view = memoryview(buffer)
+    while view:
+        received = sock.recv_into(view)
+        if not received:
+            raise ConnectionError('Connection closed.')
+        view = view[received:]
+    return buffer
@@ -0,0 +1,187 @@
+import logging
+import os
+import re
+import threading
+import uuid
+import weakref
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Optional, Tuple, Union
+
+import pandas as pd
+
+from pyrty.refs import FileRef
+from pyrty.registry import RegistryManager
+from pyrty.resources import parse_memory
+from pyrty.utils import read_frame, write_frame
+
+_logger = logging.getLogger(__name__)
+_reg_manager = RegistryManager()
+
+
+@dataclass(frozen=True)
+class ObjectRef(FileRef):
+    """Handle on a table in an `ObjectStore`; pass it to any `PyRFunc` as an input.
+
+    The table was serialized once when it was put in the store, and every call
+    taking the handle reads that same file.
+    """
+
+    key: str = ''
+
+
+class ObjectStore:
+    """Tables serialized once as Arrow files, shared by any number of calls.
+
+    Each handle returned by `put` holds a reference to its entry, dropped by
+    `release` or when the handle is garbage collected. Once the store's files
+    exceed `budget`, the least recently used entries without references are
+    deleted. Reference counts are kept per process; entries found on disk at
+    start-up have none.
+
+    Point `root` at a `tmpfs` such as `/dev/shm` to keep entries in shared memory.
+
+    Args:
+        root: Directory for entries (default: `store` under the pyrty directory).
+        budget: Size limit in bytes, or as e.g. `'8G'`; `None` for no limit.
+    """
+
+    def __init__(self, root: Union[str, Path, None] = None,
+                 budget: Union[int, str, None] = None):
+        if root is None:
+            root = _reg_manager.pyrty_dir / 'store'
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.budget = parse_memory(budget) if budget is not None else None
+        self._refcounts: Dict[str, int] = {}
+        self._finalizers: Dict[int, Tuple[str, weakref.finalize]] = {}  # By handle id
+        # key -> size, least recent first
+        self._entries: 'OrderedDict[str, int]' = OrderedDict()
+        # Finalizers may run during garbage collection while it is held
+        self._lock = threading.RLock()
+        existing = [p for p in self.root.glob('*.arrow') if not p.name.startswith('.')]
+        for path in sorted(existing, key=lambda p: p.stat().st_mtime):
+            self._entries[path.stem] = path.stat().st_size
+
+    def put(self, df: pd.DataFrame, key: Optional[str] = None) -> ObjectRef:
+        """Serializes `df` into the store and returns a handle on it.
+
+        With a `key` that is already in the store, `df` is not serialized again and the
+        handle shares the existing entry.
+        """
+        if key is not None and not re.fullmatch(r'\w[\w.-]*', key):
+            raise ValueError(f'Invalid key {key!r}; '
+                             f'use letters, digits, "_", "." and "-".')
+        with self._lock:
+            exists = key is not None and key in self._entries
+        key = key or uuid.uuid4().hex
+        path = self._path(key)
+        if not exists:
+            partial = write_frame(df, self.root / f'.{key}.partial.arrow')
+            os.replace(partial, path)
+
+        ref = ObjectRef(path, key=key)
+        with self._lock:
+            self._entries[key] = path.stat().st_size
+            self._entries.move_to_end(key)
+            self._refcounts[key] = self._refcounts.get(key, 0) + 1
+            finalizer = weakref.finalize(ref, self._decref, key, id(ref))
+            self._finalizers[id(ref)] = (key, finalizer)
+            self._evict()
+        return ref
+
+    def get(self, ref: ObjectRef) -> pd.DataFrame:
+        """Loads the table behind `ref`."""
+        with self._lock:
+            if ref.key not in self._entries:
+                raise KeyError(f'{ref.key} is not in the store '
+                               f'(it may have been evicted).')
+            self._entries.move_to_end(ref.key)
+        return read_frame(ref.path)
+
+    def release(self, ref: ObjectRef) -> None:
+        """Drops the reference `ref` holds; entries without references are evictable."""
+        __, finalizer = self._finalizers.get(id(ref), (None, None))
+        if finalizer is not None:
+            finalizer()  # Runs `_decref` once, and not again at garbage collection
+
+    def refcount(self, ref: ObjectRef) -> int:
+        return self._refcounts.get(ref.key, 0)
+
+    def evict(self, key: str) -> None:
+        """Deletes an entry now, whether or not it is referenced."""
+        with self._lock:
+            self._delete(key)
+
+    @property
+    def nbytes(self) -> int:
+        return sum(self._entries.values())
+
+    def __contains__(self, ref: ObjectRef) -> bool:
+        return ref.key in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __repr__(self) -> str:
+        budget = f'/{self.budget}' if self.budget is not None else ''
+        return (f'ObjectStore({self.root}, {len(self)} entries, '
+                f'{self.nbytes}{budget} bytes)')
+
+    def _decref(self, key: str, token: int) -> None:
+        with self._lock:
+            self._finalizers.pop(token, None)
+            if self._refcounts.get(key, 0) > 0:
+                self._refcounts[key] -= 1
+            self._evict()
+
+    def _evict(self) -> None:
+        if self.budget is None:
+            return
+        for key in list(self._entries):
+            if self.nbytes <= self.budget:
+                return
+            if not self._refcounts.get(key):
+                _logger.info(f'Evicting {key} from the object store.')
+                self._delete(key)
+        if self.nbytes > self.budget:
+            _logger.warning(f'Object store holds {self.nbytes} bytes of referenced '
+                            f'entries, over its budget of {self.budget}.')
+
+    def _delete(self, key: str) -> None:
+        self._entries.pop(key, None)
+        self._refcounts.pop(key, None)
+        for token, (entry, finalizer) in list(self._finalizers.items()):
+            if entry == key:
+                finalizer.detach()
+                del self._finalizers[token]
+        try:
+            self._path(key).unlink()
+        except FileNotFoundError:
+            pass
+
+    def _path(self, key: str) -> Path:
+        return self.root / f'{key}.arrow'
+
+
+_default_store: Optional[ObjectStore] = None
+
+
+def get_store() -> ObjectStore:
+    """The process-wide store used by `put`, created on first use."""
+    global _default_store
+    if _default_store is None:
+        _default_store = ObjectStore()
+    return _default_store
+
+
+def set_store(store: ObjectStore) -> None:
+    """Replaces the process-wide store, e.g. to set a budget or a shared-memory root."""
+    global _default_store
+    _default_store = store
+
+
+def put(df: pd.DataFrame, key: Optional[str] = None) -> ObjectRef:
+    """Serializes `df` once into the process-wide store; see `ObjectStore.put`."""
+    return get_store().put(df, key=key)
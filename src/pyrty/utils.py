@@ -1,22 +1,55 @@
+import hashlib
 import os
 import shutil
 from csv import reader
-from io import TextIOWrapper
+from io import BufferedReader, RawIOBase, StringIO, TextIOWrapper
 from os import linesep
+from pathlib import Path
 from subprocess import PIPE, Popen
 from typing import List, Union
 
 import pandas as pd
 
+from pyrty.accounting import CallMetadata, wait_with_rusage
 
-def run_capture(cmd: str, skip: int = 0) -> pd.DataFrame:
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+except ImportError:
+    pa = pa_csv = None
+
+
+def run_capture(cmd: str, skip: int = 0, metadata: CallMetadata = None, resources=None,
+                **popen_kwargs) -> pd.DataFrame:
+    """Runs `cmd` and parses its CSV stdout; `resources` (a `ResourceSpec`) limit it."""
+    args = cmd.split(' ')
+    if resources is not None:
+        args = resources.command(args)
+    with Popen(args, stdout=PIPE, **popen_kwargs) as p:
+        stdout = _CountingReader(p.stdout)
+        with TextIOWrapper(BufferedReader(stdout), newline=linesep) as f:
+            df = _parse_capture(f, skip=skip)
+        rusage = wait_with_rusage(p)
+    if metadata is not None:
+        metadata.add_rusage(rusage, p.returncode)
+        metadata.bytes_out += stdout.nbytes
+    return df
+
+def read_capture(path: Union[str, Path], skip: int = 0) -> pd.DataFrame:
+    """Parses captured stdout saved to a file, as `run_capture` does from a process."""
+    with open(path, newline=linesep) as f:
+        return _parse_capture(f, skip=skip)
+
+def as_captured(df: pd.DataFrame) -> pd.DataFrame:
+    """`df` as `run_capture` returns a script's CSV output: every value a string."""
+    return _parse_capture(StringIO(df.to_csv(index=False)))
+
+def _parse_capture(f, skip: int = 0) -> pd.DataFrame:
     captured_stdout = []
-    with Popen(cmd.split(' '), stdout=PIPE) as p:
-        with TextIOWrapper(p.stdout, newline=linesep) as f:
-            csv_reader = reader(f, delimiter=",")
-            for r in csv_reader:
-                if r:  # Check if line is not empty
-                    captured_stdout.append(r)
+    csv_reader = reader(f, delimiter=",")
+    for r in csv_reader:
+        if r:  # Check if line is not empty
+            captured_stdout.append(r)
     capture_df = (
         pd.concat([pd.Series(__) for __ in captured_stdout[skip:]], axis=1)
         # TODO: Why is stdout sometimes returned with two empty rows?
@@ -24,6 +57,71 @@ def run_capture(cmd: str, skip: int = 0) -> pd.DataFrame:
     )
     return capture_df
 
+class _CountingReader(RawIOBase):
+    """Counts the bytes read from a binary stream."""
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.nbytes = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        n = self.raw.readinto(buffer)
+        self.nbytes += n or 0
+        return n
+
+def read_frame(path: Union[str, Path]) -> pd.DataFrame:
+    """Reads a table written by a script's footer, dispatching on file extension."""
+    path = str(path)
+    if path.endswith('.parquet'):
+        return pd.read_parquet(path)
+    if path.endswith(('.feather', '.arrow')):
+        return pd.read_feather(path)
+    return pd.read_csv(path)
+
+def write_frame(df: pd.DataFrame, path: Union[str, Path]) -> Path:
+    """Writes a table for a script's prologue, dispatching on file extension."""
+    path = Path(path)
+    if path.suffix == '.parquet':
+        df.to_parquet(path, index=False)
+    elif path.suffix == '.arrow':
+        df.reset_index(drop=True).to_feather(path, compression='uncompressed')
+    elif path.suffix == '.feather':
+        df.reset_index(drop=True).to_feather(path)
+    else:
+        write_csv(df, path)
+    return path
+
+def write_csv(df: pd.DataFrame, path: Union[str, Path]) -> Path:
+    """Writes `df` as CSV with the fastest available writer.
+
+    Uses `pyarrow`'s multi-threaded CSV writer when it is installed and can convert
+    the frame, and falls back to `pandas` otherwise.
+    """
+    if pa_csv is not None:
+        try:
+            pa_csv.write_csv(pa.Table.from_pandas(df, preserve_index=False), str(path))
+            return Path(path)
+        except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+            pass
+    df.to_csv(path, index=False)
+    return Path(path)
+
+def hash_file(path: Union[str, Path], chunk_size: int = 1 << 20) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def hash_frame(df: pd.DataFrame) -> str:
+    digest = hashlib.sha256()
+    digest.update(','.join(map(str, df.columns)).encode())
+    digest.update(pd.util.hash_pandas_object(df, index=True).values.tobytes())
+    return digest.hexdigest()
+
 def get_conda_exe(mamba: bool = False) -> str:
     """
     Note:
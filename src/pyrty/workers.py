@@ -0,0 +1,474 @@
+import errno
+import itertools
+import logging
+import os
+import select
+import shutil
+import signal
+import subprocess
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass
+from pathlib import Path
+from tempfile import mkdtemp
+from typing import Any, Dict, Optional, Tuple
+
+import pandas as pd
+
+from pyrty.pyr_env import PyREnv
+from pyrty.pyr_script import fetch_script_writer
+from pyrty.refs import FileRef
+from pyrty.resources import ResourceSpec
+from pyrty.script_writers.base_script import OutputFormat
+from pyrty.utils import read_frame, write_frame
+
+_logger = logging.getLogger(__name__)
+
+STORE_PREFIX = 'pyrty-store://'
+
+
+class WorkerError(RuntimeError):
+    """Raised when a call fails inside a worker, or the worker itself dies."""
+
+
+@dataclass(frozen=True)
+class StoredRef:
+    """Reference to an object kept in a worker's store, usable as a call input."""
+
+    name: str
+
+
+class Worker:
+    """A long-lived interpreter in an env, serving calls to `PyRFunc`s.
+
+    The interpreter is started once (through the env's run command) and loads each
+    function's libraries once, when the function is first defined in it. Requests
+    and responses travel over a pair of FIFOs in the worker's run directory, so
+    anything the function bodies print does not interfere.
+
+    With `fork=True`, the worker forks a fresh child per call (`parallel::mcparallel`
+    in R, `os.fork` in Python): calls are isolated from each other, run concurrently,
+    and still skip interpreter startup and library loading. A call whose child dies
+    without answering (killed, crashed, exited) fails with a `WorkerError`, and one
+    running over its `timeout` has its child killed.
+
+    Args:
+        env: The env to run the interpreter in.
+        lang: `'R'` or `'python'`.
+        fork: Whether to fork a child per call.
+        format: File format results are handed back in.
+        resources: Resources granted to the interpreter.
+        startup_timeout: Seconds to wait for the interpreter to come up.
+    """
+
+    def __init__(
+        self,
+        env: PyREnv,
+        lang: str,
+        fork: bool = False,
+        format: str = 'csv',
+        resources: Optional[ResourceSpec] = None,
+        startup_timeout: float = 300.0,
+    ):
+        self.env = env
+        self.lang = lang
+        self.fork = fork
+        self.format = OutputFormat(format)
+        self.resources = resources
+        self.startup_timeout = startup_timeout
+        self.pid = None  # Of the interpreter, not of the env's run command
+        self._proc = None
+        self._run_dir = None
+        self._req = None
+        self._resp_fd = None
+        self._defined = set()
+        self.stored = set()  # Names of objects in the worker's store
+        self._pending: Dict[str, Future] = {}
+        self._children: Dict[str, int] = {}  # Pids of forked calls, by request id
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+        self._define_lock = threading.Lock()
+        self._reader = None
+
+    def start(self) -> 'Worker':
+        if self.alive:
+            return self
+        writer_cls = fetch_script_writer(self.lang)
+        if not hasattr(writer_cls, 'build_worker_script'):
+            raise NotImplementedError(f'Workers are not supported for {self.lang}.')
+
+        self._run_dir = Path(mkdtemp(prefix='pyrty-worker-'))
+        script_path = self._run_dir / f'worker.{writer_cls._ext}'
+        writer = writer_cls(script_path, versioned=False)
+        script_path.write_text(writer.build_worker_script())
+        req_path, resp_path = self._run_dir / 'req', self._run_dir / 'resp'
+        os.mkfifo(req_path)
+        os.mkfifo(resp_path)
+
+        # Opened read-write so that reads never see EOF before the worker connects
+        self._resp_fd = os.open(resp_path, os.O_RDWR | os.O_NONBLOCK)
+        cmd = (f'{self.env.find_exe(writer_cls._exe)} {script_path} {req_path} '
+               f'{resp_path} {"fork" if self.fork else "serial"}')
+        args = self.env.get_run_in_env_cmd(cmd).split(' ')
+        if self.resources is not None:
+            args = self.resources.command(args)
+        env = self.resources.env() if self.resources is not None else None
+        self._proc = subprocess.Popen(args, stdin=subprocess.DEVNULL,
+                                      stdout=subprocess.DEVNULL, start_new_session=True,
+                                      env=env)
+        self._req = self._open_request_fifo(req_path)
+
+        ready = Future()
+        self._pending['READY'] = ready
+        self._reader = threading.Thread(target=self._read_responses, daemon=True)
+        self._reader.start()
+        self.pid = int(ready.result(timeout=self.startup_timeout))
+        _logger.info(f'Started {self}.')
+        return self
+
+    def define(self, func) -> None:
+        """Loads `func`'s libraries and body into the worker (once per alias)."""
+        if func.script.lang != self.lang:
+            raise ValueError(f'{func.alias} is a {func.script.lang} function, '
+                             f'not {self.lang}.')
+        with self._define_lock:
+            if func.alias in self._defined:
+                return
+            writer = func.script.script_writer
+            def_path = self._run_dir / f'def-{len(self._defined)}.{writer._ext}'
+            def_path.write_text(writer.make_worker_def(func.alias))
+            self._request('DEF', str(def_path)).result()
+            self._defined.add(func.alias)
+
+    def submit(self, func, input: Optional[Dict[str, Any]] = None, store_as: str = '',
+               output: bool = True, timeout: Optional[float] = None) -> Future:
+        """Calls `func` in the worker without waiting; the future gives its result.
+
+        After `timeout` seconds, the future fails with `TimeoutError` and the call is
+        stopped: its child is killed in a fork-server, the whole interpreter otherwise.
+        """
+        self.start()
+        self.define(func)
+        call_dir = Path(mkdtemp(dir=self._run_dir, prefix='call-'))
+        args_path = self._write_args(call_dir, input or {})
+        out_path = ''
+        if output and func.script.script_ret:
+            out_path = call_dir / f'out{self.format.suffix}'
+
+        future = Future()
+        request_id, request = self._send('CALL', func.alias, args_path, out_path,
+                                         store_as)
+        if timeout is not None:
+            timer = threading.Timer(timeout, self._expire, args=(request_id, timeout))
+            timer.daemon = True
+            timer.start()
+            request.add_done_callback(lambda __: timer.cancel())
+
+        def collect(request):
+            try:
+                request.result()
+                if store_as and not self.fork:
+                    self.stored.add(store_as)
+                future.set_result(read_frame(out_path) if out_path else None)
+            except Exception as e:
+                future.set_exception(e)
+            finally:
+                shutil.rmtree(call_dir, ignore_errors=True)
+        request.add_done_callback(collect)
+        return future
+
+    def call(self, func, input: Optional[Dict[str, Any]] = None, **kwargs):
+        """Calls `func` in the worker and returns its result; see `submit`."""
+        return self.submit(func, input, **kwargs).result()
+
+    def put(self, name: str, value) -> StoredRef:
+        """Loads a DataFrame, path or `FileRef` into the worker's store as `name`."""
+        self.start()
+        call_dir = Path(mkdtemp(dir=self._run_dir, prefix='put-'))
+        try:
+            if isinstance(value, pd.DataFrame):
+                value = write_frame(value, call_dir / f'{name}{self.format.suffix}')
+            elif isinstance(value, FileRef):
+                value = value.resolve(call_dir, name)
+            self._request('PUT', name, value).result()
+        finally:
+            shutil.rmtree(call_dir, ignore_errors=True)
+        self.stored.add(name)
+        return StoredRef(name)
+
+    def get(self, name: str) -> pd.DataFrame:
+        """Copies object `name` out of the worker's store."""
+        call_dir = Path(mkdtemp(dir=self._run_dir, prefix='get-'))
+        try:
+            out_path = call_dir / f'{name}{self.format.suffix}'
+            self._request('GET', name, out_path).result()
+            return read_frame(out_path)
+        finally:
+            shutil.rmtree(call_dir, ignore_errors=True)
+
+    def drop(self, name: str) -> None:
+        """Removes object `name` from the worker's store."""
+        self._request('DROP', name).result()
+        self.stored.discard(name)
+
+    def close(self, timeout: float = 10.0) -> None:
+        if self._proc is None:
+            return
+        try:
+            self._req.write('QUIT\n')
+            self._req.flush()
+            self._proc.wait(timeout=timeout)
+        except (OSError, ValueError, subprocess.TimeoutExpired):
+            self._kill()
+        finally:
+            self._cleanup()
+
+    @property
+    def alive(self) -> bool:
+        return self._proc is not None and self._proc.poll() is None
+
+    def _request(self, kind: str, *fields) -> Future:
+        return self._send(kind, *fields)[1]
+
+    def _send(self, kind: str, *fields) -> Tuple[str, Future]:
+        future = Future()
+        with self._lock:
+            if not self.alive:
+                raise WorkerError(f'{self} is not running.')
+            request_id = str(next(self._ids))
+            self._pending[request_id] = future
+            self._req.write('\t'.join([kind, request_id, *map(str, fields)]) + '\n')
+            self._req.flush()
+        return request_id, future
+
+    def _expire(self, request_id: str, timeout: float) -> None:
+        with self._lock:
+            future = self._pending.pop(request_id, None)
+            pid = self._children.pop(request_id, None)
+        if future is None or future.done():
+            return
+        if pid is not None:
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+        elif not self.fork:
+            # The call holds the interpreter, which is restarted on the next call
+            self.close(timeout=0)
+        future.set_exception(TimeoutError(f'Call {request_id} to {self} timed out '
+                                          f'after {timeout}s.'))
+
+    def _write_args(self, call_dir: Path, input: Dict[str, Any]) -> str:
+        if not input:
+            return ''
+        lines = []
+        for name, value in input.items():
+            if isinstance(value, pd.DataFrame):
+                value = write_frame(value, call_dir / f'{name}.csv')
+            elif isinstance(value, FileRef):
+                value = value.resolve(call_dir, name)
+            elif isinstance(value, StoredRef):
+                value = f'{STORE_PREFIX}{value.name}'
+            lines.append(f'{name}: {value}')
+        args_path = call_dir / 'args.dcf'
+        args_path.write_text('\n'.join(lines) + '\n')
+        return str(args_path)
+
+    def _open_request_fifo(self, path: Path):
+        # Opening a FIFO for writing fails until the worker opens it for reading
+        deadline = time.monotonic() + self.startup_timeout
+        while True:
+            try:
+                fd = os.open(path, os.O_WRONLY | os.O_NONBLOCK)
+                break
+            except OSError as e:
+                if e.errno != errno.ENXIO:
+                    raise
+            if self._proc.poll() is not None or time.monotonic() > deadline:
+                self._cleanup()
+                raise WorkerError(f'Worker for {self.env.prefix} failed to start.')
+            time.sleep(0.01)
+        os.set_blocking(fd, True)
+        return os.fdopen(fd, 'w')
+
+    def _read_responses(self) -> None:
+        buffer = b''
+        exited = set()  # Calls whose child was gone at the previous check
+        while True:
+            try:
+                ready, __, __ = select.select([self._resp_fd], [], [], 0.5)
+                chunk = os.read(self._resp_fd, 1 << 16) if ready else b''
+            except (OSError, ValueError, TypeError):  # Closed
+                return
+            buffer += chunk
+            while b'\n' in buffer:
+                line, buffer = buffer.split(b'\n', 1)
+                self._dispatch(line.decode().split('\t'))
+            if chunk:
+                continue
+            if not self.alive:
+                self._fail_pending(WorkerError(f'{self} exited.'))
+                return
+            # A child writes DONE before exiting, so a call still pending one read after
+            # its child was found gone died without answering
+            for request_id in exited:
+                with self._lock:
+                    future = self._pending.pop(request_id, None)
+                    pid = self._children.pop(request_id, None)
+                if future is not None and not future.done():
+                    future.set_exception(WorkerError(f'Call process {pid} exited '
+                                                     f'without a result.'))
+            with self._lock:
+                exited = {request_id for request_id, pid in self._children.items()
+                          if not _process_running(pid)}
+
+    def _dispatch(self, msg) -> None:
+        if msg[0] == 'READY':
+            future = self._pending.pop('READY', None)
+            if future is not None:
+                future.set_result(msg[1])
+        elif msg[0] == 'STARTED':
+            with self._lock:
+                if msg[1] in self._pending:
+                    self._children[msg[1]] = int(msg[2])
+        elif msg[0] == 'DONE':
+            with self._lock:
+                future = self._pending.pop(msg[1], None)
+                self._children.pop(msg[1], None)
+            if future is None or future.done():  # Answered already, or timed out
+                return
+            if msg[2] == 'ok':
+                future.set_result(None)
+            else:
+                message = msg[3] if len(msg) > 3 else 'Call failed.'
+                future.set_exception(WorkerError(message))
+
+    def _fail_pending(self, error: Exception) -> None:
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._children.clear()
+        for future in pending.values():
+            if not future.done():
+                future.set_exception(error)
+
+    def _kill(self) -> None:
+        try:
+            os.killpg(self._proc.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        self._proc.wait()
+
+    def _cleanup(self) -> None:
+        for closer in (lambda: self._req.close(), lambda: os.close(self._resp_fd)):
+            try:
+                closer()
+            except (OSError, AttributeError, TypeError):
+                pass
+        self._req = self._resp_fd = None
+        self._fail_pending(WorkerError(f'{self} was closed.'))
+        if self._run_dir is not None:
+            shutil.rmtree(self._run_dir, ignore_errors=True)
+        self._proc = None
+        self._defined.clear()
+        self.stored.clear()
+
+    def __enter__(self) -> 'Worker':
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def __del__(self):
+        try:
+            if self.alive:
+                self.close()
+        except Exception:
+            pass
+
+    def __str__(self) -> str:
+        mode = 'fork-server' if self.fork else 'worker'
+        return f'{self.lang} {mode} (pid {self.pid}) in {self.env.prefix}'
+
+
+def _process_running(pid: int) -> bool:
+    """Whether process `pid` exists and is not a zombie."""
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            # The command name may contain spaces; fields resume after its closing ')'
+            return f.read().rsplit(')', 1)[1].split()[0] != 'Z'
+    except FileNotFoundError:
+        return False
+    except (OSError, IndexError):  # No /proc
+        pass
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class ForkServer(Worker):
+    """Fork-server for one function: libraries load once, each call runs in a new child.
+
+    Example:
+        with ForkServer(func) as server:
+            futures = [server.submit({'x': chunk}) for chunk in chunks]
+            results = [f.result() for f in futures]
+    """
+
+    def __init__(self, func, **kwargs):
+        super().__init__(func.env, func.script.lang, fork=True, **kwargs)
+        self.func = func
+
+    def start(self) -> 'ForkServer':
+        if not self.alive:
+            super().start()
+            self.define(self.func)
+        return self
+
+    def submit(self, input: Optional[Dict[str, Any]] = None, **kwargs) -> Future:
+        return super().submit(self.func, input, **kwargs)
+
+    def call(self, input: Optional[Dict[str, Any]] = None, **kwargs):
+        return self.submit(input, **kwargs).result()
+
+    __call__ = call
+
+
+class Session(Worker):
+    """One interpreter kept alive across calls, with named objects resident in it.
+
+    Any number of functions of the session's language can run in it. A call's result
+    can be kept in the session with `store_as`, and objects can be loaded with `put`;
+    later calls take them as inputs through `session[name]`, so the data is loaded
+    only once.
+
+    Example:
+        with Session(env) as session:
+            session.put('counts', 'counts.parquet')
+            session.run(normalize, {'x': session['counts']}, store_as='norm',
+                        output=False)
+            res = session.run(cluster, {'x': session['norm'], 'k': 8})
+    """
+
+    def __init__(self, env: PyREnv, lang: str = 'R', **kwargs):
+        super().__init__(env, lang, fork=False, **kwargs)
+
+    def run(self, func, input: Optional[Dict[str, Any]] = None, store_as: str = '',
+            output: bool = True):
+        """Calls `func` in the session, keeping its result as `store_as` if given."""
+        return self.call(func, input, store_as=store_as, output=output)
+
+    def __getitem__(self, name: str) -> StoredRef:
+        if name not in self.stored:
+            raise KeyError(name)
+        return StoredRef(name)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.stored
+
+    def __str__(self) -> str:
+        return f'{self.lang} session (pid {self.pid}) in {self.env.prefix}'
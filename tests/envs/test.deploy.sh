@@ -0,0 +1,2 @@
+None create -p /root/package/tests/envs/test-env --no-default-packages -y
+None env update -p /root/package/tests/envs/test-env --file /root/package/tests/envs/test-env.yaml
\ No newline at end of file
@@ -0,0 +1,4 @@
+#!/usr/bin/env bash
+# Stand-in for `sbatch`: runs the job script in the background on this machine
+nohup bash "$1" > /dev/null 2>&1 &
+echo "Submitted batch job $!"
@@ -1,15 +1,57 @@
+import gc
+import json
+import os
 import shutil
 import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from types import SimpleNamespace
 from typing import Union
 
+import pandas as pd
+import pyarrow.parquet as pq
 import pytest
 
-from pyrty.env_managers.conda import write_conda_deploy_script
+from pyrty import fusion, resources
+from pyrty.accounting import CallMetadata, usage_log
+from pyrty import bench
+from pyrty.bench import compare_csv_engines, compare_executors
+from pyrty.env_managers.conda import (CondaEnv, CondaEnvManager,
+                                      write_conda_deploy_script)
 from pyrty.env_managers.utils import SHELL_EXE
+from pyrty.executors import BatchExecutor, EmbeddedRExecutor, InProcessExecutor
+from pyrty.executors.base_executor import temporary_run_dir
+from pyrty.executors.embedded import find_r_home
+from pyrty.executors.inprocess import python_info
+from pyrty.fusion import _fused_body
+from pyrty.loadtest import (HostEnv, host_function, local_function, local_input,
+                            run_load, sweep)
+from pyrty.partitions import map_incremental, split_frame
+from pyrty.pipeline import Pipeline
+from pyrty.pool import WorkerPool, process_rss
+from pyrty.prewarm import prewarm, touch_shared_libs
 from pyrty.pyr_env import PyREnv
+from pyrty.pyr_func import PyRFunc
 from pyrty.pyr_script import PyRScript
+from pyrty.refs import DatasetRef, FileRef
+from pyrty.registry import DBManager
+from pyrty.resources import ResourceSpec, parse_memory
+from pyrty.results import LazyResult, compact_dtypes, materialize, memory_usage
 from pyrty.script_writers import BaseScriptWriter
+from pyrty.script_writers.pyscript import PyScriptWriter
+from pyrty.server import DaemonClient, DaemonError, PyRDaemon
+from pyrty.store import ObjectStore
+from pyrty.utils import read_frame, write_frame
+from pyrty.workers import ForkServer, Session, WorkerError
+
+
+@pytest.fixture(autouse=True)
+def call_history(tmp_path, monkeypatch):
+    """Records the tests' calls in a temporary database rather than the registry's."""
+    db = DBManager(db_dir=tmp_path)
+    monkeypatch.setattr(PyRFunc, 'history', db)
+    return db
 
 
 @pytest.fixture
@@ -71,6 +113,40 @@ def test_rscriptwriter():
     assert input_args == {'arg1': [], 'arg2': []}
     _script_write_remove(writer)
 
+def test_rscriptwriter_csv_engine(tmp_path):
+    code = 'res <- pyrty_read(opt$x)'
+    kwargs = dict(code_body=code, args={'x': {}}, ret=True, ret_name='res',
+                  output_type='df')
+    readr = str(PyRScript('R', dict(path=tmp_path / 'readr.R', **kwargs)).script_writer)
+    fast_writer = PyRScript('R', dict(path=tmp_path / 'dt.R', csv_engine='data.table',
+                                      **kwargs)).script_writer
+    fast = str(fast_writer)
+    assert 'readr::format_csv(res)' in readr and 'data.table' not in readr
+    assert 'readr::write_csv(x, path)' in readr and '@' not in readr
+    assert 'readr::' not in fast
+    assert "data.table::fread(x, data.table = FALSE)" in fast
+    assert "data.table::fwrite(res, '')" in fast
+    assert 'readr::' not in fast_writer.build_worker_script()
+    with pytest.raises(ValueError):
+        PyRScript('R', dict(path=tmp_path / 'x.R', csv_engine='vroom'))
+
+def test_compare_csv_engines_loads_only_the_engine(tmp_path, monkeypatch):
+    script = PyRScript('R', dict(path=tmp_path / 'f.R', code_body='res <- 1',
+                                 libs=['readr', 'dplyr']))
+    func = SimpleNamespace(alias='f', script=script)
+    scripts = {}
+    monkeypatch.setattr(bench, '_run_manager_for', lambda func, script: script)
+    monkeypatch.setattr(bench, 'time_calls', lambda *__, **___: [0.0])
+    monkeypatch.setattr(bench, 'summarize', lambda timings: timings)
+    def record(self):
+        scripts[self.script_writer.csv_engine] = str(self.script_writer)
+    monkeypatch.setattr(PyRScript, 'create_script', record)
+    compare_csv_engines(func)
+    assert 'library(readr)' in scripts['readr']
+    assert 'library(readr)' not in scripts['data.table']
+    assert 'library(dplyr)' in scripts['data.table']
+    assert script.script_writer.libs == ['readr', 'dplyr']  # The original is unchanged
+
 def test_pyscriptwriter():
     bdir, aut, descr, args = pyr_script_params
     path = bdir / 'test.py'
@@ -106,4 +182,617 @@ def _script_write_remove(writer: BaseScriptWriter):
     writer.write_to_file()
     assert writer.versioned_path.exists()
     writer.delete_file()
-    assert not writer.versioned_path.exists()
\ No newline at end of file
+    assert not writer.versioned_path.exists()
+
+
+class _FakeRunManager:
+    """Stands in for a script run: writes `input['x'] + 1` to the output path."""
+    resources = None
+
+    def __init__(self):
+        self.calls = 0
+
+    def run(self, input, output_path=None, resources=None):
+        self.calls += 1
+        write_frame(read_frame(input['x']) + 1, output_path)
+        return output_path
+
+    def run_dir(self):
+        return temporary_run_dir()
+
+
+def _fake_func(tmp_path, name):
+    script = tmp_path / f'{name}.R'
+    script.write_text(name)
+    return SimpleNamespace(script_path=script, env=SimpleNamespace(prefix=tmp_path),
+                           run_manager=_FakeRunManager())
+
+def test_pipeline_runs_and_caches(tmp_path):
+    add_a, add_b, add_c = (_fake_func(tmp_path, n) for n in 'abc')
+    df = pd.DataFrame({'v': [1, 2, 3]})
+    pipe = Pipeline(run_dir=tmp_path / 'run', format='csv')
+    a = pipe.add('a', add_a, x=df)
+    pipe.add('b', add_b, x=a)
+    pipe.add('c', add_c, x=a)
+    outputs = pipe.run()
+    assert set(outputs) == {'a', 'b', 'c'}
+    assert pipe.collect('b').v.tolist() == [3, 4, 5]
+    pipe.run(targets=['c'])
+    assert (add_a.run_manager.calls, add_c.run_manager.calls) == (1, 1)
+
+def test_fused_body_passes_results_in_memory(tmp_path):
+    kwargs = dict(args={'x': {}, 'k': {}}, ret=True, output_type='df')
+    first = PyRScript('R', dict(path=tmp_path / 'a.R', code_body='res <- opt$x',
+                                ret_name='res', **kwargs))
+    second = PyRScript('R', dict(path=tmp_path / 'b.R', code_body='out <- opt$x',
+                                 ret_name='out', **kwargs))
+    body = _fused_body('R', [first.script_writer, second.script_writer], ['x'],
+                       {(0, 'x'): 'x', (0, 'k'): 'a_k', (1, 'k'): 'b_k'})
+    assert '.pyrty_step_0 <- function(opt) {' in body
+    assert ('.pyrty_result_1 <- .pyrty_step_1(list(`x` = .pyrty_result_0, '
+            '`k` = opt$b_k))') in body
+
+def test_fuse_runs_python_chain(tmp_path, monkeypatch):
+    monkeypatch.setattr(fusion._reg_manager, 'scripts', tmp_path)
+    args = {'x': {}, 'k': {}}
+    scale = _local_func(tmp_path, 'scale',
+                        'res = pyrty_read(args.x)\nres["v"] *= int(args.k)', args=args)
+    shift = _local_func(tmp_path, 'shift',
+                        'res = pyrty_read(args.x)\nres["v"] += int(args.k)', args=args)
+    fused = fusion.fuse([scale, shift])
+    assert fused.alias == 'scale__shift' and fused.args == 'x, scale_k, shift_k'
+    res = fused({'x': pd.DataFrame({'v': [1, 2]}), 'scale_k': 10, 'shift_k': 1})
+    assert res.v.tolist() == ['11', '21']
+
+    ignores_link = _local_func(tmp_path, 'ignores', 'res = args.x', args={'x': {}})
+    with pytest.raises(ValueError, match='pyrty_read'):
+        fusion.fuse([scale, ignores_link])
+
+def test_split_frame():
+    df = pd.DataFrame({'g': list('aaabbc'), 'v': range(6)})
+    assert [len(p) for p in split_frame(df, npartitions=4)] == [2, 2, 1, 1]
+    assert sorted(len(p) for p in split_frame(df, by='g')) == [1, 2, 3]
+    packed = split_frame(df, npartitions=2, by='g')
+    assert sorted(len(p) for p in packed) == [3, 3]
+    assert sum(p.g.nunique() for p in packed) == 3  # No group is split
+
+def test_resource_spec_split_and_env(monkeypatch):
+    spec = ResourceSpec(cpus=range(8), memory='8G')
+    shares = spec.split(3)
+    assert [s.cpus for s in shares] == [(0, 1), (2, 3, 4), (5, 6, 7)]
+    assert [s.n_threads for s in shares] == [2, 3, 3]
+    # A per-process limit, not divided
+    assert shares[0].memory_bytes == parse_memory('8G')
+    assert shares[0].env({})['OPENBLAS_NUM_THREADS'] == '2'
+    assert ResourceSpec().env({}) == {}
+    assert ResourceSpec().command(['Rscript', 'f.R']) == ['Rscript', 'f.R']
+    monkeypatch.setattr(resources, '_which', lambda name: f'/usr/bin/{name}')
+    assert shares[0].command(['Rscript', 'f.R']) == [
+        'taskset', '-c', '0,1', 'prlimit', f'--as={8 << 30}', '--', 'Rscript', 'f.R']
+    monkeypatch.setattr(resources, '_which', lambda name: None)
+    # Never applied late, once the process is already running
+    with pytest.raises(RuntimeError, match='needs `prlimit`'):
+        ResourceSpec(memory='1G').command(['Rscript', 'f.R'])
+    assert ResourceSpec.available().command(['Rscript', 'f.R']) == ['Rscript', 'f.R']
+
+def test_conda_env_from_prefix(tmp_path):
+    meta_dir = tmp_path / 'env' / 'conda-meta'
+    meta_dir.mkdir(parents=True)
+    (meta_dir / 'history').write_text(
+        "==> 2024-01-01 00:00:00 <==\n# update specs: ['r-base=4.3', 'numpy']\n"
+        "==> 2024-01-02 00:00:00 <==\n# remove specs: ['numpy']\n")
+    record = dict(name='r-base', version='4.3.1', build='h0',
+                  channel='https://conda.anaconda.org/conda-forge/linux-64')
+    (meta_dir / 'r-base-4.3.1-h0.json').write_text(json.dumps(record))
+    env = CondaEnv.from_prefix(tmp_path / 'env')
+    assert env.packages == {'r-base': '4.3.1'}
+    assert env.channels == ['conda-forge']
+    requested = CondaEnv.from_prefix(tmp_path / 'env', from_history=True)
+    assert requested.dependencies == ['r-base=4.3']
+    assert requested.with_blas('mkl').dependencies == ['r-base=4.3', 'libblas=*=*mkl']
+    # Cached until conda-meta changes
+    assert CondaEnv.from_prefix(tmp_path / 'env') is env
+    manager = CondaEnvManager(prefix=tmp_path / 'env', name='env')
+    assert manager.exists and manager.installed_packages == {'r-base': '4.3.1'}
+    assert not CondaEnvManager(prefix=tmp_path, name='env').exists
+
+def test_conda_env_blas_pin(tmp_path, monkeypatch):
+    env = CondaEnv('env', ['r-base=4.3', 'libblas=3.9.0=20_linux64_openblas', 'mkl'],
+                   ['defaults'])
+    assert env.blas == 'openblas'
+    pinned = env.with_blas('mkl')
+    assert pinned.dependencies == ['r-base=4.3', 'libblas=*=*mkl']
+    assert pinned.blas == 'mkl' and pinned.channels == ['defaults', 'conda-forge']
+    assert env.channels == ['defaults']
+    with pytest.raises(ValueError):
+        CondaEnvManager(name='env', blas='atlas')
+    monkeypatch.chdir(tmp_path)
+    manager = CondaEnvManager(prefix=tmp_path / 'env', name='env',
+                              dependencies=['r-base'], blas='openblas')
+    manager._process_env_specs(manager.prefix, None, 'env', manager.dependencies,
+                               manager.channels)
+    assert CondaEnv.from_yaml(manager.envfile).blas == 'openblas'
+    envfile = tmp_path / 'given.yaml'
+    env.write(envfile)
+    manager = CondaEnvManager(prefix=tmp_path / 'env', envfile=envfile, blas='blis')
+    manager._process_env_specs(manager.prefix, envfile, None, None, manager.channels)
+    assert manager.envfile.name == 'given.blis.yaml' and manager.env.blas == 'blis'
+    assert CondaEnv.from_yaml(envfile).blas == 'openblas'  # Left as given
+
+def test_batch_executor_with_fake_sbatch(tmp_path):
+    fake_sbatch = Path(__file__).parent / 'scripts' / 'fake_sbatch.sh'
+    table = tmp_path / 'table.csv'
+    table.write_text('a,b\n1,2\n3,4\n')
+    executor = BatchExecutor(submit_cmd=f'bash {fake_sbatch}', poll_cmd=None,
+                             job_dir=tmp_path / 'jobs', poll_interval=0.05)
+    df = executor.execute(f'cat {table}', capture=True,
+                          resources=ResourceSpec(threads=2))
+    assert df.columns.tolist() == ['a', 'b'] and df.a.tolist() == ['1', '3']
+    job_script = executor.write_job_script('true', 'job',
+                                           resources=ResourceSpec(threads=2))
+    assert '#SBATCH --cpus-per-task=2' in job_script.read_text()
+    with pytest.raises(subprocess.CalledProcessError):
+        executor.execute('false', capture=True)
+
+def test_batch_jobs_read_inputs_from_job_dir(tmp_path, host_func):
+    fake_sbatch = Path(__file__).parent / 'scripts' / 'fake_sbatch.sh'
+    executor = BatchExecutor(submit_cmd=f'bash {fake_sbatch}', poll_cmd=None,
+                             job_dir=tmp_path / 'jobs', poll_interval=0.05)
+    func = host_func('where', 'res = pyrty_read(args.x)\nres["path"] = args.x',
+                     args={'x': {}}, executor=executor)
+    input_path = Path(func({'x': pd.DataFrame({'v': [1]})}).path[1])
+    # Visible from compute nodes
+    assert input_path.parent.parent == tmp_path / 'jobs' / 'runs'
+    assert not input_path.parent.exists()  # Removed once the job is done
+
+def _local_func(tmp_path, alias, code, args=None):
+    return host_function(alias, code, args=args, script_dir=tmp_path)
+
+@pytest.fixture
+def host_func(tmp_path):
+    """Builds `PyRFunc`s whose Python scripts run on the host, see `host_function`."""
+    def make(alias, code, args=None, executor=None):
+        func = _local_func(tmp_path, alias, code, args=args)
+        if executor is not None:
+            func.set_executor(executor)
+        return func
+    return make
+
+def test_fork_server_isolates_calls(tmp_path):
+    func = _local_func(tmp_path, 'scale', 'import os\nres = pyrty_read(args.x)\n'
+                       'res["y"] = res.v * args.k\nres["pid"] = os.getpid()',
+                       args={'x': {}, 'k': {}})
+    df = pd.DataFrame({'v': [1, 2, 3]})
+    with ForkServer(func) as server:
+        futures = [server.submit({'x': df, 'k': k}) for k in range(3)]
+        results = [future.result(timeout=60) for future in futures]
+        assert results[2].y.tolist() == [2, 4, 6]
+        assert len({res.pid[0] for res in results} | {server.pid}) == 4
+    broken = _local_func(tmp_path, 'broken', 'res = 1 / 0')
+    with ForkServer(broken) as server:
+        with pytest.raises(WorkerError, match='ZeroDivisionError'):
+            server.call()
+
+def test_fork_server_fails_calls_whose_child_dies(tmp_path):
+    code = ('import os, signal, sys, time\n'
+            'if args.how == "kill": os.kill(os.getpid(), signal.SIGKILL)\n'
+            'if args.how == "exit": sys.exit(3)\n'
+            'if args.how == "sleep": time.sleep(60)\n'
+            'res = pd.DataFrame({"v": [1]})')
+    func = _local_func(tmp_path, 'crashy', 'import pandas as pd\n' + code,
+                       args={'how': {}})
+    with ForkServer(func) as server:
+        with pytest.raises(WorkerError, match='killed by signal 9'):
+            server.submit({'how': 'kill'}).result(timeout=30)
+        with pytest.raises(WorkerError, match='SystemExit'):
+            server.call({'how': 'exit'})
+        with pytest.raises(TimeoutError):
+            server.call({'how': 'sleep'}, timeout=0.5)
+        assert server.call({'how': 'ok'}).v.tolist() == [1]  # The server is unaffected
+
+def test_fork_server_answers_clean_calls_once(tmp_path, monkeypatch):
+    done = []
+    dispatch = ForkServer._dispatch
+    def record(self, msg):
+        if msg[0] == 'DONE':
+            done.append(msg[1])
+        dispatch(self, msg)
+    monkeypatch.setattr(ForkServer, '_dispatch', record)
+    func = _local_func(tmp_path, 'clean', 'import pandas as pd\n'
+                       'res = pd.DataFrame({"v": [1]})')
+    with ForkServer(func) as server:
+        for __ in range(3):
+            assert server.call().v.tolist() == [1]
+        time.sleep(0.5)  # Give the server time to reap the last child
+    assert len(done) == len(set(done)) >= 3  # One DONE per request, calls included
+
+def test_lazy_result_is_memory_mapped_and_released(tmp_path):
+    df = pd.DataFrame({'a': range(5), 'b': list('vwxyz')})
+    path = write_frame(df, tmp_path / 'res.arrow')
+    with LazyResult(path) as res:
+        assert res.num_rows == 5
+        assert res.dataset().to_table(columns=['b']).column('b').to_pylist()[0] == 'v'
+        assert res.to_pandas(columns=['a']).a.sum() == 10
+    assert res.released and not path.exists()
+    with pytest.raises(ValueError):
+        res.dataset()
+
+def test_file_ref_pushes_down_projection_and_filters(tmp_path):
+    df = pd.DataFrame({'g': list('aabbc'), 'v': range(5), 'w': [0.5] * 5})
+    df.to_parquet(tmp_path / 'data.parquet', index=False)
+    df.to_parquet(tmp_path / 'ds', partition_cols=['g'], index=False)
+    helpers = {}
+    exec(PyScriptWriter._io_helpers, helpers)
+
+    plain = FileRef(tmp_path / 'data.parquet')
+    assert plain.resolve(tmp_path, 'x') == plain.path  # Passed straight through
+    ref = FileRef(tmp_path / 'data.parquet', columns=['g', 'v'],
+                  filters=[('v', '>=', 1), ('g', 'in', ['a', 'c'])])
+    res = helpers['pyrty_read'](str(ref.resolve(tmp_path, 'x')))
+    assert res.columns.tolist() == ['g', 'v'] and res.v.tolist() == [1, 4]
+    ref = DatasetRef(tmp_path / 'ds', filters=[('g', '==', 'b')])
+    res = helpers['pyrty_read'](str(ref.resolve(tmp_path)))
+    assert sorted(res.v) == [2, 3]
+    with pytest.raises(ValueError):
+        FileRef(tmp_path / 'data.parquet', filters=[('v', '~', 1)])
+
+def test_sink_writes_result_to_destination(tmp_path, host_func):
+    func = host_func('double', 'res = pyrty_read(args.x)\nres["v"] *= 2',
+                     args={'x': {}})
+    df = pd.DataFrame({'v': range(10)})
+
+    res = func({'x': df}, sink=tmp_path / 'out' / 'res.parquet', compression='zstd')
+    assert (res.rows, res.path.name) == (10, 'res.parquet') and res.bytes > 0
+    column = pq.ParquetFile(res.path).metadata.row_group(0).column(0)
+    assert column.compression == 'ZSTD'
+    res = func({'x': df}, sink=tmp_path / 'res.csv.gz')
+    assert res.rows == 10 and pd.read_csv(res).v.sum() == 90
+    for name in ['res.arrow', 'res.csv']:
+        with pytest.raises(ValueError, match='compression'):
+            func({'x': df}, sink=tmp_path / name, compression='zstd')
+    # Partial files moved
+    assert not any(p.name.startswith('.pyrty') for p in tmp_path.iterdir())
+
+def test_compact_dtypes_shrinks_captured_strings():
+    n = 400
+    df = pd.DataFrame({
+        'count': [str(i % 100) for i in range(n)],
+        'score': [str(i / 4) if i % 3 else 'NA' for i in range(n)],
+        'maybe': [str(i) if i % 2 else 'NA' for i in range(n)],
+        'flag': ['TRUE', 'FALSE'] * (n // 2),
+        'group': list('abcd') * (n // 4),
+        'day': [f'2024-01-0{i % 9 + 1}' for i in range(n)],
+        'id': [f'{i:04d}' for i in range(n)],
+    }, dtype=object)
+    compact = compact_dtypes(df)
+    assert compact.drop(columns='day').dtypes.astype(str).to_dict() == {
+        'count': 'uint8', 'score': 'float32', 'maybe': 'Int16', 'flag': 'boolean',
+        'group': 'category', 'id': 'object'}
+    assert pd.api.types.is_datetime64_any_dtype(compact.day)
+    assert memory_usage(compact) < memory_usage(df) / 2
+    metadata = CallMetadata()
+    assert materialize(df, 'pyarrow', metadata=metadata).num_rows == n
+    assert metadata.memory.before == memory_usage(df)
+    assert metadata.memory.after < metadata.memory.before
+
+def test_session_keeps_objects_resident(tmp_path):
+    load = _local_func(tmp_path, 'load', 'res = pyrty_read(args.x)\nres["loads"] = 1',
+                       args={'x': {}})
+    scale = _local_func(tmp_path, 'scale', 'res = args.x.assign(v=args.x.v * args.k)',
+                        args={'x': {}, 'k': {}})
+    with Session(HostEnv(), lang='python') as session:
+        session.run(load, {'x': pd.DataFrame({'v': [1, 2, 3]})}, store_as='data',
+                    output=False)
+        assert 'data' in session
+        res = session.run(scale, {'x': session['data'], 'k': 10})
+        assert res.v.tolist() == [10, 20, 30]
+        session.put('more', pd.DataFrame({'v': [4]}))
+        session.run(scale, {'x': session['more'], 'k': 2}, store_as='scaled',
+                    output=False)
+        assert session.get('scaled').v.tolist() == [8]
+        session.drop('more')
+        with pytest.raises(WorkerError, match='KeyError'):
+            session.get('more')
+
+def test_object_store_refcounts_and_evicts(tmp_path):
+    df = pd.DataFrame({'v': range(1000)})
+    store = ObjectStore(tmp_path / 'store', budget=3 * 8000)
+    first = store.put(df, key='first')
+    shared = store.put(None, key='first')  # Shares the entry, nothing is written
+    assert store.refcount(first) == 2 and first.path == shared.path
+    assert store.get(shared).v.sum() == df.v.sum()
+    store.release(first)
+    store.release(first)  # Releasing twice drops only one reference
+    assert store.refcount(shared) == 1
+    del shared
+    gc.collect()
+    # Over budget: the unreferenced entry goes first
+    refs = [store.put(df) for __ in range(3)]
+    assert 'first' not in {p.stem for p in (tmp_path / 'store').iterdir()}
+    assert all(ref in store for ref in refs)
+
+def test_incremental_reruns_only_changed_groups(tmp_path):
+    func = _fake_func(tmp_path, 'inc')
+    df = pd.DataFrame({'day': [1, 1, 2, 3], 'v': [0, 1, 2, 3]})
+    res = map_incremental(func, df, 'x', by='day', cache_dir=tmp_path / 'cache',
+                          format='csv')
+    assert res.v.tolist() == [1, 2, 3, 4] and func.run_manager.calls == 3
+
+    grown = pd.concat([df.assign(v=df.v.where(df.day != 3, 10)),
+                       pd.DataFrame({'day': [4], 'v': [5]})])
+    res = map_incremental(func, grown, 'x', by='day', cache_dir=tmp_path / 'cache',
+                          format='csv', prune=True)
+    assert res.v.tolist() == [1, 2, 3, 11, 6]
+    assert func.run_manager.calls == 5  # Only the changed day 3 and the new day 4
+    assert len(list((tmp_path / 'cache').iterdir())) == 4
+
+    map_incremental(func, df, 'x', by='day', cache_dir=tmp_path / 'cache',
+                    format='csv', k=1)
+    map_incremental(func, grown, 'x', by='day', cache_dir=tmp_path / 'cache',
+                    format='csv', prune=True)
+    assert func.run_manager.calls == 8  # Other arguments are cached separately
+    assert len(list((tmp_path / 'cache').iterdir())) == 7  # and not pruned
+
+def test_embedded_executor_falls_back_for_other_languages(host_func):
+    func = host_func('double', 'res = pyrty_read(args.x)\nres["v"] *= 2',
+                     args={'x': {}})
+    func.set_executor('embedded')
+    assert not func.run_manager.executor.supports(func.run_manager)
+    assert func({'x': pd.DataFrame({'v': [1]})}).v.tolist() == ['2']
+
+    stats = compare_executors(func, {'x': pd.DataFrame({'v': [1]})}, n=2, warmup=0)
+    assert stats.index.tolist() == ['local', 'embedded (fallback)']
+    assert (stats.n == 2).all()
+    assert type(func.run_manager.executor).__name__ == 'EmbeddedRExecutor'  # Restored
+
+def test_embedded_executor_matches_subprocess_results(tmp_path):
+    pytest.importorskip('rpy2.robjects')
+    if shutil.which('R') is None:
+        pytest.skip('R is not installed')
+    r_home = subprocess.run(['R', 'RHOME'], capture_output=True, text=True).stdout
+    prefix = Path(r_home.strip()).parent.parent
+    if find_r_home(prefix) is None:
+        pytest.skip('R has no shared library to embed')
+    code = 'res <- pyrty_read(opt$x)\nres$v <- res$v * opt$k'
+    func = host_function('scale', code, lang='R', libs=['optparse', 'readr'],
+                         args={'x': {}, 'k': {'type': "'integer'"}},
+                         script_dir=tmp_path)
+    func.env = func.run_manager.env = SimpleNamespace(
+        prefix=prefix, find_exe=shutil.which, env_exists=True,
+        get_run_in_env_cmd=lambda cmd: cmd)
+    input = {'x': pd.DataFrame({'v': [1, 2]}), 'k': 3}
+    expected = func(input)
+    func.set_executor('embedded')
+    assert func.run_manager.executor.supports(func.run_manager)
+    pd.testing.assert_frame_equal(func(input), expected)  # Same types as a subprocess
+
+def test_embedded_converts_scalars_by_declared_or_python_type(tmp_path):
+    names = ['StrVector', 'IntVector', 'FloatVector', 'BoolVector']
+    vectors = SimpleNamespace(**{name: (lambda n: lambda values: (n, values))(name)
+                                 for name in names})
+    ro = SimpleNamespace(vectors=vectors)
+
+    def to_r(value, r_type=None):
+        return EmbeddedRExecutor._to_r(ro, value, tmp_path, 'x', r_type)
+
+    assert to_r(3) == ('IntVector', [3]) and to_r(2.5) == ('FloatVector', [2.5])
+    assert to_r(True) == ('BoolVector', [True]) and to_r('a') == ('StrVector', ['a'])
+    assert to_r('3', "'integer'") == ('IntVector', [3])
+    assert to_r(3, "'double'") == ('FloatVector', [3.0])
+    assert to_r('TRUE', "'logical'") == ('BoolVector', [True])
+    assert to_r(3, "'character'") == ('StrVector', ['3'])
+
+@pytest.mark.parametrize('mode', ['thread', 'process'])
+def test_inprocess_executor_passes_objects(tmp_path, host_func, mode):
+    code = ('import sys\nres = pyrty_read(args.x)\nres["v"] *= int(args.k)\n'
+            'res["path"] = sys.path[0]')
+    func = host_func('double', code, args={'x': {}, 'k': {}},
+                     executor=InProcessExecutor(mode, typed=True))
+    assert func.run_manager.executor.supports(func.run_manager)
+    df = pd.DataFrame({'v': [1, 2]})
+    res = func({'x': df, 'k': 3})
+    assert res.v.tolist() == [3, 6]  # Typed: not round-tripped through CSV strings
+    assert df.v.tolist() == [1, 2]
+    if mode == 'process':  # The env's site-packages come first
+        assert res.path[0] in python_info(func.env.find_exe('python'))[2]
+    assert func({'x': df, 'k': 2}, sink=tmp_path / 'out.parquet').rows == 2
+    func.run_manager.executor.shutdown()
+
+    func.set_executor('local')
+    expected = func({'x': df, 'k': 3}).drop(columns='path')
+    func.set_executor(InProcessExecutor(mode))
+    res = func({'x': df, 'k': 3}).drop(columns='path')
+    pd.testing.assert_frame_equal(res, expected)  # Same types as a subprocess run
+    func.run_manager.executor.shutdown()
+
+def test_inprocess_threads_do_not_share_compression(tmp_path, host_func):
+    func = host_func('copy', 'import time\ntime.sleep(0.2)\nres = pyrty_read(args.x)',
+                     args={'x': {}}, executor=InProcessExecutor('thread'))
+    df = pd.DataFrame({'v': [1, 2]})
+
+    def call(codec):
+        path = tmp_path / f'{codec}.parquet'
+        func({'x': df}, sink=path, compression=codec)
+        return pq.ParquetFile(path).metadata.row_group(0).column(0).compression
+
+    with ThreadPoolExecutor(2) as pool:
+        assert list(pool.map(call, ['zstd', 'gzip'])) == ['ZSTD', 'GZIP']
+    assert 'PYRTY_COMPRESSION' not in os.environ
+    func.run_manager.executor.shutdown()
+
+def test_concurrent_calls_are_isolated(tmp_path, host_func):
+    n = 16
+    code = 'res = pyrty_read(args.x)\nres["v"] *= 2\nres["path"] = args.x'
+    func = host_func('double', code, args={'x': {}})
+
+    def call(i):
+        res = func({'x': pd.DataFrame({'v': [i] * 1000})})
+        return res.v.astype(int).unique().tolist(), res.path.unique().tolist()
+
+    with ThreadPoolExecutor(n) as pool:
+        results = list(pool.map(call, range(n)))
+    assert [values for values, __ in results] == [[2 * i] for i in range(n)]
+    paths = [Path(path) for __, (path,) in results]  # One input file per call
+    assert len({path.parent for path in paths}) == n  # Each call has its own run dir
+    assert not any(path.parent.exists() for path in paths)  # Removed once done
+
+    sleeper = host_function('sleeper', 'sleep 0.25\necho v\necho 1', lang='shell',
+                            script_dir=tmp_path)
+    start = time.perf_counter()
+    for __ in range(n):
+        sleeper()
+    serial_time = time.perf_counter() - start
+    start = time.perf_counter()
+    with ThreadPoolExecutor(n) as pool:
+        assert all(len(res) == 1 for res in pool.map(lambda __: sleeper(), range(n)))
+    concurrent_time = time.perf_counter() - start
+    # The scripts' sleeps overlap, even on a single CPU
+    assert concurrent_time < serial_time / 2
+
+def test_daemon_serves_calls_over_unix_socket(tmp_path, host_func):
+    func = host_func('double', 'res = pyrty_read(args.x)\nres["v"] *= int(args.k)',
+                     args={'x': {}, 'k': {}})
+    broken = _local_func(tmp_path, 'broken', 'res = 1 / 0')
+    socket_path = tmp_path / 'pyrty.sock'
+    assert DaemonClient.connect(socket_path) is None
+    funcs = {'double': func, 'broken': broken}
+    with PyRDaemon(socket_path, aliases=['double'], funcs=funcs) as daemon:
+        client = DaemonClient.connect(socket_path)
+        assert client.ping()['aliases'] == ['broken', 'double']
+        res = client.call('double', {'x': pd.DataFrame({'v': [1, 2]}), 'k': 3})
+        assert res.v.tolist() == [3, 6]
+        dead = daemon._servers['double']
+        dead._proc.kill()
+        dead._proc.wait()
+        res = client.call('double', {'x': pd.DataFrame({'v': [1]}), 'k': 3})
+        # A dead fork-server is closed, and replaced
+        assert res.v.tolist() == [3] and dead._proc is None
+        with pytest.raises(DaemonError, match='ZeroDivisionError'):
+            client.call('broken')
+
+        input = {'x': pd.DataFrame({'v': [5]}), 'k': 2}
+        expected = func(input)
+        assert func.use_daemon(socket_path)
+        # Same types as a local run
+        pd.testing.assert_frame_equal(func(input), expected)
+        assert func._routable(None) and not func._routable(ResourceSpec(threads=1))
+        func.set_executor('local')
+        assert not func._routable(None)  # Calls needing a given backend stay local
+    assert not socket_path.exists()
+
+def test_worker_pool_scales_and_recycles(tmp_path):
+    local = _local_func(tmp_path, 'slow',
+                        'import os, time\ntime.sleep(0.5)\nres = pyrty_read(args.x)\n'
+                        'res["pid"] = os.getpid()', args={'x': {}})
+    assert process_rss(os.getpid()) > 0
+    with WorkerPool(local, min_workers=1, max_workers=2, max_calls=2,
+                    idle_timeout=0.5) as pool:
+        futures = [pool.submit({'x': pd.DataFrame({'v': [i]})}) for i in range(6)]
+        results = [future.result(timeout=120) for future in futures]
+        assert [res.v[0] for res in results] == list(range(6))
+        # Two workers, recycled every 2 calls
+        assert len({res.pid[0] for res in results}) >= 3
+        metrics = pool.metrics()
+        assert metrics['calls'] == 6 and metrics['errors'] == 0
+        assert metrics['scale_ups'] == 2 and metrics['recycled'] >= 2
+        deadline = time.time() + 10
+        while pool.metrics()['workers'] > 1 and time.time() < deadline:
+            time.sleep(0.1)
+        assert pool.metrics()['workers'] == 1  # Back to min_workers once idle
+        assert [d.action for d in pool.decisions][:2] == ['scale_up', 'scale_up']
+        assert 'scale_down' in [d.action for d in pool.decisions]
+
+def test_prewarm_touches_libs_and_loads_libraries(tmp_path):
+    (tmp_path / 'env' / 'lib' / 'R' / 'lib').mkdir(parents=True)
+    (tmp_path / 'env' / 'lib' / 'R' / 'lib' / 'libR.so').write_bytes(b'\0' * 3000)
+    (tmp_path / 'env' / 'lib' / 'libz.so.1').write_bytes(b'\0' * 100)
+    assert touch_shared_libs(tmp_path / 'env') == 3100
+    env = SimpleNamespace(prefix=tmp_path / 'env', find_exe=shutil.which,
+                          get_run_in_env_cmd=lambda cmd: cmd)
+    script = PyRScript('python', dict(path=tmp_path / 'f.py', code_body='res = 1',
+                                      libs=['json']))
+    func = SimpleNamespace(alias='f', env=env, script=script)
+    assert prewarm(func).result(timeout=60) > 0
+    script = PyRScript('python', dict(path=tmp_path / 'g.py', code_body='res = 1',
+                                      libs=['no_such_lib']))
+    with pytest.raises(subprocess.CalledProcessError):
+        prewarm(SimpleNamespace(alias='g', env=env, script=script)).result(timeout=60)
+
+def test_calls_record_resource_usage(host_func, call_history):
+    func = host_func('usage',
+                     'res = pyrty_read(args.x)\nres["w"] = sum(range(10 ** 6))',
+                     args={'x': {}})
+    res = func({'x': pd.DataFrame({'v': range(100)})})
+    metadata = res.attrs['pyrty']
+    assert metadata.returncode == 0 and metadata.cpu_time > 0
+    assert metadata.max_rss > 1 << 20
+    assert metadata.bytes_in > 0 and metadata.bytes_out > 0 and metadata.duration > 0
+    lazy = func({'x': pd.DataFrame({'v': range(100)})}, spill=True)
+    assert lazy.metadata.bytes_out == lazy.path.stat().st_size
+    lazy.release()
+    totals = func.usage()
+    assert totals['calls'] == 2 and totals['failures'] == 0
+    assert totals['max_rss'] == max(metadata.max_rss, lazy.metadata.max_rss)
+    assert usage_log.summary().loc['usage', 'mean_duration'] > 0
+    assert func.stats().loc['usage', 'calls'] == 2
+    func.history = None
+    func({'x': pd.DataFrame({'v': range(100)})})
+    assert call_history.stats('usage').loc['usage', 'calls'] == 2
+    compact = func({'x': pd.DataFrame({'v': range(100)})}, compact=True)
+    assert compact.attrs['pyrty'].memory.ratio < 1
+
+def test_call_history_and_latency_stats(tmp_path):
+    db = DBManager(db_dir=tmp_path)
+    for i in range(100):
+        metadata = CallMetadata('f', duration=(i + 1) / 100, returncode=0,
+                                phases={'execute': 0.001})
+        db.record_call('f', metadata, started=1000.0 + 36 * i,
+                       script_version=f'f_v{1 + i // 50}.R', failed=i == 99)
+    stats = db.stats('f')
+    assert stats.loc['f', 'calls'] == 100 and stats.loc['f', 'failures'] == 1
+    assert stats.loc['f', 'p50'] == pytest.approx(0.505)
+    assert stats.loc['f', 'p99'] == pytest.approx(0.9901)
+    hourly = db.stats('f', window='1h')
+    assert hourly.calls.tolist() == [73, 27]  # Calls every 36s from 1000s
+    assert hourly.throughput.iloc[0] == pytest.approx(hourly.calls.iloc[0] / 3600)
+    versions = db.stats('f', by_version=True)
+    assert versions.p50.loc['f_v2.R'] > versions.p50.loc['f_v1.R']
+    assert db.stats('f', since='1d').empty
+    assert db.history.records('f').execute.iloc[0] == 0.001
+
+def test_call_history_is_shared_and_bounded(tmp_path):
+    db = DBManager(db_dir=tmp_path)
+    assert DBManager(db_dir=tmp_path).history is db.history
+    db.history.max_rows = 10
+    for i in range(25):
+        db.record_call('f', CallMetadata('f', duration=0.1), started=float(i))
+    assert db.history.records('f').started.tolist() == [float(i) for i in range(15, 25)]
+
+def test_load_test_reports_latency_errors_and_memory(tmp_path, call_history):
+    func = local_function('shell', tmp_path)
+    assert func(local_input('shell')).columns.tolist() == ['v', 'w']
+    report = run_load(func, concurrency=2, duration=None, requests=6,
+                      sample_interval=0.05)
+    assert call_history.stats('loadtest-shell').calls.tolist() == [1]  # Not the load
+    assert func.history is call_history
+    summary = report.summary()
+    assert summary['requests'] == 6 and summary['errors'] == 0
+    assert summary['throughput'] > 0 and summary['p50'] <= summary['p99']
+    assert report.histogram(bins=5)['count'].sum() == 6
+    assert len(report.memory) >= 2 and report.memory.parent_rss.gt(0).all()
+    report.write(tmp_path / 'report')
+    assert {p.name for p in (tmp_path / 'report').iterdir()} == {
+        'summary.json', 'calls.csv', 'memory.csv', 'histogram.csv', 'report.txt'}
+
+    def flaky(input, calls=[]):
+        calls.append(1)
+        if len(calls) % 2:
+            raise RuntimeError('flaky')
+    df = sweep(flaky, concurrencies=[1, 2], rate=50, duration=0.2,
+               out=tmp_path / 'sweep')
+    assert df.index.tolist() == [1, 2] and (df.error_rate > 0.3).all()
+    assert (tmp_path / 'sweep' / 'sweep.csv').exists()
+
+    script_dir = local_function('shell').script.script_writer.path.parent
+    gc.collect()
+    assert not script_dir.exists()  # Removed with the function